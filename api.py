@@ -0,0 +1,148 @@
+import numpy as np
+
+from density import dbscan_labels, enforce_constraints, optics_labels
+from greedy import assign_clusters
+from neighbors import latlon_radius_graph
+from refine import merge_clusters
+from tiling import cluster_tiles
+
+# API importable (sans effet de bord) : tableaux LAT/LON/PIR en entrée, labels en sortie.
+# Même numérotation que les scripts : BallTree et OPTICS à partir de 1, DBSCAN à partir de 0.
+#
+#   from api import cluster
+#   labels = cluster('balltree', lats, lons, pirs, max_pir=4000)
+#
+# backend='kdtree' : voisins par KD-tree sur vecteurs unitaires 3D (mêmes voisins que le
+# BallTree haversine, voir neighbors.ChordKDTree) ; DBSCAN/OPTICS passent alors par le
+# graphe creux précalculé.
+#
+# WarmDataset garde les données et les structures coûteuses (graphe de voisinage,
+# labels DBSCAN/OPTICS bruts, qui ne dépendent pas du PIR) en mémoire entre les appels.
+
+RADIUS_KM = 45
+ALGORITHMS = ('balltree', 'dbscan', 'optics')
+FIRST_LABEL = {'balltree': 1, 'dbscan': 0, 'optics': 1}
+
+
+def _check_algorithm(algorithm):
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Algorithme inconnu: {algorithm} (attendu: {', '.join(ALGORITHMS)})")
+
+
+def _coords(lats, lons):
+    return np.radians(np.column_stack((lats, lons)))
+
+
+def cluster_balltree(lats, lons, pirs, max_pir, radius_km=RADIUS_KM, workers=1, graph=None, metrics=None,
+                     dynamic_seeds=False, backend="balltree"):
+    if graph is None:
+        graph = latlon_radius_graph(lats, lons, radius_km, workers=workers, backend=backend)
+    return assign_clusters(lats, lons, pirs, graph, max_pir, radius_km, metrics=metrics,
+                           dynamic_seeds=dynamic_seeds)
+
+
+def cluster_dbscan(lats, lons, pirs, max_pir, radius_km=RADIUS_KM, precomputed=False, workers=1,
+                   raw_labels=None, metrics=None, backend="balltree"):
+    coords = _coords(lats, lons)
+    if raw_labels is None:
+        raw_labels = dbscan_labels(coords, radius_km, min_samples=2, precomputed=precomputed or backend == "kdtree",
+                                   workers=workers, backend=backend)
+    return enforce_constraints(raw_labels, coords, np.asarray(pirs), max_pir, radius_km,
+                               first_label=FIRST_LABEL['dbscan'], metrics=metrics, workers=workers)
+
+
+def cluster_optics(lats, lons, pirs, max_pir, radius_km=RADIUS_KM, precomputed=False, workers=1,
+                   raw_labels=None, metrics=None, backend="balltree"):
+    coords = _coords(lats, lons)
+    if raw_labels is None:
+        raw_labels = optics_labels(coords, min_samples=2, xi=0.05, precomputed=precomputed or backend == "kdtree",
+                                   radius_km=radius_km, workers=workers, backend=backend)
+    return enforce_constraints(raw_labels, coords, np.asarray(pirs), max_pir, radius_km,
+                               first_label=FIRST_LABEL['optics'], metrics=metrics, workers=workers)
+
+
+def cluster(algorithm, lats, lons, pirs, max_pir, radius_km=RADIUS_KM, workers=1, tile_km=0, precomputed=False,
+            merge=False, backend="balltree"):
+    # merge : fusion des clusters voisins en fin de traitement (refine.merge_clusters)
+    _check_algorithm(algorithm)
+    lats, lons, pirs = np.asarray(lats), np.asarray(lons), np.asarray(pirs)
+    if tile_km:
+        labels = cluster_tiles(lats, lons, pirs, algorithm, max_pir, radius_km, tile_km, workers=workers,
+                               first_label=FIRST_LABEL[algorithm], precomputed=precomputed, backend=backend)
+    elif algorithm == 'balltree':
+        labels = cluster_balltree(lats, lons, pirs, max_pir, radius_km, workers=workers, backend=backend)
+    elif algorithm == 'dbscan':
+        labels = cluster_dbscan(lats, lons, pirs, max_pir, radius_km, precomputed=precomputed, workers=workers,
+                                backend=backend)
+    else:
+        labels = cluster_optics(lats, lons, pirs, max_pir, radius_km, precomputed=precomputed, workers=workers,
+                                backend=backend)
+    if merge:
+        labels = merge_clusters(labels, lats, lons, pirs, max_pir, radius_km,
+                                constraint='rayon' if algorithm == 'balltree' else 'diametre',
+                                first_label=FIRST_LABEL[algorithm])
+    return labels
+
+
+class WarmDataset:
+    # Jeu de données chargé une fois ; chaque appel à labels() ne refait que l'étape
+    # qui dépend du PIR (assignation BallTree, post-traitement DBSCAN/OPTICS).
+    # Les derniers résultats sont mémorisés par (algorithme, max_pir).
+
+    def __init__(self, lats, lons, pirs, radius_km=RADIUS_KM, workers=1, precomputed=False, max_results=32,
+                 backend="balltree"):
+        self.lats = np.asarray(lats)
+        self.lons = np.asarray(lons)
+        self.pirs = np.asarray(pirs)
+        self.radius_km = radius_km
+        self.workers = workers
+        self.precomputed = precomputed or backend == "kdtree"
+        self.backend = backend
+        self.max_results = max_results
+        self.graph = None
+        self.raw = {}
+        self.results = {}
+
+    def __len__(self):
+        return len(self.pirs)
+
+    def prepare(self, algorithm):
+        # Construit la structure coûteuse de l'algorithme si ce n'est pas déjà fait
+        _check_algorithm(algorithm)
+        if algorithm == 'balltree':
+            if self.graph is None:
+                self.graph = latlon_radius_graph(self.lats, self.lons, self.radius_km, workers=self.workers,
+                                                 backend=self.backend)
+        elif algorithm not in self.raw:
+            coords = _coords(self.lats, self.lons)
+            if algorithm == 'dbscan':
+                self.raw[algorithm] = dbscan_labels(coords, self.radius_km, min_samples=2,
+                                                    precomputed=self.precomputed, workers=self.workers,
+                                                    backend=self.backend)
+            else:
+                self.raw[algorithm] = optics_labels(coords, min_samples=2, xi=0.05, precomputed=self.precomputed,
+                                                    radius_km=self.radius_km, workers=self.workers,
+                                                    backend=self.backend)
+
+    def ready(self):
+        return [a for a in ALGORITHMS if (self.graph is not None if a == 'balltree' else a in self.raw)]
+
+    def labels(self, algorithm, max_pir):
+        key = (algorithm, float(max_pir))
+        if key in self.results:
+            self.results[key] = self.results.pop(key)  # plus récemment utilisé en dernier
+            return self.results[key]
+        self.prepare(algorithm)
+        if algorithm == 'balltree':
+            labels = cluster_balltree(self.lats, self.lons, self.pirs, max_pir, self.radius_km, graph=self.graph)
+        elif algorithm == 'dbscan':
+            labels = cluster_dbscan(self.lats, self.lons, self.pirs, max_pir, self.radius_km,
+                                    raw_labels=self.raw[algorithm])
+        else:
+            labels = cluster_optics(self.lats, self.lons, self.pirs, max_pir, self.radius_km,
+                                    raw_labels=self.raw[algorithm])
+        labels.setflags(write=False)
+        self.results[key] = labels
+        while len(self.results) > self.max_results:
+            del self.results[next(iter(self.results))]
+        return labels
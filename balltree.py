@@ -1,148 +1,265 @@
 import pandas as pd
 import numpy as np
-from sklearn.neighbors import BallTree
 import time
-import sys
+import argparse
+import os
+
+from cache import CACHE_DIR, CACHE_MAX_MB, cached_radius_graph
+from checkpoint import CHECKPOINT_DIR, CHECKPOINT_INTERVAL_S, Checkpoint
+from dataset import load_points
+from export import write_compact
+from greedy import assign_clusters, assign_clusters_parallel, assign_clusters_sweep
+from metrics import Metrics
+from neighbors import NEIGHBOR_BACKENDS, build_radius_graph, default_workers, neighbor_tree
+from refine import merge_clusters
+from tiling import cluster_tiles
 
 print("\n\n\n###################################################################")
 print("#                     Clustering avec BallTree                    #")
 print("################################################################### \n\n\n")
 
-if len(sys.argv) != 2:
+parser = argparse.ArgumentParser(description="Clustering avec BallTree")
+parser.add_argument("max_pir", nargs="?", type=float, help="PIR maximal par cluster (4000 par défaut)")
+parser.add_argument("--sweep", nargs="+", type=float, metavar="PIR",
+                    help="plusieurs limites de PIR en une exécution (une colonne cluster_<PIR> par limite)")
+parser.add_argument("--entree", default="generated.csv",
+                    help="données d'entrée : CSV, .parquet ou répertoire .npy (voir dataset.py)")
+parser.add_argument("--workers", type=int, default=default_workers(),
+                    help="nombre de processus de calcul (1 par défaut sans fork)")
+parser.add_argument("--tuiles", type=float, default=0, metavar="KM",
+                    help="mode partitionné : taille des tuiles en km (0 = désactivé)")
+parser.add_argument("--graines", choices=("statique", "dynamique"), default="statique",
+                    help="ordre des graines : nombre de voisins initial (statique) ou voisins encore libres (dynamique)")
+parser.add_argument("--parallele", action="store_true",
+                    help="assignation sur --workers processus par lots de graines éloignées de plus de 2 x rayon "
+                         "(graines statiques, mêmes labels)")
+parser.add_argument("--fusion", action="store_true",
+                    help="fusionner ensuite les clusters voisins tant que rayon et PIR tiennent (voir refine.py)")
+parser.add_argument("--recherche", choices=NEIGHBOR_BACKENDS, default="balltree",
+                    help="recherche des voisins : BallTree haversine ou KD-tree sur vecteurs unitaires 3D "
+                         "(mêmes voisins, voir neighbors.py)")
+parser.add_argument("--memoire-mo", type=int, default=256, help="budget mémoire de la recherche des voisins (Mo)")
+parser.add_argument("--cache", action="store_true", help="réutiliser le graphe de voisinage stocké sur disque")
+parser.add_argument("--cache-dir", default=CACHE_DIR, help="répertoire du cache des graphes")
+parser.add_argument("--cache-max-mo", type=int, default=CACHE_MAX_MB, help="taille maximale du cache (Mo)")
+parser.add_argument("--controle", action="store_true",
+                    help="points de contrôle : graphe puis état de l'assignation sauvegardés périodiquement")
+parser.add_argument("--reprise", action="store_true",
+                    help="reprendre au dernier point de contrôle (mêmes données et paramètres, mêmes labels)")
+parser.add_argument("--controle-dir", default=CHECKPOINT_DIR, help="répertoire des points de contrôle")
+parser.add_argument("--controle-intervalle", type=float, default=CHECKPOINT_INTERVAL_S, metavar="S",
+                    help="intervalle entre deux sauvegardes de l'assignation (s)")
+parser.add_argument("--format", choices=("csv", "compact"), default="csv",
+                    help="csv : res.csv complet ; compact : répertoire labels.npy + résumé par cluster (Parquet)")
+parser.add_argument("--sortie", help="fichier (csv) ou répertoire (compact) de résultats : res.csv / res par défaut")
+parser.add_argument("--voisins", action="store_true",
+                    help="format compact : exporter aussi nb_voisins et les listes de voisins (débogage)")
+parser.add_argument("--rapport", default="rapport_balltree.json",
+                    help="rapport JSON des mesures (durée et mémoire par phase, compteurs)")
+parser.add_argument("--profil", nargs="+", default=(), metavar="PHASE",
+                    help="phases à profiler avec cProfile (arbre, voisins, assignation... ou '*')")
+args = parser.parse_args()
+if args.sweep and args.parallele:
+    parser.error("--parallele n'est pas disponible avec --sweep (le balayage répartit déjà les limites sur --workers)")
+if args.parallele and args.graines == "dynamique":
+    parser.error("--parallele n'est possible qu'avec les graines statiques")
+if (args.controle or args.reprise) and (args.sweep or args.tuiles or args.parallele):
+    parser.error("--controle/--reprise ne sont pas disponibles avec --sweep, --tuiles ou --parallele")
+sortie = args.sortie or ("res" if args.format == "compact" else "res.csv")
+mesures = Metrics("balltree", profile=args.profil)
+
+if args.sweep:
+    MAX_PIR_PER_CLUSTER = None
+elif args.max_pir is None:
     print("Usage: python balltree.py <max_pir_per_cluster>")
     print("Utilisation de la valeur 4000 par défaut\n\n")
     MAX_PIR_PER_CLUSTER = 4000.0
 else : 
-    MAX_PIR_PER_CLUSTER = float(sys.argv[1])
+    MAX_PIR_PER_CLUSTER = args.max_pir
 
 # Paramètres de clustering
 RADIUS_KM = 45  # rayon géographique de voisinage
 
-# Lecture du CSV
-dtype_dict = {
-    'LAT': np.float32,
-    'LON': np.float32,
-    'PIR': np.float32  # colonne bande passante
-}
+controle = None
+if args.controle or args.reprise:
+    try:
+        controle = Checkpoint(args.controle_dir, args.entree,
+                              dict(script="balltree", max_pir=MAX_PIR_PER_CLUSTER, rayon_km=RADIUS_KM,
+                                   graines=args.graines, recherche=args.recherche),
+                              resume=args.reprise, interval_s=args.controle_intervalle)
+    except ValueError as e:
+        parser.error(str(e))
 
 # Afficher message de progression
-print("Lecture du fichier CSV...")
-donnees = pd.read_csv("generated.csv", delimiter=",", dtype=dtype_dict)
+temps_debut = time.time()
+# Lecture des données (LAT, LON, PIR en float32 ; PIR = colonne bande passante)
+print(f"Lecture des données ({args.entree})...")
+with mesures.phase('chargement'):
+    donnees = load_points(args.entree)
 print(f"Chargement terminé: {len(donnees)} lignes")
 
-# Initialisation des colonnes
-donnees['nb_voisins'] = np.zeros(len(donnees), dtype=np.int32)
-donnees['cluster'] = np.zeros(len(donnees), dtype=np.int32)
-donnees['VID'] = [[] for _ in range(len(donnees))]
-
-# Calcul des voisins avec BallTree
-coords = np.radians(donnees[['LAT', 'LON']].values.astype(np.float32))
-print("\n\nConstruction du BallTree...")
-tree = BallTree(coords, metric='haversine', leaf_size=100)  # Leaf size augmenté pour performance
-radius = RADIUS_KM / 6371.0  # Conversion km -> radians
-
-# Traiter par lots pour éviter les interruptions de mémoire
-print("\n\nRecherche des voisins...")
-batch_size = 5000  # Ajuster selon la mémoire disponible
-num_points = len(coords)
-indices = []
-
-start_time = time.time()
-for i in range(0, num_points, batch_size):
-    end_idx = min(i + batch_size, num_points)
-    print(f"\n\nTraitement du lot {i//batch_size + 1}/{(num_points + batch_size - 1)//batch_size}: points {i} à {end_idx-1}")
-    batch_indices = tree.query_radius(coords[i:end_idx], r=radius)
-    
-    # Ajuster les indices pour correspondre à la position globale
-    for j, idx_array in enumerate(batch_indices):
-        batch_indices[j] = idx_array.astype(np.int32)
-    
-    indices.extend(batch_indices)
-    
-    # Afficher la progression
-    elapsed = time.time() - start_time
-    percent_done = end_idx / num_points
-    if percent_done > 0:
-        estimated_total = elapsed / percent_done
-        remaining = estimated_total - elapsed
-        print(f"Progression: {percent_done*100:.1f}% - Temps écoulé: {elapsed:.1f}s - Temps restant estimé: {remaining:.1f}s")
-
-print("\n\nCalcul des statistiques de voisinage...")
-donnees['nb_voisins'] = np.array([len(neighs) - 1 for neighs in indices], dtype=np.int32)  # -1 pour exclure le point lui-même
-donnees['VID'] = [list(neighs[neighs != i]) for i, neighs in enumerate(indices)]
-
-# Assignation des clusters avec contraintes
-print("\nCréation des clusters...")
-n = 1  # identifiant de cluster
-cluster_map = np.zeros(len(donnees), dtype=np.int32)
-sorted_indices = donnees['nb_voisins'].sort_values(ascending=False).index
-
-start_time = time.time()
-processed = 0
-num_to_process = len(sorted_indices)
-
-for index in sorted_indices:
-    if cluster_map[index] != 0:
-        processed += 1
-        continue  # déjà assigné
-
-    pir_initial = donnees.at[index, 'PIR']
-    lat_initial = donnees.at[index, 'LAT']
-    lon_initial = donnees.at[index, 'LON']
-
-    if pir_initial <= MAX_PIR_PER_CLUSTER:
-        cluster_members = [index]
-        total_pir = pir_initial
-        latlons = [(lat_initial, lon_initial)]
-
-        voisins = [(v, donnees.at[v, 'PIR'], donnees.at[v, 'LAT'], donnees.at[v, 'LON']) for v in donnees.at[index, 'VID'] if cluster_map[v] == 0]
-        voisins.sort(key=lambda x: x[1])  # Trie par PIR croissante
-
-        for voisin, pir_voisin, lat_voisin, lon_voisin in voisins:
-            if total_pir + pir_voisin > MAX_PIR_PER_CLUSTER:
-                continue
-            # Tentatively add the neighbor
-            temp_latlons = latlons + [(lat_voisin, lon_voisin)]
-            centroid_lat = np.mean([lat for lat, lon in temp_latlons])
-            centroid_lon = np.mean([lon for lat, lon in temp_latlons])
-            # Calculate max distance from centroid to any point
-            max_dist = 0
-            for lat, lon in temp_latlons:
-                # Haversine formula (in km)
-                lat1, lon1, lat2, lon2 = map(np.radians, [centroid_lat, centroid_lon, lat, lon])
-                dlon = lon2 - lon1
-                dlat = lat2 - lat1
-                a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-                c = 2 * np.arcsin(np.sqrt(a))
-                r = 6371
-                dist = c * r
-                if dist > max_dist:
-                    max_dist = dist
-            if max_dist <= RADIUS_KM:
-                cluster_members.append(voisin)
-                total_pir += pir_voisin
-                latlons.append((lat_voisin, lon_voisin))
+lats = donnees['LAT'].values
+lons = donnees['LON'].values
+pirs = donnees['PIR'].values
+mesures.set(entree=args.entree, lignes=len(donnees), max_pir=MAX_PIR_PER_CLUSTER, sweep=args.sweep,
+            rayon_km=RADIUS_KM, workers=args.workers, tuiles_km=args.tuiles, graines=args.graines,
+            fusion=args.fusion, parallele=args.parallele, recherche=args.recherche,
+            controle=controle is not None, reprise=args.reprise)
+
+graph = None
+if args.tuiles:
+    # Mode partitionné : tuiles + halo clusterisées en parallèle
+    print(f"\n\nClustering par tuiles de {args.tuiles:.0f} km ({args.workers} processus)...")
+    start_time = time.time()
+
+    def afficher_tuiles(done, total):
+        elapsed = time.time() - start_time
+        print(f"Tuiles traitées: {done}/{total} - Temps écoulé: {elapsed:.1f}s")
+
+    with mesures.phase('tuiles'):
+        if args.sweep:
+            resultats = []
+            for max_pir in args.sweep:
+                debut = time.time()
+                labels = cluster_tiles(lats, lons, pirs, 'balltree', max_pir, RADIUS_KM, args.tuiles,
+                                       workers=args.workers, first_label=1, progress=afficher_tuiles,
+                                       backend=args.recherche)
+                resultats.append((labels, time.time() - debut))
+        else:
+            donnees['cluster'] = cluster_tiles(lats, lons, pirs, 'balltree', MAX_PIR_PER_CLUSTER, RADIUS_KM,
+                                               args.tuiles, workers=args.workers, first_label=1,
+                                               progress=afficher_tuiles, backend=args.recherche)
+else:
+    # Calcul des voisins avec BallTree
+    def construire_graphe():
+        coords = np.radians(donnees[['LAT', 'LON']].values.astype(np.float32))
+        print(f"\n\nConstruction de l'arbre ({args.recherche})...")
+        with mesures.phase('arbre'):
+            tree = neighbor_tree(coords, args.recherche)  # BallTree : leaf size augmenté pour performance
+        radius = RADIUS_KM / 6371.0  # Conversion km -> radians
+
+        # Graphe de voisinage CSR (indptr/indices int32) construit par lots en parallèle,
+        # la taille des lots dépend du budget mémoire et de la densité locale
+        unite = "threads" if args.recherche == "kdtree" else "processus"
+        print(f"\n\nRecherche des voisins ({args.workers} {unite})...")
+        start_time = time.time()
+
+        def afficher_progression(done, total):
+            elapsed = time.time() - start_time
+            percent_done = done / total
+            remaining = elapsed / percent_done - elapsed
+            print(f"Progression: {percent_done*100:.1f}% - Temps écoulé: {elapsed:.1f}s - Temps restant estimé: {remaining:.1f}s")
+
+        with mesures.phase('voisins'):
+            return build_radius_graph(tree, coords, radius, workers=args.workers, memory_mb=args.memoire_mo,
+                                      progress=afficher_progression)
+
+    graph = controle.load_graph() if controle is not None else None
+    graphe_repris = graph is not None
+    if graphe_repris:
+        print("\n\nGraphe de voisinage repris du point de contrôle")
+    elif args.cache:
+        # Graphe réutilisé tant que les données et RADIUS_KM ne changent pas (une entrée par moteur)
+        graph, trouve = cached_radius_graph(args.entree, RADIUS_KM, NEIGHBOR_BACKENDS[args.recherche],
+                                            construire_graphe,
+                                            cache_dir=args.cache_dir, max_mb=args.cache_max_mo, metrics=mesures)
+        mesures.set(cache_trouve=trouve)
+        if trouve:
+            print("\n\nGraphe de voisinage chargé depuis le cache")
     else:
-        cluster_members = [index]
-        total_pir = pir_initial
-
-    for i in cluster_members:
-        cluster_map[i] = n
-    n += 1
-    processed += 1
-    if processed % 5000 == 0 or processed == num_to_process:
+        graph = construire_graphe()
+    if controle is not None and not graphe_repris:
+        controle.save_graph(graph)  # sortie de la phase de voisinage
+    mesures.count('aretes_graphe', graph.indptr[-1])
+
+    if args.format == "csv":
+        print("\n\nCalcul des statistiques de voisinage...")
+        donnees['nb_voisins'] = graph.degrees()
+
+    # Assignation des clusters avec contraintes
+    print("\nCréation des clusters...")
+    start_time = time.time()
+    temps_commun = start_time - temps_debut
+
+    def afficher_creation(processed, num_to_process, num_clusters):
         elapsed = time.time() - start_time
         percent_done = processed / num_to_process
         estimated_total = elapsed / percent_done
         remaining = estimated_total - elapsed
-        print(f"Création des clusters: {percent_done*100:.1f}% - Clusters créés: {n-1} - Temps restant: {remaining:.1f}s")
+        print(f"Création des clusters: {percent_done*100:.1f}% - Clusters créés: {num_clusters} - Temps restant: {remaining:.1f}s")
 
-donnees['cluster'] = cluster_map
+    def afficher_tours(assigned, num_points, rounds):
+        elapsed = time.time() - start_time
+        print(f"Création des clusters: {assigned / num_points * 100:.1f}% - Tours: {rounds} - Temps écoulé: {elapsed:.1f}s")
+
+    with mesures.phase('assignation'):
+        if args.sweep:
+            # une assignation par limite de PIR, en parallèle, sur le même graphe
+            resultats = assign_clusters_sweep(lats, lons, pirs, graph, args.sweep, RADIUS_KM,
+                                              workers=args.workers, dynamic_seeds=args.graines == "dynamique")
+        elif args.parallele:
+            # lots de graines indépendantes grossis en parallèle
+            donnees['cluster'] = assign_clusters_parallel(lats, lons, pirs, graph, MAX_PIR_PER_CLUSTER, RADIUS_KM,
+                                                          workers=args.workers, progress=afficher_tours,
+                                                          metrics=mesures)
+        else:
+            donnees['cluster'] = assign_clusters(lats, lons, pirs, graph, MAX_PIR_PER_CLUSTER, RADIUS_KM,
+                                                 progress=afficher_creation, metrics=mesures,
+                                                 dynamic_seeds=args.graines == "dynamique", checkpoint=controle)
+
+if args.fusion:
+    # Raffinement : fusion des clusters voisins sur les résumés par cluster
+    print("\nFusion des clusters voisins...")
+    with mesures.phase('fusion'):
+        if args.sweep:
+            resultats = [(merge_clusters(labels, lats, lons, pirs, max_pir, RADIUS_KM), duree)
+                         for max_pir, (labels, duree) in zip(args.sweep, resultats)]
+        else:
+            avant = donnees['cluster'].nunique()
+            donnees['cluster'] = merge_clusters(donnees['cluster'].values, lats, lons, pirs, MAX_PIR_PER_CLUSTER,
+                                                RADIUS_KM, metrics=mesures)
+            print(f"Clusters: {avant} -> {donnees['cluster'].nunique()}")
+
+if args.sweep:
+    # Une colonne de labels par limite + résumé (nombre de clusters, temps)
+    resume = []
+    for max_pir, (labels, duree) in zip(args.sweep, resultats):
+        donnees[f'cluster_{max_pir:g}'] = labels
+        resume.append({'max_pir': max_pir, 'nb_clusters': len(np.unique(labels)), 'temps_s': round(duree, 3)})
+    resume = pd.DataFrame(resume)
+    if not args.tuiles:
+        print(f"\nLecture + graphe de voisinage (commun): {temps_commun:.1f}s")
+    print("\nRésumé du balayage :")
+    print(resume.to_string(index=False))
+    # à côté de res.csv (res_sweep.csv) ou dans le répertoire compact
+    fichier_resume = (os.path.join(sortie, "sweep_resume.csv") if args.format == "compact"
+                      else os.path.splitext(sortie)[0] + "_sweep.csv")
+    os.makedirs(os.path.dirname(fichier_resume) or ".", exist_ok=True)
+    resume.to_csv(fichier_resume, index=False)
+    print(f"Résumé enregistré dans '{fichier_resume}'.")
 
 # Export des résultats
-donnees.to_csv("res.csv", sep=',', index=False)
+with mesures.phase('ecriture'):
+    if args.format == "compact":
+        meta = {'entree': os.path.abspath(args.entree), 'algorithme': 'balltree', 'rayon_km': RADIUS_KM,
+                'graines': args.graines, 'tuiles_km': args.tuiles}
+        voisins = graph if args.voisins else None
+        if args.sweep:
+            # un sous-répertoire par limite de PIR
+            for max_pir, (labels, _) in zip(args.sweep, resultats):
+                write_compact(os.path.join(sortie, f"pir_{max_pir:g}"), labels, lats, lons, pirs,
+                              meta=dict(meta, max_pir=max_pir), graph=voisins)
+        else:
+            write_compact(sortie, donnees['cluster'].values, lats, lons, pirs,
+                          meta=dict(meta, max_pir=MAX_PIR_PER_CLUSTER), graph=voisins)
+    else:
+        donnees.to_csv(sortie, sep=',', index=False)
 
-print("\n\nTraitement terminé. Résultats enregistrés dans 'res.csv'.")
+print(f"\n\nTraitement terminé. Résultats enregistrés dans '{sortie}'.")
+if not args.sweep:
+    mesures.set(nb_clusters=int(donnees['cluster'].nunique()))
+if args.rapport:
+    mesures.write(args.rapport)
 
 print("\n\n\n###################################################################")
 print("#                       fin du clustering                         #")
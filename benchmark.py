@@ -0,0 +1,302 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import CHUNK_ROWS, load_points
+from metrics import Metrics
+
+# Banc de mesure reproductible :
+# - `generer` : jeu synthétique LAT/LON/PIR (uniforme, urbain ou mixte) de 1e4 à 1e7 lignes
+# - `lancer`  : chaque algorithme sur chaque jeu, dans un processus Python neuf
+#   (pic de RSS propre à l'exécution), temps par phase et nombre de clusters
+#   ajoutés en JSON Lines à un historique (suivi des régressions dans le temps)
+# - `memoire` : outofcore.py sous plusieurs budgets --memoire-mo ; le pic de RSS
+#   doit rester sous le budget, ou l'exécution être refusée d'emblée (code de
+#   sortie 1 sinon)
+
+LAT_RANGE = (41.3, 51.1)  # France métropolitaine
+LON_RANGE = (-5.2, 9.6)
+PIR_VALUES = np.array([10, 20, 50, 100, 200, 500, 1000], dtype=np.float32)
+DISTRIBUTIONS = ('uniforme', 'urbain', 'mixte')
+ALGORITHMS = ('balltree', 'dbscan', 'optics')
+RADIUS_KM = 45
+
+
+def _urban(rng, n, num_cities):
+    # Villes de tailles très inégales (poids log-normaux), étalement de 2 à 30 km
+    centers = np.column_stack((rng.uniform(*LAT_RANGE, num_cities), rng.uniform(*LON_RANGE, num_cities)))
+    weights = rng.lognormal(0.0, 1.5, num_cities)
+    spread = rng.uniform(0.02, 0.3, num_cities)
+    city = rng.choice(num_cities, size=n, p=weights / weights.sum())
+    lat = centers[city, 0] + rng.normal(0.0, 1.0, n) * spread[city]
+    lon = centers[city, 1] + rng.normal(0.0, 1.0, n) * spread[city] / np.cos(np.radians(centers[city, 0]))
+    return np.clip(lat, -90, 90), lon
+
+
+def generate_points(n, distribution='mixte', seed=0):
+    rng = np.random.default_rng(seed)
+    if distribution == 'uniforme':
+        num_uniform = n
+    elif distribution == 'urbain':
+        num_uniform = 0
+    elif distribution == 'mixte':
+        num_uniform = n // 3
+    else:
+        raise ValueError(f"distribution inconnue: {distribution} (attendu: {', '.join(DISTRIBUTIONS)})")
+    lat_u, lon_u = rng.uniform(*LAT_RANGE, num_uniform), rng.uniform(*LON_RANGE, num_uniform)
+    lat_c, lon_c = _urban(rng, n - num_uniform, num_cities=max(10, n // 2000))
+    order = rng.permutation(n)
+    return pd.DataFrame({
+        'LAT': np.concatenate((lat_u, lat_c))[order].astype(np.float32),
+        'LON': np.concatenate((lon_u, lon_c))[order].astype(np.float32),
+        'PIR': rng.choice(PIR_VALUES, size=n),
+    })
+
+
+def write_points(df, path):
+    # Mêmes formats que dataset.load_points : .csv (par morceaux), .parquet, sinon répertoire .npy
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    elif not path.endswith('.csv'):
+        os.makedirs(path, exist_ok=True)
+        for c in df.columns:
+            np.save(os.path.join(path, f"{c}.npy"), df[c].values)
+    else:
+        for start in range(0, len(df), CHUNK_ROWS):
+            df.iloc[start:start + CHUNK_ROWS].to_csv(path, mode='w' if start == 0 else 'a',
+                                                    header=start == 0, index=False)
+
+
+def measure(algorithm, path, max_pir, workers):
+    # Exécuté dans un processus neuf : renvoie durée et mémoire par phase, compteurs,
+    # pic RSS et nombre de clusters. Les imports sont faits avant la mesure pour ne
+    # pas compter leur coût dans les phases.
+    from sklearn.neighbors import BallTree
+    from density import dbscan_labels, enforce_constraints, optics_labels
+    from greedy import assign_clusters
+    from neighbors import build_radius_graph
+
+    mesures = Metrics(algorithm)
+    with mesures.phase('chargement'):
+        df = load_points(path)
+    lats, lons, pirs = df['LAT'].values, df['LON'].values, df['PIR'].values
+
+    if algorithm == 'balltree':
+        coords = np.radians(df[['LAT', 'LON']].values.astype(np.float32))
+        with mesures.phase('arbre'):
+            tree = BallTree(coords, metric='haversine', leaf_size=100)
+        with mesures.phase('voisins'):
+            graph = build_radius_graph(tree, coords, RADIUS_KM / 6371.0, workers=workers)
+        mesures.count('aretes_graphe', graph.indptr[-1])
+        df['nb_voisins'] = graph.degrees()
+        with mesures.phase('assignation'):
+            labels = assign_clusters(lats, lons, pirs, graph, max_pir, RADIUS_KM, metrics=mesures)
+    else:
+        coords = np.radians(df[['LAT', 'LON']].values)
+        with mesures.phase('clustering'):
+            if algorithm == 'dbscan':
+                raw = dbscan_labels(coords, RADIUS_KM, min_samples=2, workers=workers)
+            else:
+                raw = optics_labels(coords, min_samples=2, xi=0.05, workers=workers)
+        with mesures.phase('post_traitement'):
+            labels = enforce_constraints(raw, coords, pirs, max_pir, RADIUS_KM,
+                                         first_label=0 if algorithm == 'dbscan' else 1, metrics=mesures,
+                                         workers=workers)
+
+    df['cluster'] = labels
+    with tempfile.TemporaryDirectory() as tmp, mesures.phase('ecriture'):
+        df.to_csv(os.path.join(tmp, "res.csv"), index=False)
+
+    report = mesures.report()
+    return {
+        'phases_s': {name: p['secondes'] for name, p in report['phases'].items()},
+        'phases_rss_pic_mb': {name: p['rss_pic_mo'] for name, p in report['phases'].items()},
+        'total_s': round(sum(p['secondes'] for p in report['phases'].values()), 4),
+        'peak_rss_mb': report['rss_pic_mo'],
+        'compteurs': report['compteurs'],
+        'nb_clusters': int(len(np.unique(labels))),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def dataset_path(data_dir, n, distribution, seed):
+    # Jeu généré une seule fois puis réutilisé
+    path = os.path.join(data_dir, f"{distribution}_{n}_s{seed}.csv")
+    if not os.path.exists(path):
+        print(f"Génération de {path}...")
+        write_points(generate_points(n, distribution, seed), path)
+    return path
+
+
+def run_suite(sizes, distributions, algorithms, max_pir, workers, data_dir, output, seed=0, timeout=None):
+    os.makedirs(data_dir, exist_ok=True)
+    commit = _git_commit()
+    results = []
+    for n in sizes:
+        for distribution in distributions:
+            path = dataset_path(data_dir, n, distribution, seed)
+            for algorithm in algorithms:
+                record = {
+                    'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'commit': commit, 'algorithme': algorithm, 'distribution': distribution,
+                    'n': n, 'seed': seed, 'max_pir': max_pir, 'workers': workers,
+                }
+                print(f"{algorithm} - {distribution} - {n} lignes...", end=" ", flush=True)
+                cmd = [sys.executable, os.path.abspath(__file__), '_mesure', algorithm, path,
+                       str(max_pir), str(workers)]
+                try:
+                    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    record['statut'] = 'timeout'
+                else:
+                    if proc.returncode == 0:
+                        record.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+                        record['statut'] = 'ok'
+                    else:
+                        record['statut'] = 'erreur'
+                        record['erreur'] = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ''
+                if record['statut'] == 'ok':
+                    pic = "pic RSS indisponible" if record['peak_rss_mb'] is None else f"{record['peak_rss_mb']:.0f} Mo"
+                    print(f"{record['total_s']:.2f}s - {pic} - {record['nb_clusters']} clusters")
+                else:
+                    print(record['statut'])
+                with open(output, 'a') as f:
+                    f.write(json.dumps(record) + "\n")
+                results.append(record)
+    return results
+
+
+def run_memory_suite(sizes, distributions, algorithms, budgets, max_pir, data_dir, output, seed=0,
+                     precomputed=False, timeout=None):
+    # outofcore.py dans un processus neuf par budget : statut 'ok' (pic <= budget),
+    # 'refus' (budget jugé insuffisant avant tout calcul), 'depassement' ou 'erreur'
+    os.makedirs(data_dir, exist_ok=True)
+    commit = _git_commit()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "outofcore.py")
+    results = []
+    for n in sizes:
+        for distribution in distributions:
+            path = dataset_path(data_dir, n, distribution, seed)
+            for algorithm in algorithms:
+                for budget in budgets:
+                    record = {
+                        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                        'commit': commit, 'algorithme': algorithm, 'distribution': distribution,
+                        'n': n, 'seed': seed, 'max_pir': max_pir, 'precalcule': precomputed, 'budget_mo': budget,
+                    }
+                    print(f"{algorithm} - {distribution} - {n} lignes - {budget} Mo...", end=" ", flush=True)
+                    with tempfile.TemporaryDirectory() as tmp:
+                        report = os.path.join(tmp, "rapport.json")
+                        cmd = [sys.executable, script, str(max_pir), '--entree', path, '--algo', algorithm,
+                               '--memoire-mo', str(budget), '--travail', tmp, '--rapport', report,
+                               '--sortie', os.path.join(tmp, "res.csv")] + (['--precalcule'] if precomputed else [])
+                        try:
+                            proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+                        except subprocess.TimeoutExpired:
+                            record['statut'] = 'timeout'
+                        else:
+                            if proc.returncode == 0:
+                                with open(report) as f:
+                                    rapport = json.load(f)
+                                record.update(peak_rss_mb=rapport['rss_pic_mo'],
+                                              estimation_tuile_mo=rapport['parametres']['estimation_tuile_mo'],
+                                              budget_tuiles_mo=rapport['parametres']['budget_tuiles_mo'],
+                                              tuiles_km=rapport['parametres']['tuiles_km'],
+                                              sous_tuiles_km=rapport['parametres']['sous_tuiles_km'],
+                                              total_s=rapport['duree_totale_s'])
+                                if rapport['rss_pic_mo'] is None:
+                                    record['statut'] = 'inconnu'  # pic de RSS indisponible (Windows)
+                                else:
+                                    record['statut'] = 'ok' if rapport['rss_pic_mo'] <= budget else 'depassement'
+                            elif "Budget mémoire insuffisant" in proc.stderr:
+                                record['statut'] = 'refus'
+                                record['erreur'] = proc.stderr.strip().splitlines()[-1]
+                            else:
+                                record['statut'] = 'erreur'
+                                record['code_sortie'] = proc.returncode  # -9 : tué (manque de mémoire)
+                                record['erreur'] = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ''
+                    if record.get('peak_rss_mb') is not None:
+                        print(f"{record['statut']} - pic {record['peak_rss_mb']:.0f} Mo "
+                              f"(tuiles {record['tuiles_km']:g} km, estimation {record['estimation_tuile_mo']:.0f} Mo "
+                              f"sur {record['budget_tuiles_mo']:.0f} Mo) - {record['total_s']:.1f}s")
+                    else:
+                        print(record['statut'])
+                    with open(output, 'a') as f:
+                        f.write(json.dumps(record) + "\n")
+                    results.append(record)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '_mesure':
+        # mode interne : une mesure, résultat JSON sur la dernière ligne de stdout
+        _, _, algorithm, path, max_pir, workers = sys.argv
+        print(json.dumps(measure(algorithm, path, float(max_pir), int(workers))))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Banc de mesure des algorithmes de clustering")
+    sub = parser.add_subparsers(dest="commande", required=True)
+
+    gen = sub.add_parser("generer", help="générer un jeu de données synthétique")
+    gen.add_argument("n", type=float, help="nombre de lignes (ex: 1e6)")
+    gen.add_argument("--distribution", choices=DISTRIBUTIONS, default="mixte")
+    gen.add_argument("--seed", type=int, default=0)
+    gen.add_argument("--sortie", default="generated.csv", help="CSV, .parquet ou répertoire .npy")
+
+    run = sub.add_parser("lancer", help="mesurer les algorithmes sur des jeux synthétiques")
+    run.add_argument("--tailles", nargs="+", type=float, default=[1e4, 1e5], help="nombres de lignes")
+    run.add_argument("--distributions", nargs="+", choices=DISTRIBUTIONS, default=list(DISTRIBUTIONS))
+    run.add_argument("--algos", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS))
+    run.add_argument("--max-pir", type=float, default=4000)
+    run.add_argument("--workers", type=int, default=os.cpu_count(), help="nombre de processus de calcul")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--donnees", default="bench_data", help="répertoire des jeux générés (réutilisés)")
+    run.add_argument("--sortie", default="bench_resultats.jsonl", help="historique JSON Lines (ajout)")
+    run.add_argument("--timeout", type=float, default=None, help="durée maximale par exécution (s)")
+
+    mem = sub.add_parser("memoire", help="vérifier que outofcore.py respecte son budget mémoire")
+    mem.add_argument("--tailles", nargs="+", type=float, default=[2e4, 5e4], help="nombres de lignes")
+    mem.add_argument("--distributions", nargs="+", choices=DISTRIBUTIONS, default=['mixte', 'urbain'])
+    mem.add_argument("--algos", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS))
+    mem.add_argument("--budgets", nargs="+", type=int, default=[300, 600, 1200], help="valeurs de --memoire-mo")
+    mem.add_argument("--precalcule", action="store_true", help="DBSCAN/OPTICS sur graphe creux précalculé")
+    mem.add_argument("--max-pir", type=float, default=4000)
+    mem.add_argument("--seed", type=int, default=0)
+    mem.add_argument("--donnees", default="bench_data", help="répertoire des jeux générés (réutilisés)")
+    mem.add_argument("--sortie", default="bench_memoire.jsonl", help="historique JSON Lines (ajout)")
+    mem.add_argument("--timeout", type=float, default=None, help="durée maximale par exécution (s)")
+    args = parser.parse_args()
+
+    if args.commande == "generer":
+        debut = time.time()
+        write_points(generate_points(int(args.n), args.distribution, args.seed), args.sortie)
+        print(f"{int(args.n)} lignes ({args.distribution}) écrites dans '{args.sortie}' "
+              f"en {time.time() - debut:.1f}s")
+    elif args.commande == "lancer":
+        run_suite([int(n) for n in args.tailles], args.distributions, args.algos, args.max_pir, args.workers,
+                  args.donnees, args.sortie, seed=args.seed, timeout=args.timeout)
+        print(f"\nRésultats ajoutés à '{args.sortie}'.")
+    else:
+        resultats = run_memory_suite([int(n) for n in args.tailles], args.distributions, args.algos, args.budgets,
+                                     args.max_pir, args.donnees, args.sortie, seed=args.seed,
+                                     precomputed=args.precalcule, timeout=args.timeout)
+        echecs = [r for r in resultats if r['statut'] not in ('ok', 'refus')]
+        print(f"\nRésultats ajoutés à '{args.sortie}'.")
+        if echecs:
+            print(f"{len(echecs)} exécution(s) hors budget ou en erreur")
+            sys.exit(1)
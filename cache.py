@@ -0,0 +1,103 @@
+import contextlib
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+from neighbors import RadiusGraph
+
+# Cache disque des graphes de voisinage : un répertoire par entrée, contenant
+# indptr.npy / indices.npy (/ distances.npy) relus en memmap. La clé combine
+# l'empreinte du contenu des données, le rayon et la métrique. Au-delà de la taille
+# maximale, les entrées les moins récemment utilisées sont supprimées.
+
+CACHE_DIR = ".cache_voisins"
+CACHE_MAX_MB = 2048
+
+
+def file_digest(path, chunk_size=1 << 20):
+    # Empreinte du contenu ; pour un répertoire (.npy), de tous ses fichiers
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    else:
+        files = [path]
+    h = hashlib.sha256()
+    for name in files:
+        with open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(digest, radius_km, metric, with_distances=False):
+    suffix = "-dist" if with_distances else ""
+    return f"{digest[:32]}-r{radius_km:g}-{metric}{suffix}"
+
+
+def _entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def load_graph(key, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        return None
+    os.utime(path)  # date de dernière utilisation pour l'éviction LRU
+    indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode='r')
+    indices = np.load(os.path.join(path, "indices.npy"), mmap_mode='r')
+    dist_path = os.path.join(path, "distances.npy")
+    distances = np.load(dist_path, mmap_mode='r') if os.path.exists(dist_path) else None
+    return RadiusGraph(indptr, indices, distances)
+
+
+def save_graph(key, graph, cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    np.save(os.path.join(tmp, "indptr.npy"), graph.indptr)
+    np.save(os.path.join(tmp, "indices.npy"), graph.indices)
+    if graph.distances is not None:
+        np.save(os.path.join(tmp, "distances.npy"), graph.distances)
+    try:
+        os.rename(tmp, path)  # écriture atomique de l'entrée
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # déjà écrite par un autre processus
+    evict(cache_dir, max_mb, keep=key)
+
+
+def evict(cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB, keep=None):
+    # Supprime les entrées les plus anciennes (mtime) tant que le cache dépasse max_mb
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and '.tmp-' not in name:
+            entries.append((os.path.getmtime(path), name, _entry_size(path)))
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_mb * 1024 * 1024:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total -= size
+
+
+def cached_radius_graph(csv_path, radius_km, metric, build, with_distances=False,
+                        cache_dir=CACHE_DIR, max_mb=CACHE_MAX_MB, metrics=None):
+    # Renvoie (graphe, trouvé_en_cache) ; `build` construit le graphe si absent.
+    # Avec metrics, seules la recherche et l'écriture sont mesurées dans la phase 'cache' :
+    # les phases de `build` restent au même niveau au lieu d'y être comptées deux fois
+    def phase():
+        return metrics.phase('cache') if metrics is not None else contextlib.nullcontext()
+
+    with phase():
+        key = cache_key(file_digest(csv_path), radius_km, metric, with_distances)
+        graph = load_graph(key, cache_dir)
+    if graph is not None:
+        return graph, True
+    graph = build()
+    with phase():
+        save_graph(key, graph, cache_dir, max_mb)
+    return graph, False
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from cache import file_digest
+from neighbors import RadiusGraph
+
+# Points de contrôle des longs calculs (balltree.py, optics.py --controle) : un
+# répertoire par exécution, avec les sorties de chaque phase au format .npy :
+# - parametres.json : empreinte des données et paramètres (une reprise n'est
+#   acceptée que s'ils sont identiques)
+# - graphe/ : indptr.npy / indices.npy (/ distances.npy) du graphe de voisinage
+# - <nom>.npy : tableau de fin de phase (labels OPTICS bruts...)
+# - assignation.npz : cluster_map partiel + état (prochain identifiant, curseur
+#   des graines, compteurs), réécrit au plus toutes les `interval_s` secondes
+# Chaque écriture passe par un fichier temporaire renommé : un arrêt brutal
+# laisse toujours le point de contrôle précédent intact.
+
+CHECKPOINT_DIR = "controle"
+CHECKPOINT_INTERVAL_S = 60
+ASSIGNMENT_FIELDS = ('prochain_id', 'curseur', 'voisins_parcourus', 'rejets_pir', 'rejets_rayon')
+
+
+class Checkpoint:
+    def __init__(self, path, entree, params, resume=False, interval_s=CHECKPOINT_INTERVAL_S):
+        # resume=False : le point de contrôle précédent est effacé (ValueError si le répertoire
+        # contient autre chose) ; resume=True : ValueError si absent ou incompatible
+        self.path = path
+        self.params = dict(params, empreinte=file_digest(entree))
+        self.interval_s = interval_s
+        self.last_save = time.time()
+        manifest = os.path.join(path, "parametres.json")
+        if resume:
+            if not os.path.exists(manifest):
+                raise ValueError(f"Aucun point de contrôle dans '{path}'")
+            with open(manifest) as f:
+                saved = json.load(f)
+            if saved != self.params:
+                changed = sorted(k for k in set(saved) | set(self.params) if saved.get(k) != self.params.get(k))
+                raise ValueError(f"Point de contrôle incompatible ({', '.join(changed)} différent)")
+        else:
+            self._clear(manifest)
+            with open(manifest, 'w') as f:
+                json.dump(self.params, f, indent=2)
+
+    def _clear(self, manifest):
+        # Supprime uniquement les fichiers écrits par un point de contrôle précédent ;
+        # refuse un répertoire non vide qui n'en contient pas
+        os.makedirs(self.path, exist_ok=True)
+        names = os.listdir(self.path)
+        if names and not os.path.exists(manifest):
+            raise ValueError(f"'{self.path}' n'est pas vide et ne contient pas de point de contrôle")
+        for name in names:
+            path = self._file(name)
+            if name in ("graphe", "graphe.tmp") and os.path.isdir(path):
+                shutil.rmtree(path)
+            elif name == "parametres.json" or name.endswith((".npy", ".npz")):
+                os.remove(path)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def load_graph(self):
+        path = self._file("graphe")
+        if not os.path.isdir(path):
+            return None
+        indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode='r')
+        indices = np.load(os.path.join(path, "indices.npy"), mmap_mode='r')
+        dist_path = os.path.join(path, "distances.npy")
+        distances = np.load(dist_path, mmap_mode='r') if os.path.exists(dist_path) else None
+        return RadiusGraph(indptr, indices, distances)
+
+    def save_graph(self, graph):
+        path = self._file("graphe")
+        tmp = f"{path}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "indptr.npy"), graph.indptr)
+        np.save(os.path.join(tmp, "indices.npy"), graph.indices)
+        if graph.distances is not None:
+            np.save(os.path.join(tmp, "distances.npy"), graph.distances)
+        os.rename(tmp, path)
+
+    def load_array(self, name):
+        path = self._file(f"{name}.npy")
+        return np.load(path) if os.path.exists(path) else None
+
+    def save_array(self, name, values):
+        tmp = self._file(f"{name}.tmp.npy")
+        np.save(tmp, values)
+        os.replace(tmp, self._file(f"{name}.npy"))
+
+    def load_assignment(self):
+        # (cluster_map, {champ: valeur}) ou None
+        path = self._file("assignation.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data['cluster_map'], dict(zip(ASSIGNMENT_FIELDS, data['etat'].tolist()))
+
+    def save_assignment(self, cluster_map, state, force=False):
+        # Écrit au plus toutes les interval_s secondes (sauf force) ; renvoie True si écrit
+        if not force and time.time() - self.last_save < self.interval_s:
+            return False
+        tmp = self._file("assignation.tmp.npz")
+        np.savez(tmp, cluster_map=cluster_map, etat=np.array([state[k] for k in ASSIGNMENT_FIELDS], dtype=np.int64))
+        os.replace(tmp, self._file("assignation.npz"))
+        self.last_save = time.time()
+        return True
@@ -1,36 +1,72 @@
-import pandas as pd
-import haversine as ha
+import sys
 import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from dataset import data_format, load_points
+from geo import haversine_km
+from neighbors import build_radius_graph, default_workers, graph_from_pairs
 
-#on import le CSV et on le met sous forme de DB pandas
-donnees = pd.read_csv("generated.csv", delimiter=",")
+#rayon moyen utilisé par le module haversine (ha.haversine), pour garder exactement les mêmes voisins
+RAYON_TERRE_HAVERSINE = 6371.0088
+RAYON_KM = 45
+#nombre de paires candidates traitées à la fois pour le calcul vectorisé des distances
+TAILLE_BLOC = 1_000_000
+
+#on importe les données (CSV, .parquet ou répertoire .npy, cf. dataset.py) sous forme de DB pandas,
+#toutes les colonnes et en float64 comme avant pour garder exactement les mêmes distances et le même res.csv
+entree = sys.argv[1] if len(sys.argv) > 1 else "generated.csv"
+if data_format(entree) == 'csv':
+    donnees = pd.read_csv(entree, delimiter=",")
+elif data_format(entree) == 'parquet':
+    donnees = pd.read_parquet(entree)
+else:
+    donnees = load_points(entree, dtype=np.float64)
 
 #on rajoute des colonnes pour nos 3 données suplémentaires
 donnees['nb_voisins'] = 0
 donnees['cluster'] = 0
-donnees['VID'] = [[] for d in range(len(donnees))]
 #le nombre de données qu'on traite
 traitement = len(donnees)
 
-#on calcul ici toutes les distances et les potentiels voisins
-for i in range (traitement):
-    for j in range (i+1,traitement):
+lats = donnees['LAT'].values.astype(np.float64)
+lons = donnees['LON'].values.astype(np.float64)
 
-        #on calcule la distance entre les deux points
-        dist = ha.haversine(
-        (donnees.loc[i, 'LAT'], donnees.loc[i, 'LON']), 
-        (donnees.loc[j, 'LAT'], donnees.loc[j, 'LON']),
-        )
-        
-        #si on est dans le cercle de 90km de diamètre, on ews théoriquement tous les deux dans un cluster
-        if dist < 45:
-            donnees.loc[i,'nb_voisins'] += 1
-            donnees.loc[i,'VID'].append(j)
-            donnees.loc[j,'nb_voisins'] +=1
-            donnees.loc[j,'VID'].append(i)
+#index spatial : on ne récupère que les paires candidates, avec un rayon de recherche
+#très légèrement élargi, le test exact (dist < 45) est refait ensuite
+coords = np.radians(donnees[['LAT', 'LON']].values.astype(np.float64))
+tree = BallTree(coords, metric='haversine')
+candidats = build_radius_graph(tree, coords, RAYON_KM / RAYON_TERRE_HAVERSINE * (1 + 1e-6),
+                               workers=default_workers())
 
+#on calcul ici les distances des paires candidates (i < j) par blocs vectorisés
+paires_i = []
+paires_j = []
+indptr = candidats.indptr
+debut = 0
+while debut < traitement:
+    #lignes du bloc : on s'arrête quand le bloc atteint TAILLE_BLOC paires
+    fin = int(np.searchsorted(indptr, indptr[debut] + TAILLE_BLOC, side='right')) - 1
+    fin = min(max(fin, debut + 1), traitement)
+    i = np.repeat(np.arange(debut, fin, dtype=np.int32), np.diff(indptr[debut:fin + 1]))
+    j = candidats.indices[indptr[debut]:indptr[fin]]
+    garde = i < j
+    i, j = i[garde], j[garde]
 
+    #si on est dans le cercle de 90km de diamètre, on est théoriquement tous les deux dans un cluster
+    dist = haversine_km(lats[i], lons[i], lats[j], lons[j], earth_radius_km=RAYON_TERRE_HAVERSINE)
+    proche = dist < RAYON_KM
+    paires_i.append(i[proche])
+    paires_j.append(j[proche])
+    debut = fin
 
+#graphe de voisinage au format CSR (indptr/indices int32)
+graph = graph_from_pairs(traitement, np.concatenate(paires_i), np.concatenate(paires_j))
+donnees['nb_voisins'] = graph.degrees().astype(np.int64)
+#VID : liste des voisins de chaque point, par indice croissant (même colonne qu'avant)
+lignes = np.repeat(np.arange(traitement), graph.degrees())
+voisins_tries = graph.indices[np.lexsort((graph.indices, lignes))]
+donnees['VID'] = [v.tolist() for v in np.split(voisins_tries, graph.indptr[1:-1])]
 
 #numéro du premier cluster
 n = 1
@@ -39,14 +75,14 @@ n = 1
 sorted_indices = donnees['nb_voisins'].sort_values(ascending=False).index
 
 
-#on assigne ici les clusters
+#on assigne ici les clusters (tableau numpy plutôt que des écritures cellule par cellule)
+cluster = np.zeros(traitement, dtype=np.int64)
 for index in sorted_indices:
-    if donnees.at[index, 'cluster'] == 0:
-        donnees.at[index, 'cluster'] = n
-        voisins = donnees.at[index, 'VID']
-        for i in voisins:
-            donnees.at[i, 'cluster'] = n
+    if cluster[index] == 0:
+        cluster[index] = n
+        cluster[graph.neighbors(index)] = n
         n += 1
+donnees['cluster'] = cluster
         
 donnees = donnees.sort_values(by=['nb_voisins'], ascending=False)
 
@@ -54,4 +90,4 @@ donnees = donnees.sort_values(by=['nb_voisins'], ascending=False)
 print(donnees) 
 
 #on affiche tout dans un autre csv nommé "res.csv"
-donnees.to_csv("res.csv", sep=',')
\ No newline at end of file
+donnees.to_csv("res.csv", sep=',')
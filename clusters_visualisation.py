@@ -1,13 +1,191 @@
+import argparse
+import os
+import time
+
+import matplotlib
+import matplotlib.image
 import matplotlib.pyplot as plt
-import pandas as pd
-
-donnees = pd.read_csv("res.csv")
-
-plt.figure(figsize=(10, 8))
-plt.scatter(donnees['LON'], donnees['LAT'], c=donnees['cluster'], cmap='tab20', s=2)
-plt.xlabel("Longitude")
-plt.ylabel("Latitude")
-plt.title("Clusters DBSCAN (vue statique)")
-plt.tight_layout()
-plt.savefig("clusters_dbscan.png", dpi=300)
-plt.show()
+import numpy as np
+
+from export import load_labeled_points
+
+# Rendu rasterisé des clusters : les points sont répartis dans une grille de pixels
+# (np.bincount sur l'indice de pixel), chaque pixel prend la couleur de son cluster
+# majoritaire ; seuls les pixels partagés entre plusieurs clusters sont départagés par tri.
+# La taille du PNG (et le temps d'écriture) ne dépend que de la taille de l'image,
+# plus du nombre de points. Option --tuiles : pyramide de tuiles PNG 256x256
+# (Web Mercator, arborescence standard {z}/{x}/{y}.png) consultable hors ligne
+# avec un visualiseur de tuiles XYZ (Leaflet, QGIS...).
+
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.05112878
+PALETTE = (np.array(matplotlib.colormaps['tab20'].colors) * 255).astype(np.uint8)
+
+
+def cluster_colors(labels):
+    # Couleur RGBA par cluster ; le pas de 11 (premier avec 20) sépare les identifiants voisins
+    rgba = np.full((len(labels), 4), 255, dtype=np.uint8)
+    rgba[:, :3] = PALETTE[(np.asarray(labels, dtype=np.int64) * 11) % len(PALETTE)]
+    return rgba
+
+
+def pixel_label_counts(pixels, labels, weights=None):
+    # Nombre de points par couple (pixel, cluster) ; weights : comptes déjà agrégés
+    order = np.lexsort((labels, pixels))
+    pixels, labels = pixels[order], labels[order]
+    starts = np.flatnonzero(np.r_[True, (pixels[1:] != pixels[:-1]) | (labels[1:] != labels[:-1])])
+    if weights is None:
+        counts = np.diff(np.append(starts, len(pixels)))
+    else:
+        counts = np.add.reduceat(weights[order], starts)
+    return pixels[starts], labels[starts], counts
+
+
+def dominant_from_counts(pixels, labels, counts):
+    # Pour chaque pixel occupé : le cluster le plus représenté (égalité : plus petit identifiant)
+    order = np.lexsort((labels, -counts, pixels))
+    first = order[np.r_[True, pixels[order][1:] != pixels[order][:-1]]]
+    return pixels[first], labels[first]
+
+
+def dominant_labels(pixels, labels):
+    return dominant_from_counts(*pixel_label_counts(pixels, labels))
+
+
+def render(lats, lons, labels, width, height=None, bounds=None, point_px=1, background=None):
+    # Image RGBA (hauteur, largeur, 4) en projection équirectangulaire.
+    # point_px : côté du carré dessiné par point ; background : couleur RGBA du fond (transparent sinon)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.int64)
+    lat_min, lat_max, lon_min, lon_max = bounds or (lats.min(), lats.max(), lons.min(), lons.max())
+    if height is None:
+        # rapport d'aspect local : 1° de longitude = cos(latitude) x 1° de latitude
+        aspect = (lat_max - lat_min) / max((lon_max - lon_min) * np.cos(np.radians((lat_min + lat_max) / 2)), 1e-9)
+        height = max(1, int(round(width * aspect)))
+    x = ((lons - lon_min) / max(lon_max - lon_min, 1e-12) * width).astype(np.int64)
+    y = ((lat_max - lats) / max(lat_max - lat_min, 1e-12) * height).astype(np.int64)
+    if point_px > 1:
+        offsets = np.arange(point_px) - point_px // 2
+        dx, dy = np.meshgrid(offsets, offsets)
+        x = (x[:, None] + dx.ravel()).ravel()
+        y = (y[:, None] + dy.ravel()).ravel()
+        labels = np.repeat(labels, point_px * point_px)
+    np.clip(x, 0, width - 1, out=x)
+    np.clip(y, 0, height - 1, out=y)
+
+    flat = y * width + x
+    counts = np.bincount(flat, minlength=width * height)
+    lowest = np.full(width * height, np.iinfo(np.int64).max)
+    highest = np.full(width * height, np.iinfo(np.int64).min)
+    np.minimum.at(lowest, flat, labels)
+    np.maximum.at(highest, flat, labels)
+    occupied = counts > 0
+    # pixel d'un seul cluster : son label ; sinon cluster majoritaire parmi ses seuls points
+    shared = occupied & (lowest != highest)
+    in_shared = shared[flat]
+    if in_shared.any():
+        pixels, dominant = dominant_labels(flat[in_shared], labels[in_shared])
+        lowest[pixels] = dominant
+    image = np.zeros((height * width, 4), dtype=np.uint8)
+    if background is not None:
+        image[:] = background
+    image[occupied] = cluster_colors(lowest[occupied])
+    return image.reshape(height, width, 4)
+
+
+def mercator_pixels(lats, lons, zoom):
+    # Coordonnées pixel globales Web Mercator au niveau de zoom donné
+    size = TILE_SIZE << zoom
+    lat = np.radians(np.clip(np.asarray(lats, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * size
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * size
+    return np.clip(x.astype(np.int64), 0, size - 1), np.clip(y.astype(np.int64), 0, size - 1)
+
+
+def write_tile_pyramid(lats, lons, labels, out_dir, min_zoom=0, max_zoom=10, progress=None):
+    # Un seul histogramme (pixel, cluster) sur les points, au zoom maximal ; chaque
+    # niveau inférieur l'agrège 2x2 (le coût ne dépend plus du nombre de points).
+    # Seules les tuiles contenant des points sont écrites. Renvoie le nombre de tuiles.
+    x, y = mercator_pixels(lats, lons, max_zoom)
+    size = TILE_SIZE << max_zoom
+    runs = pixel_label_counts(y * size + x, np.asarray(labels, dtype=np.int64))
+    num_tiles = 0
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        size = TILE_SIZE << zoom
+        if zoom < max_zoom:
+            # agrégation 2x2 des comptes du niveau précédent (grille de 2 x size pixels de côté)
+            run_pixels, run_labels, counts = runs
+            px, py = run_pixels % (2 * size), run_pixels // (2 * size)
+            runs = pixel_label_counts((py // 2) * size + px // 2, run_labels, counts)
+        pixels, dominant = dominant_from_counts(*runs)
+        tiles = _write_tiles(out_dir, zoom, pixels % size, pixels // size, cluster_colors(dominant))
+        num_tiles += tiles
+        if progress is not None:
+            progress(zoom, tiles)
+    return num_tiles
+
+
+def _write_tiles(out_dir, zoom, px, py, colors):
+    # Découpe les pixels d'un niveau de zoom en tuiles PNG {zoom}/{x}/{y}.png
+    tile_ids = (py // TILE_SIZE) * (1 << zoom) + px // TILE_SIZE
+    order = np.argsort(tile_ids, kind='stable')
+    tile_ids, px, py, colors = tile_ids[order], px[order], py[order], colors[order]
+    tiles, starts = np.unique(tile_ids, return_index=True)
+    bounds = np.append(starts, len(tile_ids))
+    for k, tile in enumerate(tiles):
+        tx, ty = int(tile % (1 << zoom)), int(tile // (1 << zoom))
+        sl = slice(bounds[k], bounds[k + 1])
+        image = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        image[py[sl] - ty * TILE_SIZE, px[sl] - tx * TILE_SIZE] = colors[sl]
+        tile_dir = os.path.join(out_dir, str(zoom), str(tx))
+        os.makedirs(tile_dir, exist_ok=True)
+        matplotlib.image.imsave(os.path.join(tile_dir, f"{ty}.png"), image)
+    return len(tiles)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rendu rasterisé des clusters")
+    parser.add_argument("fichier", nargs="?", default="res.csv",
+                        help="résultats : res.csv ou répertoire du format compact")
+    parser.add_argument("--colonne", default="cluster",
+                        help="colonne des labels (par ex. cluster_4000 pour un balayage --sweep en CSV)")
+    parser.add_argument("--sortie", default="clusters_dbscan.png", help="image PNG de la vue d'ensemble")
+    parser.add_argument("--largeur", type=int, default=2000, help="largeur de l'image (pixels)")
+    parser.add_argument("--hauteur", type=int, help="hauteur de l'image (par défaut : proportionnelle)")
+    parser.add_argument("--taille-point", type=int, default=3, help="côté du carré dessiné par point (pixels)")
+    parser.add_argument("--tuiles", metavar="REPERTOIRE", help="écrire aussi une pyramide de tuiles PNG")
+    parser.add_argument("--zoom-max", type=int, default=10, help="niveau de zoom maximal de la pyramide")
+    parser.add_argument("--afficher", action="store_true", help="afficher l'image (matplotlib)")
+    args = parser.parse_args()
+
+    donnees = load_labeled_points(args.fichier)
+    if args.colonne not in donnees.columns:
+        parser.error(f"colonne '{args.colonne}' absente de {args.fichier} (colonnes : {', '.join(donnees.columns)})")
+    lats, lons, labels = donnees['LAT'].values, donnees['LON'].values, donnees[args.colonne].values
+
+    debut = time.time()
+    image = render(lats, lons, labels, args.largeur, args.hauteur, point_px=args.taille_point,
+                   background=(255, 255, 255, 255))
+    plt.figure(figsize=(10, 8))
+    plt.imshow(image, extent=(lons.min(), lons.max(), lats.min(), lats.max()), aspect='auto',
+               interpolation='nearest')
+    plt.xlabel("Longitude")
+    plt.ylabel("Latitude")
+    plt.title("Clusters DBSCAN (vue statique)")
+    plt.tight_layout()
+    plt.savefig(args.sortie, dpi=300)
+    print(f"{len(donnees)} points rendus en {image.shape[1]}x{image.shape[0]} dans '{args.sortie}' "
+          f"en {time.time() - debut:.1f}s")
+
+    if args.tuiles:
+        debut = time.time()
+
+        def afficher_zoom(zoom, tiles):
+            print(f"Zoom {zoom}: {tiles} tuiles - Temps écoulé: {time.time() - debut:.1f}s")
+
+        total = write_tile_pyramid(lats, lons, labels, args.tuiles, max_zoom=args.zoom_max, progress=afficher_zoom)
+        print(f"{total} tuiles écrites dans '{args.tuiles}/{{z}}/{{x}}/{{y}}.png'")
+
+    if args.afficher:
+        plt.show()
@@ -0,0 +1,219 @@
+import argparse
+import heapq
+import os
+import time
+
+import numpy as np
+
+from dataset import load_points
+from density import build_haversine_graph
+from geo import EARTH_RADIUS_KM, haversine_km
+from metrics import Metrics
+
+# Clustering hiérarchique agglomératif à lien complet, sous contraintes.
+# La distance entre deux clusters est la plus grande distance entre leurs membres ;
+# elle n'est finie que si toutes les paires sont des arêtes du graphe de voisinage
+# creux (rayon 2 x RADIUS_KM), aucune matrice n x n n'est donc construite.
+# Fusions par tas : chaque cluster vivant y a une entrée (distance, cluster, plus
+# proche voisin). Le lien complet est réductible (une fusion n'éloigne jamais moins
+# les autres clusters), une entrée dont le voisin a disparu est simplement recalculée
+# quand elle arrive en tête. Une fusion est refusée si le PIR total dépasse MAX_PIR
+# ou si le rayon autour du centroïde (moyenne LAT/LON, comme test.py) dépasse
+# RADIUS_KM. Mémoire : graphe CSR (proportionnel au nombre d'arêtes) + O(n).
+
+
+def _gather(indptr, rows):
+    # Positions dans le tableau CSR des arêtes des lignes `rows`
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    return np.arange(counts.sum()) + offsets
+
+
+def _initial_neighbors(graph, pirs, max_pir):
+    # Plus proche voisin de chaque point compatible en PIR (égalité : plus petit index)
+    rows = np.repeat(np.arange(len(graph), dtype=np.int64), graph.degrees())
+    cols = np.asarray(graph.indices)
+    dists = np.asarray(graph.distances)
+    ok = pirs[rows] + pirs[cols] <= max_pir
+    rows, cols, dists = rows[ok], cols[ok], dists[ok]
+    order = np.lexsort((cols, dists, rows))
+    first = np.unique(rows[order], return_index=True)[1]
+    best = order[first]
+    return rows[best], cols[best], dists[best]
+
+
+def complete_linkage(lats, lons, pirs, graph, max_pir, radius_km, metrics=None, progress=None):
+    # graph : RadiusGraph avec distances (radians), rayon >= 2 x radius_km.
+    # Renvoie les identifiants de cluster (à partir de 1, dans l'ordre des identifiants internes).
+    num_points = len(pirs)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    pirs = np.asarray(pirs, dtype=np.float64)
+    indptr, indices, distances = graph.indptr, graph.indices, graph.distances
+
+    # clusters 0..n-1 = points ; chaque fusion crée un nouvel identifiant (jamais réutilisé)
+    capacity = 2 * num_points
+    label = np.arange(num_points, dtype=np.int64)
+    alive = np.zeros(capacity, dtype=bool)
+    alive[:num_points] = True
+    size = np.zeros(capacity, dtype=np.int64)
+    size[:num_points] = 1
+    pir_total = np.zeros(capacity)
+    pir_total[:num_points] = pirs
+    lat_sum = np.zeros(capacity)
+    lat_sum[:num_points] = lats
+    lon_sum = np.zeros(capacity)
+    lon_sum[:num_points] = lons
+    members = {}  # identifiant -> indices des points (clusters de plus d'un point)
+    forbidden = {}  # identifiant -> clusters avec lesquels la fusion a été refusée (rayon)
+
+    def members_of(c):
+        return members[c] if c in members else np.array([c], dtype=np.int64)
+
+    def best_neighbor(c):
+        # Cluster le plus proche au sens du lien complet, fusion autorisée par le PIR
+        edges = _gather(indptr, members_of(c))
+        neighbor_labels = label[indices[edges]]
+        keep = neighbor_labels != c
+        neighbor_labels, dists = neighbor_labels[keep], distances[edges][keep]
+        if len(neighbor_labels) == 0:
+            return None
+        order = np.argsort(neighbor_labels, kind='stable')
+        neighbor_labels, dists = neighbor_labels[order], dists[order]
+        candidates, first = np.unique(neighbor_labels, return_index=True)
+        pairs = np.diff(np.append(first, len(neighbor_labels)))
+        linkage = np.maximum.reduceat(dists, first)
+        ok = (pairs == size[c] * size[candidates]) & (pir_total[c] + pir_total[candidates] <= max_pir)
+        candidates, linkage = candidates[ok], linkage[ok]
+        refused = forbidden.get(c, ())
+        for k in np.lexsort((candidates, linkage)):
+            if candidates[k] not in refused:
+                return linkage[k], int(candidates[k])
+        return None
+
+    def radius_ok(a, b):
+        union = np.concatenate((members_of(a), members_of(b)))
+        count = size[a] + size[b]
+        c_lat = (lat_sum[a] + lat_sum[b]) / count
+        c_lon = (lon_sum[a] + lon_sum[b]) / count
+        return haversine_km(c_lat, c_lon, lats[union], lons[union]).max() <= radius_km, union
+
+    rows, cols, dists = _initial_neighbors(graph, pirs, max_pir)
+    heap = list(zip(dists.tolist(), rows.tolist(), cols.tolist()))
+    heapq.heapify(heap)
+
+    next_id = num_points
+    merges = rejected_radius = 0
+    while heap:
+        linkage, a, b = heapq.heappop(heap)
+        if not alive[a]:
+            continue
+        if not alive[b] or b in forbidden.get(a, ()):
+            best = best_neighbor(a)  # voisin disparu (fusionné) ou refusé entre-temps
+            if best is not None:
+                heapq.heappush(heap, (best[0], a, best[1]))
+            continue
+
+        within, union = radius_ok(a, b)
+        if not within:
+            rejected_radius += 1
+            forbidden.setdefault(a, set()).add(b)
+            forbidden.setdefault(b, set()).add(a)
+            best = best_neighbor(a)
+            if best is not None:
+                heapq.heappush(heap, (best[0], a, best[1]))
+            continue
+
+        c = next_id
+        next_id += 1
+        alive[a] = alive[b] = False
+        alive[c] = True
+        size[c] = size[a] + size[b]
+        pir_total[c] = pir_total[a] + pir_total[b]
+        lat_sum[c] = lat_sum[a] + lat_sum[b]
+        lon_sum[c] = lon_sum[a] + lon_sum[b]
+        members[c] = union
+        label[union] = c
+        for old in (a, b):
+            members.pop(old, None)
+            forbidden.pop(old, None)
+        merges += 1
+        if progress is not None and merges % 10000 == 0:
+            progress(merges, num_points - merges)
+
+        best = best_neighbor(c)
+        if best is not None:
+            heapq.heappush(heap, (best[0], c, best[1]))
+
+    if metrics is not None:
+        metrics.count('fusions', merges)
+        metrics.count('rejets_rayon', rejected_radius)
+        metrics.count('clusters_crees', num_points - merges)
+    return np.unique(label, return_inverse=True)[1] + 1
+
+
+if __name__ == "__main__":
+    print("\n\n\n###################################################################")
+    print("#           Clustering hiérarchique (lien complet)                #")
+    print("################################################################### \n\n\n")
+
+    parser = argparse.ArgumentParser(description="Clustering hiérarchique à lien complet sous contraintes")
+    parser.add_argument("max_pir", nargs="?", type=float, help="PIR maximal par cluster (4000 par défaut)")
+    parser.add_argument("--entree", default="generated.csv",
+                        help="données d'entrée : CSV, .parquet ou répertoire .npy (voir dataset.py)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="nombre de processus de calcul")
+    parser.add_argument("--sortie", default="res_hierarchique.csv", help="fichier de résultats")
+    parser.add_argument("--rapport", default="rapport_hierarchique.json",
+                        help="rapport JSON des mesures (durée et mémoire par phase, compteurs)")
+    parser.add_argument("--profil", nargs="+", default=(), metavar="PHASE",
+                        help="phases à profiler avec cProfile (graphe, fusions... ou '*')")
+    args = parser.parse_args()
+
+    if args.max_pir is None:
+        print("Usage: python clutering_hierarchique.py <max_pir_per_cluster>")
+        print("Utilisation de la valeur 4000 par défaut\n\n")
+        MAX_PIR = 4000.0
+    else:
+        MAX_PIR = args.max_pir
+
+    RADIUS_KM = 45
+    mesures = Metrics("hierarchique", profile=args.profil)
+
+    print(f"Lecture des données ({args.entree})...")
+    with mesures.phase('chargement'):
+        df = load_points(args.entree)
+    print(f"Chargement terminé: {len(df)} lignes")
+    mesures.set(entree=args.entree, lignes=len(df), max_pir=MAX_PIR, rayon_km=RADIUS_KM, workers=args.workers)
+
+    # Graphe creux au diamètre maximal d'un cluster valide (2 x RADIUS_KM)
+    print(f"\nGraphe de voisinage à {2 * RADIUS_KM} km ({args.workers} processus)...")
+    coords = np.radians(df[['LAT', 'LON']].values.astype(np.float64))
+    with mesures.phase('graphe'):
+        graph = build_haversine_graph(coords, 2 * RADIUS_KM / EARTH_RADIUS_KM, workers=args.workers)
+    mesures.count('aretes_graphe', graph.indptr[-1])
+    print(f"{graph.indptr[-1]} arêtes")
+
+    print("\nFusions...")
+    start_time = time.time()
+
+    def afficher_fusions(merges, clusters):
+        print(f"Fusions: {merges} - Clusters restants: {clusters} - Temps écoulé: {time.time() - start_time:.1f}s")
+
+    with mesures.phase('fusions'):
+        df['cluster'] = complete_linkage(df['LAT'].values, df['LON'].values, df['PIR'].values, graph, MAX_PIR,
+                                         RADIUS_KM, metrics=mesures, progress=afficher_fusions)
+
+    with mesures.phase('ecriture'):
+        df.to_csv(args.sortie, index=False)
+
+    num_clusters = df['cluster'].nunique()
+    print(f"\nNombre final de clusters: {num_clusters}")
+    print(f"Résultats enregistrés dans '{args.sortie}'.")
+    mesures.set(nb_clusters=int(num_clusters))
+    if args.rapport:
+        mesures.write(args.rapport)
+
+    print("\n\n\n###################################################################")
+    print("#                 Fin du clustering hiérarchique                  #")
+    print("################################################################### \n\n\n")
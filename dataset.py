@@ -0,0 +1,153 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Chargement des points (LAT, LON, PIR) depuis plusieurs formats :
+# - CSV (generated.csv), lu colonne par colonne avec usecols
+# - Parquet (.parquet), seules les colonnes utiles sont lues (pyarrow requis)
+# - répertoire de tableaux .npy float32 (LAT.npy, LON.npy, PIR.npy), relus en memmap
+# `python dataset.py generated.csv generated_npy` fait la conversion une fois pour toutes.
+
+COLUMNS = ('LAT', 'LON', 'PIR')
+CHUNK_ROWS = 1_000_000
+
+
+def data_format(path):
+    if os.path.isdir(path):
+        return 'npy'
+    if path.endswith('.parquet'):
+        return 'parquet'
+    return 'csv'
+
+
+def load_points(path, columns=COLUMNS, dtype=np.float32):
+    fmt = data_format(path)
+    if fmt == 'npy':
+        data = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode='r') for c in columns}
+        return pd.DataFrame({c: np.asarray(v, dtype=dtype) for c, v in data.items()})
+    if fmt == 'parquet':
+        df = pd.read_parquet(path, columns=list(columns))
+        return df.astype({c: dtype for c in columns})
+    return pd.read_csv(path, delimiter=",", usecols=list(columns), dtype={c: dtype for c in columns})[list(columns)]
+
+
+def iter_points(path, columns=COLUMNS, dtype=np.float32, chunk_rows=CHUNK_ROWS):
+    # Lecture en flux par morceaux de chunk_rows lignes (DataFrame LAT, LON, PIR)
+    fmt = data_format(path)
+    if fmt == 'npy':
+        data = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode='r') for c in columns}
+        num_rows = len(data[columns[0]])
+        for start in range(0, num_rows, chunk_rows):
+            yield pd.DataFrame({c: np.asarray(v[start:start + chunk_rows], dtype=dtype) for c, v in data.items()})
+    elif fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=list(columns)):
+            yield batch.to_pandas().astype({c: dtype for c in columns})
+    else:
+        for chunk in pd.read_csv(path, delimiter=",", usecols=list(columns), dtype={c: dtype for c in columns},
+                                 chunksize=chunk_rows):
+            yield chunk[list(columns)]
+
+
+def load_rows(path, rows, columns=COLUMNS, dtype=np.float32, chunk_rows=CHUNK_ROWS):
+    # Seules les lignes `rows` (indices croissants) : accès direct aux memmaps .npy,
+    # lecture en flux sinon (rien n'est gardé en dehors des lignes demandées)
+    rows = np.asarray(rows, dtype=np.int64)
+    if data_format(path) == 'npy':
+        data = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode='r') for c in columns}
+        return pd.DataFrame({c: np.asarray(v[rows], dtype=dtype) for c, v in data.items()})
+    parts = [pd.DataFrame({c: np.empty(0, dtype=dtype) for c in columns})]
+    found = 0
+    start = 0
+    for chunk in iter_points(path, columns, dtype, chunk_rows):
+        if found == len(rows):
+            break
+        end = start + len(chunk)
+        hi = int(np.searchsorted(rows, end))
+        parts.append(chunk.iloc[rows[found:hi] - start])
+        found, start = hi, end
+    if found < len(rows):
+        raise ValueError(f"{path}: ligne {rows[found]} demandée, {start} lignes lues")
+    return pd.concat(parts, ignore_index=True)
+
+
+def _count_rows(csv_path):
+    with open(csv_path, 'rb') as f:
+        lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            lines += 1  # dernière ligne sans retour chariot
+    return lines - 1  # en-tête
+
+
+def convert_csv(csv_path, out_path, columns=COLUMNS, chunk_rows=CHUNK_ROWS):
+    # Conversion par morceaux : la mémoire reste bornée quelle que soit la taille du CSV
+    dtype = {c: np.float32 for c in columns}
+    chunks = pd.read_csv(csv_path, usecols=list(columns), dtype=dtype, chunksize=chunk_rows)
+    if data_format(out_path) == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk[list(columns)], preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+        return
+
+    num_rows = _count_rows(csv_path)
+    os.makedirs(out_path, exist_ok=True)
+    arrays = {c: np.lib.format.open_memmap(os.path.join(out_path, f"{c}.npy"), mode='w+',
+                                           dtype=np.float32, shape=(num_rows,)) for c in columns}
+    start = 0
+    for chunk in chunks:
+        end = start + len(chunk)
+        for c in columns:
+            arrays[c][start:end] = chunk[c].values
+        start = end
+    if start != num_rows:
+        raise ValueError(f"{csv_path}: {start} lignes lues pour {num_rows} attendues (lignes vides ?)")
+    for a in arrays.values():
+        a.flush()
+
+
+def count_points(path, columns=COLUMNS):
+    fmt = data_format(path)
+    if fmt == 'npy':
+        return len(np.load(os.path.join(path, f"{columns[0]}.npy"), mmap_mode='r'))
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return _count_rows(path)
+
+
+def concat_points(paths, out_path, columns=COLUMNS, chunk_rows=CHUNK_ROWS):
+    # Concaténation de plusieurs entrées (tous formats) en un répertoire .npy, par morceaux
+    sizes = [count_points(p, columns) for p in paths]
+    os.makedirs(out_path, exist_ok=True)
+    arrays = {c: np.lib.format.open_memmap(os.path.join(out_path, f"{c}.npy"), mode='w+',
+                                           dtype=np.float32, shape=(sum(sizes),)) for c in columns}
+    start = 0
+    for path, size in zip(paths, sizes):
+        first = start
+        for chunk in iter_points(path, columns, chunk_rows=chunk_rows):
+            end = start + len(chunk)
+            for c in columns:
+                arrays[c][start:end] = chunk[c].values
+            start = end
+        if start - first != size:
+            raise ValueError(f"{path}: {start - first} lignes lues pour {size} attendues (lignes vides ?)")
+    for a in arrays.values():
+        a.flush()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python dataset.py <generated.csv> <sortie.parquet | répertoire_npy>")
+        sys.exit(1)
+    convert_csv(sys.argv[1], sys.argv[2])
+    print(f"Conversion terminée: {sys.argv[1]} -> {sys.argv[2]}")
@@ -0,0 +1,214 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.cluster import DBSCAN, OPTICS
+from sklearn.metrics.pairwise import haversine_distances
+
+from geo import EARTH_RADIUS_KM, DiameterState, diameter_within
+from neighbors import build_radius_graph, neighbor_tree, process_pool
+
+
+def build_haversine_graph(coords, radius_rad, workers=1, backend="balltree", memory_mb=256):
+    # backend : 'balltree' (haversine) ou 'kdtree' (corde sur vecteurs unitaires, mêmes voisins)
+    tree = neighbor_tree(coords, backend)
+    return build_radius_graph(tree, coords, radius_rad, workers=workers, memory_mb=memory_mb,
+                              return_distance=True)
+
+
+def haversine_graph(coords, radius_rad, workers=1, min_neighbors=0, graph=None, backend="balltree",
+                    memory_mb=256):
+    # Graphe creux des distances haversine (radians) plafonné à radius_rad,
+    # construit une seule fois par BallTree, pour metric='precomputed'.
+    # Les lignes avec moins de min_neighbors voisins sont complétées par des
+    # arêtes fictives à distance pi (au-delà de tout max_eps) : OPTICS exige
+    # min_samples voisins stockés par ligne mais ignore ces arêtes.
+    # `graph` : RadiusGraph avec distances déjà calculé (cache disque).
+    if graph is None:
+        graph = build_haversine_graph(coords, radius_rad, workers=workers, backend=backend, memory_mb=memory_mb)
+    deficit = np.maximum(min_neighbors - graph.degrees(), 0)
+    if not deficit.any():
+        return graph.to_sparse()
+
+    num_points = len(graph)
+    degrees = graph.degrees()
+    if np.any(deficit > num_points - 1 - degrees):
+        # même message que sklearn (min_samples = min_neighbors + 1)
+        raise ValueError(f"min_samples must be no greater than the number of samples ({num_points}). "
+                         f"Got {min_neighbors + 1}")
+    shift = np.concatenate(([0], np.cumsum(deficit)))
+    indptr = graph.indptr + shift
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    distances = np.full(indptr[-1], np.pi)
+    real = np.arange(len(graph.indices)) + np.repeat(shift[:-1], degrees)
+    indices[real] = graph.indices
+    distances[real] = graph.distances
+
+    # Arêtes fictives vers les points suivants (ni soi-même, ni un vrai voisin) : une
+    # ligne en déficit a deficit + degré = min_neighbors candidats (i + 1, i + 2... modulo
+    # n), dont au plus degré vrais voisins ; on garde les deficit premiers restants.
+    rows = np.flatnonzero(deficit)
+    row_deficit, row_degrees = deficit[rows], degrees[rows].astype(np.int64)
+    candidates = (rows[:, None] + 1 + np.arange(min_neighbors)) % num_points
+    edge_start = np.concatenate(([0], np.cumsum(row_degrees)[:-1]))
+    edges = np.repeat(graph.indptr[rows] - edge_start, row_degrees) + np.arange(row_degrees.sum())
+    edge_keys = np.repeat(rows.astype(np.int64), row_degrees) * num_points + graph.indices[edges]
+    free = ~np.isin(rows[:, None].astype(np.int64) * num_points + candidates, edge_keys)
+    keep = free & (np.cumsum(free, axis=1) <= row_deficit[:, None])
+    pad_start = np.concatenate(([0], np.cumsum(row_deficit)[:-1]))
+    slots = np.repeat(indptr[rows + 1] - row_deficit - pad_start, row_deficit) + np.arange(row_deficit.sum())
+    indices[slots] = candidates[keep]
+    return csr_matrix((distances, indices, indptr), shape=(num_points, num_points))
+
+
+def dbscan_eps(radius_km):
+    # eps = 0.5x le rayon, comme dans hdbscan.py
+    return 0.5 * radius_km / EARTH_RADIUS_KM
+
+
+def dbscan_labels(coords, radius_km, min_samples=2, precomputed=False, workers=1, graph=None, backend="balltree",
+                  memory_mb=256):
+    # memory_mb : budget des lots de construction du graphe creux (precomputed)
+    eps = dbscan_eps(radius_km)
+    if precomputed:
+        X = haversine_graph(coords, eps, workers=workers, graph=graph, backend=backend, memory_mb=memory_mb)
+        return DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed').fit(X).labels_
+    return DBSCAN(eps=eps, min_samples=min_samples, metric='haversine').fit(coords).labels_
+
+
+def optics_labels(coords, min_samples=2, xi=0.05, precomputed=False, radius_km=None, workers=1, graph=None,
+                  backend="balltree", memory_mb=256):
+    # En mode precomputed, le voisinage est borné à radius_km (max_eps)
+    if precomputed:
+        max_eps = radius_km / EARTH_RADIUS_KM
+        X = haversine_graph(coords, max_eps, workers=workers, min_neighbors=min_samples - 1, graph=graph,
+                            backend=backend, memory_mb=memory_mb)
+        return OPTICS(metric='precomputed', min_samples=min_samples, max_eps=max_eps,
+                      cluster_method='xi', xi=xi).fit(X).labels_
+    return OPTICS(metric='haversine', min_samples=min_samples, cluster_method='xi', xi=xi).fit(coords).labels_
+
+
+# --- Post-traitement : respect des contraintes de diamètre et PIR ---
+def cluster_diameter_km(cluster_coords):
+    if len(cluster_coords) < 2:
+        return 0
+    dists = haversine_distances(cluster_coords)
+    return np.max(dists) * EARTH_RADIUS_KM
+
+
+def split_cluster(indices, coords, pirs, max_pir, radius_km):
+    # Greedy split: parcours dans l'ordre des indices, nouveau sous-cluster
+    # dès que le diamètre ou la somme des PIR serait dépassé. Le diamètre du
+    # sous-cluster courant est suivi de façon incrémentale (DiameterState).
+    clusters = []
+    current = []
+    current_pir = 0
+    state = None
+    for idx in indices:
+        lat, lon = coords[idx]
+        if current:
+            temp_pir = current_pir + pirs[idx]
+            if (temp_pir > max_pir) or not state.fits(lat, lon):
+                clusters.append(current)
+                current = []
+            else:
+                current.append(idx)
+                current_pir = temp_pir
+                state.add(lat, lon)
+                continue
+        current = [idx]
+        current_pir = pirs[idx]
+        state = DiameterState(64, radius_km)
+        state.add(lat, lon)
+    if current:
+        clusters.append(current)
+    return clusters
+
+
+# Les clusters sont regroupés une seule fois (tri stable des labels : membres
+# contigus, par index croissant) et contrôlés/découpés par lots de clusters
+# consécutifs, sur un pool de processus quand workers > 1 (coordonnées, PIR et
+# ordre partagés par fork). split_cluster découpe en tranches contiguës des
+# membres : chaque lot renvoie seulement la taille des sous-clusters, dans
+# l'ordre des clusters, et la numérotation est faite à la fin par le processus
+# principal (identique quel que soit le nombre de processus).
+_constraints = {}
+
+
+def _init_constraints(coords, pirs, order, max_pir, radius_km):
+    _constraints.update(coords=coords, pirs=pirs, order=order, max_pir=max_pir, radius_km=radius_km)
+
+
+def _split_batch(bounds):
+    # bounds : (début, fin) dans `order` de clusters consécutifs.
+    # Renvoie (tailles des clusters créés, rejets PIR, rejets diamètre)
+    c = _constraints
+    coords, pirs, max_pir, radius_km = c['coords'], c['pirs'], c['max_pir'], c['radius_km']
+    sizes = []
+    rejected_pir = rejected_diameter = 0
+    for start, end in bounds:
+        indices = c['order'][start:end]
+        cluster_coords = coords[indices]
+        pir_ok = pirs[indices].sum() <= max_pir
+        if pir_ok and diameter_within(cluster_coords[:, 0], cluster_coords[:, 1], radius_km):
+            sizes.append(end - start)
+            continue
+        if pir_ok:
+            rejected_diameter += 1
+        else:
+            rejected_pir += 1
+        sizes.extend(len(split) for split in split_cluster(indices.tolist(), coords, pirs, max_pir, radius_km))
+    return sizes, rejected_pir, rejected_diameter
+
+
+def enforce_constraints(labels, coords, pirs, max_pir, radius_km, first_label=0,
+                        progress=None, progress_every=1000, metrics=None, workers=1):
+    # Renumérote les clusters DBSCAN/OPTICS en découpant ceux qui dépassent les
+    # contraintes ; chaque point de bruit (-1) devient son propre cluster.
+    # progress(clusters traités, total) est appelé tous les progress_every clusters (un lot).
+    # metrics (metrics.Metrics) : clusters rejetés pour le PIR / le diamètre, clusters créés.
+    labels = np.asarray(labels)
+    pirs = np.asarray(pirs)
+    order = np.argsort(labels, kind='stable')
+    cluster_ids, starts = np.unique(labels[order], return_index=True)
+    ends = np.append(starts[1:], len(order))[:len(starts)]
+    num_noise = ends[0] if len(cluster_ids) and cluster_ids[0] == -1 else 0
+    noise_indices, order = order[:num_noise], order[num_noise:]
+    keep = cluster_ids != -1
+    starts, ends = starts[keep] - num_noise, ends[keep] - num_noise
+    total_clusters = len(starts)
+
+    batches = [list(zip(starts[i:i + progress_every].tolist(), ends[i:i + progress_every].tolist()))
+               for i in range(0, total_clusters, progress_every)]
+    initargs = (coords, pirs, order, max_pir, radius_km)
+    sizes = []
+    rejected_pir = rejected_diameter = processed = 0
+    if workers > 1 and len(batches) > 1:
+        executor = process_pool(min(workers, len(batches)), _init_constraints, initargs)
+        results = executor.map(_split_batch, batches)
+    else:
+        executor = None
+        _init_constraints(*initargs)
+        results = map(_split_batch, batches)
+    try:
+        for batch, (batch_sizes, batch_pir, batch_diameter) in zip(batches, results):
+            sizes.extend(batch_sizes)
+            rejected_pir += batch_pir
+            rejected_diameter += batch_diameter
+            processed += len(batch)
+            if progress is not None:
+                progress(processed, total_clusters)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        _constraints.clear()
+
+    new_labels = np.empty(len(labels), dtype=int)
+    next_label = first_label + len(sizes)
+    new_labels[order] = np.repeat(np.arange(first_label, next_label), sizes)
+    new_labels[noise_indices] = np.arange(next_label, next_label + len(noise_indices))
+    if metrics is not None:
+        metrics.count('clusters_initiaux', total_clusters)
+        metrics.count('rejets_pir', rejected_pir)
+        metrics.count('rejets_diametre', rejected_diameter)
+        metrics.count('points_bruit', len(noise_indices))
+        metrics.count('clusters_crees', next_label - first_label + len(noise_indices))
+    return new_labels
@@ -0,0 +1,120 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import CHUNK_ROWS, load_points, load_rows
+from validation import cluster_summary
+
+# Export compact des résultats (au lieu d'un res.csv qui recopie toutes les données) :
+# un répertoire contenant
+# - labels.npy       : identifiant de cluster de chaque point, dans l'ordre de l'entrée (int32)
+# - clusters.parquet : résumé par cluster (points_count, pir_total, centroïde, radius_km)
+# - meta.json        : fichier d'entrée, nombre de lignes et paramètres de l'exécution
+# - sur demande (débogage) : nb_voisins.npy, voisins_indptr.npy / voisins_indices.npy
+# Les coordonnées ne sont pas recopiées : elles sont relues depuis l'entrée.
+# Labels et résumé sont écrits par morceaux de CHUNK_ROWS lignes.
+# incremental.py --delta-seul écrit au même format le résultat d'un delta : labels des seuls
+# nouveaux sites, résumé des seuls clusters touchés, `base` (résultat précédent) dans meta.json ;
+# une chaîne de deltas se lit en remontant les `base` (compact_chain).
+
+LABELS_FILE = "labels.npy"
+SUMMARY_FILE = "clusters.parquet"
+META_FILE = "meta.json"
+
+
+def is_compact(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, LABELS_FILE))
+
+
+def write_compact(out_dir, labels, lats, lons, pirs, meta=None, graph=None, chunk_rows=CHUNK_ROWS, summary=None):
+    # summary : résumé par cluster déjà calculé (lats / lons / pirs ne sont alors pas lus)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(out_dir, exist_ok=True)
+    labels = np.asarray(labels)
+    out = np.lib.format.open_memmap(os.path.join(out_dir, LABELS_FILE), mode='w+', dtype=np.int32,
+                                    shape=labels.shape)
+    for start in range(0, len(labels), chunk_rows):
+        out[start:start + chunk_rows] = labels[start:start + chunk_rows]
+    out.flush()
+    del out
+
+    if summary is None:
+        summary = cluster_summary(labels, lats, lons, pirs)[0]
+    writer = None
+    for start in range(0, max(len(summary), 1), chunk_rows):
+        table = pa.Table.from_pandas(summary.iloc[start:start + chunk_rows], preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(os.path.join(out_dir, SUMMARY_FILE), table.schema)
+        writer.write_table(table)
+    writer.close()
+
+    if graph is not None:
+        # Artefacts de débogage : degrés et listes de voisins (CSR)
+        np.save(os.path.join(out_dir, "nb_voisins.npy"), graph.degrees())
+        np.save(os.path.join(out_dir, "voisins_indptr.npy"), graph.indptr)
+        np.save(os.path.join(out_dir, "voisins_indices.npy"), graph.indices)
+
+    meta = dict(meta or {})
+    meta.update(lignes=len(labels), nb_clusters=len(summary))
+    with open(os.path.join(out_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_compact(path):
+    # Renvoie (labels en memmap, résumé par cluster, méta-données)
+    labels = np.load(os.path.join(path, LABELS_FILE), mmap_mode='r')
+    summary = pd.read_parquet(os.path.join(path, SUMMARY_FILE))
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    return labels, summary, meta
+
+
+def compact_chain(path):
+    # Résultat compact -> [(chemin, labels, résumé, méta)], du résultat complet au dernier
+    # delta (un seul élément pour un résultat complet)
+    chain = []
+    while True:
+        labels, summary, meta = load_compact(path)
+        chain.append((path, labels, summary, meta))
+        if 'base' not in meta:
+            return chain[::-1]
+        path = meta['base']
+
+
+def load_labeled_points(path, entree=None):
+    # Points LAT/LON/PIR + colonne cluster, depuis un res.csv ou un répertoire compact
+    # (les coordonnées sont alors relues depuis `entree`, par défaut celle de meta.json ;
+    # pour un delta, base puis nouveaux sites, `entree` ne valant que pour le résultat complet)
+    if not is_compact(path):
+        return pd.read_csv(path)
+    labels, _, meta = load_compact(path)
+    source = meta['entree'] if 'base' in meta else (entree or meta['entree'])
+    df = load_points(source)
+    if len(df) != len(labels):
+        raise ValueError(f"{path}: {len(labels)} labels pour {len(df)} lignes dans {source}")
+    df['cluster'] = np.asarray(labels)
+    if 'base' in meta:
+        df = pd.concat([load_labeled_points(meta['base'], entree), df], ignore_index=True)
+    return df
+
+
+def load_cluster_members(path, cluster_ids, entree=None, chunk_rows=CHUNK_ROWS):
+    # LAT/LON des membres des clusters `cluster_ids` d'un résultat compact, par cluster :
+    # une passe en flux sur labels.npy (sans tri), puis seules les lignes retenues sont
+    # relues depuis l'entrée. Renvoie {cluster_id: (lats, lons)}.
+    labels, _, meta = load_compact(path)
+    ids = np.unique(np.asarray(cluster_ids))
+    rows = [start + np.flatnonzero(np.isin(labels[start:start + chunk_rows], ids))
+            for start in range(0, len(labels), chunk_rows)]
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    points = load_rows(entree or meta['entree'], rows)
+    row_labels = np.asarray(labels[rows])
+    order = np.argsort(row_labels, kind='stable')
+    found, starts = np.unique(row_labels[order], return_index=True)
+    lats = np.split(points['LAT'].values[order], starts[1:])
+    lons = np.split(points['LON'].values[order], starts[1:])
+    return {int(c): (lat, lon) for c, lat, lon in zip(found, lats, lons)}
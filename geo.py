@@ -0,0 +1,197 @@
+import math
+
+import numpy as np
+
+# Rayon terrestre moyen utilisé partout dans le projet (km)
+EARTH_RADIUS_KM = 6371.0
+
+
+def to_unit_vectors(lat_deg, lon_deg):
+    # Conversion LAT/LON (degrés) -> vecteurs unitaires 3D (x, y, z)
+    lat = np.radians(np.asarray(lat_deg, dtype=np.float64))
+    lon = np.radians(np.asarray(lon_deg, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def haversine_km(lat1, lon1, lat2, lon2, earth_radius_km=EARTH_RADIUS_KM):
+    # Distance orthodromique (km), vectorisée, entrées en degrés
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(a))
+
+
+def centroid_radius_km(lats, lons):
+    # Rayon d'un cluster : distance max entre le centroïde (moyenne LAT/LON,
+    # comme test.py) et ses membres
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    return float(haversine_km(lats.mean(), lons.mean(), lats, lons).max())
+
+
+def chord_from_km(distance_km):
+    # Longueur de corde (sphère unité) équivalente à une distance orthodromique
+    return 2.0 * np.sin(distance_km / (2.0 * EARTH_RADIUS_KM))
+
+
+def km_from_chord(chord):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2.0, 0.0, 1.0))
+
+
+class ClusterState:
+    # État d'un cluster en cours de construction :
+    # - sommes courantes LAT/LON -> centroïde mis à jour en O(1) (même définition
+    #   que test.py : moyenne des latitudes et des longitudes)
+    # - vecteurs unitaires 3D des membres dans un tableau préalloué -> contrôle
+    #   du rayon en une seule passe vectorisée (distance de corde)
+
+    def __init__(self, capacity, radius_km):
+        self.members = np.empty((max(capacity, 1), 3), dtype=np.float64)
+        self.size = 0
+        self.lat_sum = 0.0
+        self.lon_sum = 0.0
+        self.max_chord_sq = chord_from_km(radius_km) ** 2
+
+    def add(self, lat, lon, vec):
+        if self.size == len(self.members):
+            self.members = np.concatenate((self.members, np.empty_like(self.members)))
+        self.members[self.size] = vec
+        self.size += 1
+        self.lat_sum += lat
+        self.lon_sum += lon
+
+    def centroid(self):
+        return self.lat_sum / self.size, self.lon_sum / self.size
+
+    def fits(self, lat, lon, vec):
+        # Le point candidat peut-il rejoindre le cluster sans dépasser le rayon ?
+        k = self.size + 1
+        c_lat = math.radians((self.lat_sum + lat) / k)
+        c_lon = math.radians((self.lon_sum + lon) / k)
+        cos_lat = math.cos(c_lat)
+        c = np.array((cos_lat * math.cos(c_lon), cos_lat * math.sin(c_lon), math.sin(c_lat)))
+        d = vec - c
+        if d @ d > self.max_chord_sq:
+            return False
+        diff = self.members[:self.size] - c
+        return bool(np.einsum('ij,ij->i', diff, diff).max() <= self.max_chord_sq)
+
+    def try_add(self, lat, lon, vec):
+        if self.fits(lat, lon, vec):
+            self.add(lat, lon, vec)
+            return True
+        return False
+
+
+def haversine_rad(lat1, lon1, lat2, lon2):
+    # Distance angulaire haversine (radians), même formule que haversine_distances
+    a = np.sin(0.5 * (lat2 - lat1)) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(0.5 * (lon2 - lon1)) ** 2
+    return 2.0 * np.arcsin(np.sqrt(a))
+
+
+class DiameterState:
+    # Sous-cluster dont on maintient le diamètre de façon incrémentale :
+    # un nouveau point n'est comparé qu'aux membres existants (O(k) au lieu
+    # d'une matrice k x k), après un test rapide sur une calotte englobante
+    # centrée sur le premier membre (rayon = distance max à ce membre).
+    # Coordonnées en radians (lat, lon), comme dans density.py.
+
+    def __init__(self, capacity, max_diameter_km):
+        self.lat = np.empty(max(capacity, 1), dtype=np.float64)
+        self.lon = np.empty(max(capacity, 1), dtype=np.float64)
+        self.size = 0
+        self.cap_radius = 0.0
+        self.max_km = max_diameter_km
+
+    def add(self, lat, lon):
+        if self.size == len(self.lat):
+            self.lat = np.concatenate((self.lat, np.empty_like(self.lat)))
+            self.lon = np.concatenate((self.lon, np.empty_like(self.lon)))
+        if self.size:
+            d_center = haversine_rad(self.lat[0], self.lon[0], lat, lon) * EARTH_RADIUS_KM
+            self.cap_radius = max(self.cap_radius, d_center)
+        self.lat[self.size] = lat
+        self.lon[self.size] = lon
+        self.size += 1
+
+    def fits(self, lat, lon):
+        if self.size == 0:
+            return True
+        d_center = haversine_rad(self.lat[0], self.lon[0], lat, lon) * EARTH_RADIUS_KM
+        # tous les membres sont à moins de cap_radius du centre : inégalité triangulaire
+        if d_center + self.cap_radius <= self.max_km * (1 - 1e-9):
+            return True
+        if d_center > self.max_km:
+            return False
+        n = self.size
+        return bool(haversine_rad(self.lat[:n], self.lon[:n], lat, lon).max() * EARTH_RADIUS_KM <= self.max_km)
+
+    def try_add(self, lat, lon):
+        if self.fits(lat, lon):
+            self.add(lat, lon)
+            return True
+        return False
+
+
+def diameter_within(lat, lon, max_diameter_km, block=2048):
+    # diamètre <= max_diameter_km ? Sans matrice n x n complète : test de la
+    # calotte autour du premier point, puis comparaison par blocs de paires
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+    if n < 2:
+        return True
+    d0 = haversine_rad(lat[0], lon[0], lat, lon).max() * EARTH_RADIUS_KM
+    if d0 > max_diameter_km:
+        return False
+    if 2 * d0 <= max_diameter_km * (1 - 1e-9):
+        return True
+    for i in range(0, n, block):
+        blat = lat[i:i + block, None]
+        blon = lon[i:i + block, None]
+        for j in range(i, n, block):
+            d = haversine_rad(blat, blon, lat[None, j:j + block], lon[None, j:j + block])
+            if d.max() * EARTH_RADIUS_KM > max_diameter_km:
+                return False
+    return True
+
+
+def _cap_from(points):
+    # Plus petite calotte dont le bord passe par 1, 2 ou 3 points (vecteurs unitaires)
+    if len(points) == 1:
+        return points[0], 1.0
+    if len(points) == 2:
+        c = points[0] + points[1]
+    else:
+        a, b, d = points
+        c = np.cross(b - a, d - a)
+        if c @ (a + b + d) < 0:
+            c = -c
+    norm = np.sqrt(c @ c)
+    if norm == 0.0:  # points confondus
+        return points[0], 1.0
+    c = c / norm
+    return c, min(p @ c for p in points)
+
+
+def min_enclosing_cap(xyz, seed=0):
+    # Plus petite calotte sphérique contenant tous les points (algorithme de
+    # Welzl itératif, ordre aléatoire déterministe). Suppose des points dans un
+    # même hémisphère, ce qui est le cas de tout cluster de quelques dizaines
+    # de km. Renvoie (centre unitaire, rayon angulaire en radians).
+    pts = np.asarray(xyz, dtype=np.float64)[np.random.default_rng(seed).permutation(len(xyz))]
+    eps = 1e-12
+    center, cos_r = _cap_from([pts[0]])
+    for i in range(1, len(pts)):
+        if pts[i] @ center >= cos_r - eps:
+            continue
+        center, cos_r = _cap_from([pts[i]])
+        for j in range(i):
+            if pts[j] @ center >= cos_r - eps:
+                continue
+            center, cos_r = _cap_from([pts[i], pts[j]])
+            for k in range(j):
+                if pts[k] @ center >= cos_r - eps:
+                    continue
+                center, cos_r = _cap_from([pts[i], pts[j], pts[k]])
+    return center, float(np.arccos(np.clip(cos_r, -1.0, 1.0)))
@@ -0,0 +1,298 @@
+import ctypes
+import heapq
+import multiprocessing
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from geo import ClusterState, chord_from_km, to_unit_vectors
+from neighbors import process_pool
+
+
+class StaticSeeds:
+    # Ordre des graines fixé une fois : nombre de voisins décroissant
+    def __init__(self, graph, cluster_map, position=0):
+        self.order = pd.Series(graph.degrees()).sort_values(ascending=False).index
+        self.cluster_map = cluster_map
+        self.position = position  # curseur : entrées de order déjà parcourues
+
+    def __iter__(self):
+        for position, index in enumerate(self.order[self.position:], start=self.position + 1):
+            if self.cluster_map[index] == 0:
+                self.position = position
+                yield index
+
+    def assigned(self, members):
+        pass
+
+
+class DynamicSeeds:
+    # Ordre des graines adaptatif : nombre de voisins *encore libres* décroissant.
+    # Tas max paresseux : les degrés ne font que baisser, une entrée périmée est
+    # réinsérée avec son degré courant quand elle arrive en tête. Clé entière
+    # -degré * n + index (égalité de degré : plus petit index d'abord).
+    # La graine suivante ne dépend que des voisins libres courants : à la reprise
+    # d'un cluster_map partiel, le tas reconstruit donne le même ordre (position ignorée).
+    def __init__(self, graph, cluster_map, position=0):
+        self.graph = graph
+        self.cluster_map = cluster_map
+        self.position = position
+        self.remaining = graph.degrees().astype(np.int64)
+        if cluster_map.any():
+            # reprise : voisins libres = voisins pas encore assignés (graphe symétrique)
+            free = np.concatenate(([0], np.cumsum(cluster_map[graph.indices] == 0)))
+            self.remaining = free[graph.indptr[1:]] - free[graph.indptr[:-1]]
+        self.num_points = len(cluster_map)
+        self.heap = (-self.remaining * self.num_points + np.arange(self.num_points)).tolist()
+        heapq.heapify(self.heap)
+
+    def __iter__(self):
+        n = self.num_points
+        while self.heap:
+            key = heapq.heappop(self.heap)
+            index = key % n
+            if self.cluster_map[index] != 0:
+                continue  # déjà assigné
+            degree = -((key - index) // n)
+            if degree != self.remaining[index]:
+                heapq.heappush(self.heap, -int(self.remaining[index]) * n + index)
+                continue  # entrée périmée
+            yield index
+
+    def assigned(self, members):
+        # Les voisins des points qui viennent d'être assignés perdent un voisin libre
+        graph = self.graph
+        if len(members) == 1:
+            neighbors = graph.neighbors(members[0])
+        else:
+            neighbors = np.concatenate([graph.neighbors(m) for m in members])
+        np.subtract.at(self.remaining, neighbors, 1)
+
+
+def grow_cluster(index, lats, lons, xyz, pirs, graph, cluster_map, max_pir, radius_km):
+    # Cluster issu de la graine `index` : ses voisins libres sont absorbés par PIR
+    # croissante tant que les contraintes tiennent. Ne lit que cluster_map sur les
+    # voisins de la graine. Renvoie (membres, voisins parcourus, rejets PIR, rejets rayon).
+    pir_initial = pirs[index]
+    if pir_initial > max_pir:
+        return [index], 0, 0, 0
+
+    cluster_members = [index]
+    total_pir = pir_initial
+    rejected_pir = rejected_radius = 0
+
+    voisins = graph.neighbors(index)
+    voisins = voisins[cluster_map[voisins] == 0]
+    voisins = voisins[np.argsort(pirs[voisins], kind='stable')]  # Trie par PIR croissante
+
+    # Centroïde incrémental + contrôle vectorisé du rayon sur les vecteurs unitaires
+    state = ClusterState(len(voisins) + 1, radius_km)
+    state.add(lats[index], lons[index], xyz[index])
+    for voisin in voisins:
+        pir_voisin = pirs[voisin]
+        if total_pir + pir_voisin > max_pir:
+            rejected_pir += 1
+            continue
+        if state.try_add(lats[voisin], lons[voisin], xyz[voisin]):
+            cluster_members.append(voisin)
+            total_pir += pir_voisin
+        else:
+            rejected_radius += 1
+    return cluster_members, len(voisins), rejected_pir, rejected_radius
+
+
+def assign_clusters(lats, lons, pirs, graph, max_pir, radius_km, progress=None, metrics=None,
+                    dynamic_seeds=False, checkpoint=None):
+    # Assignation gloutonne avec contraintes (rayon autour du centroïde, PIR total) :
+    # les graines sont prises par nombre de voisins décroissant, puis chaque graine
+    # absorbe ses voisins libres par PIR croissante tant que les contraintes tiennent.
+    # dynamic_seeds : le nombre de voisins est celui des voisins encore libres, mis à
+    # jour au fil des assignations (DynamicSeeds) au lieu d'être figé au départ.
+    # Renvoie les identifiants de cluster (à partir de 1).
+    # metrics (metrics.Metrics) : compteurs voisins parcourus / rejets PIR / rejets rayon.
+    # checkpoint (checkpoint.Checkpoint) : état sauvegardé périodiquement, repris s'il existe.
+    n = 1  # identifiant de cluster
+    cluster_map = np.zeros(len(pirs), dtype=np.int32)
+    scanned = rejected_pir = rejected_radius = 0
+    position = 0
+    saved = checkpoint.load_assignment() if checkpoint is not None else None
+    if saved is not None:
+        cluster_map, saved_state = saved
+        n, position = saved_state['prochain_id'], saved_state['curseur']
+        scanned = saved_state['voisins_parcourus']
+        rejected_pir, rejected_radius = saved_state['rejets_pir'], saved_state['rejets_rayon']
+    seeds = (DynamicSeeds if dynamic_seeds else StaticSeeds)(graph, cluster_map, position)
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    xyz = to_unit_vectors(lats, lons)
+
+    processed = int(np.count_nonzero(cluster_map))  # points assignés
+    num_to_process = len(cluster_map)
+    next_report = processed + 5000
+
+    def state():
+        return dict(prochain_id=n, curseur=seeds.position, voisins_parcourus=scanned, rejets_pir=rejected_pir,
+                    rejets_rayon=rejected_radius)
+
+    for index in seeds:
+        cluster_members, num_scanned, num_rejected_pir, num_rejected_radius = grow_cluster(
+            index, lats, lons, xyz, pirs, graph, cluster_map, max_pir, radius_km)
+        scanned += num_scanned
+        rejected_pir += num_rejected_pir
+        rejected_radius += num_rejected_radius
+
+        cluster_map[cluster_members] = n
+        seeds.assigned(cluster_members)
+        n += 1
+        processed += len(cluster_members)
+        if progress is not None and (processed >= next_report or processed == num_to_process):
+            progress(processed, num_to_process, n - 1)
+            next_report = processed + 5000
+        if checkpoint is not None:
+            checkpoint.save_assignment(cluster_map, state())
+
+    if checkpoint is not None:
+        checkpoint.save_assignment(cluster_map, state(), force=True)
+    if metrics is not None:
+        metrics.count('voisins_parcourus', scanned)
+        metrics.count('rejets_pir', rejected_pir)
+        metrics.count('rejets_rayon', rejected_radius)
+        metrics.count('clusters_crees', n - 1)
+    return cluster_map
+
+
+# Assignation parallèle par lots de graines indépendantes. Une graine ne lit et
+# n'écrit cluster_map que sur elle-même et ses voisins (à moins de RADIUS_KM) :
+# deux graines à plus de 2 x RADIUS_KM l'une de l'autre donnent le même cluster
+# quel que soit l'ordre. Chaque tour parcourt les prochaines graines dans l'ordre
+# statique et retient celles qui sont à plus de 2 x RADIUS_KM de toute graine
+# antérieure du tour, retenue ou écartée (une graine ne double jamais une graine
+# antérieure proche) ; les paires proches viennent d'un cKDTree sur les vecteurs
+# unitaires des graines du tour.
+# Les graines retenues grossissent en parallèle dans des processus qui écrivent
+# directement dans cluster_map (mémoire partagée), avec un identifiant provisoire
+# = rang de la graine + 1 ; la renumérotation finale par rang donne exactement les
+# labels de assign_clusters (graines statiques).
+_parallel = {}
+SEEDS_PER_WORKER = 512  # graines examinées par tour et par processus
+MIN_PARALLEL_BATCH = 64  # en dessous, le lot est traité dans le processus principal
+# Marge absolue sur la corde de conflit (~64 m sur la sphère terrestre) : le graphe
+# vient de LAT/LON arrondis en float32 (~1 m), le test de conflit des vecteurs float64.
+# Deux graines à 2 x RADIUS_KM près de l'arrondi sont donc toujours en conflit.
+CONFLICT_MARGIN = 1e-5
+
+
+def _init_parallel(lats, lons, xyz, pirs, graph, shared_map, max_pir, radius_km):
+    _parallel.update(lats=lats, lons=lons, xyz=xyz, pirs=pirs, graph=graph, max_pir=max_pir, radius_km=radius_km,
+                     cluster_map=np.frombuffer(shared_map, dtype=np.int32))
+
+
+def _grow_seeds(seeds, labels):
+    # Grossit les clusters des graines (indépendantes) ; renvoie les compteurs cumulés
+    p = _parallel
+    totals = np.zeros(4, dtype=np.int64)  # points assignés, voisins parcourus, rejets PIR, rejets rayon
+    for index, label in zip(seeds, labels):
+        members, num_scanned, num_rejected_pir, num_rejected_radius = grow_cluster(
+            index, p['lats'], p['lons'], p['xyz'], p['pirs'], p['graph'], p['cluster_map'], p['max_pir'],
+            p['radius_km'])
+        p['cluster_map'][members] = label
+        totals += (len(members), num_scanned, num_rejected_pir, num_rejected_radius)
+    return totals
+
+
+def assign_clusters_parallel(lats, lons, pirs, graph, max_pir, radius_km, workers=1, progress=None,
+                             metrics=None):
+    # Mêmes labels que assign_clusters(..., dynamic_seeds=False), calculés sur `workers` processus
+    num_points = len(pirs)
+    shared_map = multiprocessing.RawArray(ctypes.c_int32, num_points)
+    cluster_map = np.frombuffer(shared_map, dtype=np.int32)
+    order = StaticSeeds(graph, cluster_map).order.to_numpy()
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    xyz = to_unit_vectors(lats, lons)
+    initargs = (lats, lons, xyz, pirs, graph, shared_map, max_pir, radius_km)
+    _init_parallel(*initargs)
+    executor = process_pool(workers, _init_parallel, initargs) if workers > 1 else None
+
+    conflict_chord = chord_from_km(2 * radius_km) + CONFLICT_MARGIN
+
+    carry = np.empty(0, dtype=np.int64)  # rangs des graines écartées au tour précédent
+    next_rank = 0
+    window = SEEDS_PER_WORKER * max(workers, 1)
+    totals = np.zeros(4, dtype=np.int64)
+    rounds = 0
+    next_report = 5000
+    try:
+        while len(carry) or next_rank < num_points:
+            fresh = np.arange(next_rank, min(next_rank + window - len(carry), num_points))
+            next_rank += len(fresh)
+            head = np.concatenate((carry, fresh))
+            head = head[cluster_map[order[head]] == 0]  # graines absorbées entre-temps
+            if len(head) == 0:
+                carry = head
+                continue
+            rounds += 1
+            # paires de graines du tour à moins de 2 x rayon : la seconde de chaque paire est écartée
+            pairs = cKDTree(xyz[order[head]]).query_pairs(conflict_chord, output_type='ndarray')
+            selected = np.ones(len(head), dtype=bool)
+            selected[pairs.max(axis=1)] = False
+
+            seeds, labels = order[head[selected]], head[selected] + 1
+            if executor is None or len(seeds) < MIN_PARALLEL_BATCH:
+                totals += _grow_seeds(seeds, labels)
+            else:
+                chunks = np.array_split(np.arange(len(seeds)), workers)
+                for result in executor.map(_grow_seeds, [seeds[c] for c in chunks], [labels[c] for c in chunks]):
+                    totals += result
+            carry = head[~selected]
+            if progress is not None and (totals[0] >= next_report or totals[0] == num_points):
+                progress(int(totals[0]), num_points, rounds)
+                next_report = totals[0] + 5000
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        _parallel.clear()
+
+    # Renumérotation dans l'ordre des graines (identique au traitement séquentiel)
+    used, labels = np.unique(cluster_map, return_inverse=True)
+    if metrics is not None:
+        metrics.count('voisins_parcourus', int(totals[1]))
+        metrics.count('rejets_pir', int(totals[2]))
+        metrics.count('rejets_rayon', int(totals[3]))
+        metrics.count('clusters_crees', len(used))
+        metrics.count('tours_paralleles', rounds)
+    return (labels + 1).astype(np.int32)
+
+
+# Balayage de plusieurs limites de PIR sur le même graphe : les données et le
+# graphe sont partagés par les processus (fork), une limite par tâche
+_sweep = {}
+
+
+def _init_sweep(lats, lons, pirs, graph, radius_km, dynamic_seeds):
+    _sweep.update(lats=lats, lons=lons, pirs=pirs, graph=graph, radius_km=radius_km, dynamic_seeds=dynamic_seeds)
+
+
+def _assign_one(max_pir):
+    start = time.time()
+    s = _sweep
+    labels = assign_clusters(s['lats'], s['lons'], s['pirs'], s['graph'], max_pir, s['radius_km'],
+                             dynamic_seeds=s['dynamic_seeds'])
+    return labels, time.time() - start
+
+
+def assign_clusters_sweep(lats, lons, pirs, graph, max_pirs, radius_km, workers=1, dynamic_seeds=False):
+    # Renvoie [(labels, durée en s)] dans l'ordre de max_pirs
+    initargs = (lats, lons, pirs, graph, radius_km, dynamic_seeds)
+    if workers <= 1 or len(max_pirs) == 1:
+        _init_sweep(*initargs)
+        try:
+            return [_assign_one(max_pir) for max_pir in max_pirs]
+        finally:
+            _sweep.clear()
+    with process_pool(min(workers, len(max_pirs)), _init_sweep, initargs) as executor:
+        return list(executor.map(_assign_one, max_pirs))
@@ -1,119 +1,136 @@
-import sys
+import argparse
 import numpy as np
-import pandas as pd
-from sklearn.cluster import DBSCAN
-from sklearn.metrics.pairwise import haversine_distances
 import time
 
+from cache import CACHE_DIR, CACHE_MAX_MB, cached_radius_graph
+from dataset import load_points
+from density import build_haversine_graph, dbscan_eps, dbscan_labels, enforce_constraints
+from metrics import Metrics
+from neighbors import NEIGHBOR_BACKENDS, default_workers
+from refine import merge_clusters
+from tiling import cluster_tiles
+
 print("\n\n\n###################################################################")
 print("#                     Clustering avec DBscan                      #")
 print("################################################################### \n\n\n")
 
 
-# Read the CSV with the same dtype as in balltree.py
-# LAT, LON, PIR columns
-dtype_dict = {
-    'LAT': np.float32,
-    'LON': np.float32,
-    'PIR': np.float32
-}
-
-if len(sys.argv) != 2:
-    print("Usage: python balltree.py <max_pir_per_cluster>")
+parser = argparse.ArgumentParser(description="Clustering avec DBSCAN")
+parser.add_argument("max_pir", nargs="?", type=float, help="PIR maximal par cluster (4000 par défaut)")
+parser.add_argument("--entree", default="generated.csv",
+                    help="données d'entrée : CSV, .parquet ou répertoire .npy (voir dataset.py)")
+parser.add_argument("--workers", type=int, default=default_workers(),
+                    help="nombre de processus de calcul (1 par défaut sans fork)")
+parser.add_argument("--tuiles", type=float, default=0, metavar="KM",
+                    help="mode partitionné : taille des tuiles en km (0 = désactivé)")
+parser.add_argument("--precalcule", action="store_true",
+                    help="graphe creux des distances haversine précalculé (metric='precomputed')")
+parser.add_argument("--recherche", choices=NEIGHBOR_BACKENDS, default="balltree",
+                    help="recherche des voisins : BallTree haversine ou KD-tree sur vecteurs unitaires 3D "
+                         "(mêmes voisins, voir neighbors.py ; kdtree implique --precalcule)")
+parser.add_argument("--fusion", action="store_true",
+                    help="fusionner ensuite les clusters voisins tant que diamètre et PIR tiennent (voir refine.py)")
+parser.add_argument("--cache", action="store_true",
+                    help="réutiliser le graphe stocké sur disque (implique --precalcule)")
+parser.add_argument("--cache-dir", default=CACHE_DIR, help="répertoire du cache des graphes")
+parser.add_argument("--cache-max-mo", type=int, default=CACHE_MAX_MB, help="taille maximale du cache (Mo)")
+parser.add_argument("--rapport", default="rapport_dbscan.json",
+                    help="rapport JSON des mesures (durée et mémoire par phase, compteurs)")
+parser.add_argument("--profil", nargs="+", default=(), metavar="PHASE",
+                    help="phases à profiler avec cProfile (clustering, post_traitement... ou '*')")
+args = parser.parse_args()
+# graphe creux précalculé : demandé, relu du cache ou construit par le KD-tree
+precalcule = args.precalcule or args.cache or args.recherche == "kdtree"
+mesures = Metrics("dbscan", profile=args.profil)
+
+if args.max_pir is None:
+    print("Usage: python hdbscan.py <max_pir_per_cluster>")
     print("Utilisation de la valeur 4000 par défaut\n\n")
     MAX_PIR = 4000.0
 else : 
-    MAX_PIR = float(sys.argv[1])
+    MAX_PIR = args.max_pir
 
 RADIUS_KM = 45
-EPS = RADIUS_KM / 6371.0
 
-df = pd.read_csv('generated.csv', dtype=dtype_dict)
+# Read LAT, LON, PIR as float32, as in balltree.py
+with mesures.phase('chargement'):
+    df = load_points(args.entree)
 coords = np.radians(df[['LAT', 'LON']].values)
+mesures.set(entree=args.entree, lignes=len(df), max_pir=MAX_PIR, rayon_km=RADIUS_KM, workers=args.workers,
+            tuiles_km=args.tuiles, precalcule=precalcule, fusion=args.fusion, recherche=args.recherche)
 
-# Try different values for eps and min_samples
-# You can adjust these values for better clustering results
-EPS = 0.5 * RADIUS_KM / 6371.0  # Increase eps (try 0.5x the original radius)
-MIN_SAMPLES = 2  # Lower min_samples to allow smaller clusters
-
-clustering = DBSCAN(eps=EPS, min_samples=MIN_SAMPLES, metric='haversine').fit(coords)
-df['cluster'] = clustering.labels_
-
-# Post-process clusters to enforce max diameter and PIR constraints
-def cluster_diameter_km(cluster_coords):
-    if len(cluster_coords) < 2:
-        return 0
-    dists = haversine_distances(cluster_coords)
-    return np.max(dists) * 6371
-
-def split_cluster(indices, coords, pirs):
-    # Greedy split: sort by PIR, split if PIR sum or diameter exceeded
-    clusters = []
-    current = []
-    current_pir = 0
-    for idx in indices:
-        if current:
-            temp_coords = coords[current + [idx]]
-            temp_pir = current_pir + pirs[idx]
-            if (cluster_diameter_km(temp_coords) > RADIUS_KM) or (temp_pir > MAX_PIR):
-                clusters.append(current)
-                current = [idx]
-                current_pir = pirs[idx]
-            else:
-                current.append(idx)
-                current_pir = temp_pir
-        else:
-            current = [idx]
-            current_pir = pirs[idx]
-    if current:
-        clusters.append(current)
-    return clusters
-
-new_labels = np.full(len(df), -1, dtype=int)
-next_label = 0
-print("\nDébut du post-traitement des clusters DBSCAN...")
-total_clusters = len([label for label in sorted(df['cluster'].unique()) if label != -1])
-processed_clusters = 0
-start_time = time.time()
-
-for label in sorted(df['cluster'].unique()):
-    if label == -1:
-        continue  # skip noise
-    indices = df.index[df['cluster'] == label].tolist()
-    cluster_coords = coords[indices]
-    cluster_pirs = df['PIR'].values[indices]
-    if (cluster_diameter_km(cluster_coords) <= RADIUS_KM) and (cluster_pirs.sum() <= MAX_PIR):
-        new_labels[indices] = next_label
-        next_label += 1
-    else:
-        # Split cluster
-        splits = split_cluster(indices, coords, df['PIR'].values)
-        for split in splits:
-            new_labels[split] = next_label
-            next_label += 1
-    processed_clusters += 1
-    if processed_clusters % 1000 == 0 or processed_clusters == total_clusters:
+if args.tuiles:
+    # Partitioned mode: tiles + halo clustered in parallel
+    print(f"\nClustering par tuiles de {args.tuiles:.0f} km ({args.workers} processus)...")
+    start_time = time.time()
+
+    def report_tiles(done, total):
+        elapsed = time.time() - start_time
+        print(f"Tuiles traitées: {done}/{total} - Temps écoulé: {elapsed:.1f}s")
+
+    with mesures.phase('tuiles'):
+        new_labels = cluster_tiles(df['LAT'].values, df['LON'].values, df['PIR'].values, 'dbscan', MAX_PIR,
+                                   RADIUS_KM, args.tuiles, workers=args.workers, first_label=0,
+                                   progress=report_tiles, precomputed=args.precalcule,
+                                   backend=args.recherche)
+else:
+    # Sparse graph at eps, reused from the on-disk cache when possible
+    graph = None
+    if args.cache:
+        eps = dbscan_eps(RADIUS_KM)
+
+        def build_graph():
+            with mesures.phase('voisins'):
+                return build_haversine_graph(coords, eps, workers=args.workers, backend=args.recherche)
+
+        graph, found = cached_radius_graph(args.entree, eps * 6371.0, NEIGHBOR_BACKENDS[args.recherche], build_graph,
+                                           with_distances=True, cache_dir=args.cache_dir,
+                                           max_mb=args.cache_max_mo, metrics=mesures)
+        mesures.set(cache_trouve=found)
+        if found:
+            print("\nGraphe de voisinage chargé depuis le cache")
+
+    # eps is 0.5x the radius and MIN_SAMPLES = 2 to allow smaller clusters
+    with mesures.phase('clustering'):
+        labels = dbscan_labels(coords, RADIUS_KM, min_samples=2, precomputed=precalcule,
+                               workers=args.workers, graph=graph, backend=args.recherche)
+
+    # Post-process clusters to enforce max diameter and PIR constraints
+    print("\nDébut du post-traitement des clusters DBSCAN...")
+    start_time = time.time()
+
+    def report_progress(processed_clusters, total_clusters):
         elapsed = time.time() - start_time
         percent_done = processed_clusters / total_clusters
         estimated_total = elapsed / percent_done if percent_done > 0 else 0
         remaining = estimated_total - elapsed
         print(f"Progression: {percent_done*100:.1f}% - Temps écoulé: {elapsed:.1f}s - Temps restant estimé: {remaining:.1f}s")
 
-# Assign each noise point to its own unique cluster label (after all clusters)
-noise_indices = df.index[df['cluster'] == -1].tolist()
-for idx in noise_indices:
-    new_labels[idx] = next_label
-    next_label += 1
+    # Each noise point gets its own unique cluster label (after all clusters)
+    with mesures.phase('post_traitement'):
+        new_labels = enforce_constraints(labels, coords, df['PIR'].values, MAX_PIR, RADIUS_KM, first_label=0,
+                                         progress=report_progress, progress_every=1000, metrics=mesures,
+                                         workers=args.workers)
+
+if args.fusion:
+    # Merge neighboring clusters (noise singletons first of all) on the per-cluster summaries
+    with mesures.phase('fusion'):
+        new_labels = merge_clusters(new_labels, df['LAT'].values, df['LON'].values, df['PIR'].values, MAX_PIR,
+                                    RADIUS_KM, constraint='diametre', first_label=0, metrics=mesures)
+
 # Assign new labels
 result = df[['LAT', 'LON', 'PIR']].copy()
 result['cluster'] = new_labels
-result.to_csv('res.csv', index=False)
+with mesures.phase('ecriture'):
+    result.to_csv('res.csv', index=False)
 
 # Print the number of clusters (excluding noise if present)
 num_clusters = len(set(new_labels))
 print(f"Number of clusters: {num_clusters}")
+mesures.set(nb_clusters=num_clusters)
+if args.rapport:
+    mesures.write(args.rapport)
 
 print("\n\n\n###################################################################")
 print("#                       fin du clustering                         #")
 print("################################################################### \n\n\n")
-
@@ -0,0 +1,244 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from dataset import concat_points, load_points
+from export import compact_chain, is_compact, load_cluster_members, load_labeled_points, write_compact
+from geo import EARTH_RADIUS_KM, ClusterState, chord_from_km, haversine_km, km_from_chord, to_unit_vectors
+from validation import cluster_summary
+
+# Mode incrémental : ajoute de nouveaux sites à un résultat existant sans tout
+# recalculer. Chaque nouveau point rejoint le cluster le plus proche (centroïde)
+# qui a encore de la marge en PIR et en rayon, sinon ouvre un nouveau cluster.
+# Les clusters candidats viennent d'un BallTree sur les centroïdes existants :
+# un point ne peut rejoindre un cluster que s'il est à moins de 3 x RADIUS_KM de
+# son centroïde d'origine (le nouveau centroïde reste à moins de 2 x RADIUS_KM
+# de l'ancien), la recherche est donc exacte.
+# Les clusters ouverts par le delta sont indexés par une grille 3D sur les vecteurs
+# unitaires de leur graine (cellules de côté corde(3 x RADIUS_KM), 27 cellules
+# voisines) : le centroïde reste à moins de RADIUS_KM de la graine, un cluster à
+# moins de 2 x RADIUS_KM du point a donc sa graine dans le voisinage de la cellule.
+# Avec un résultat au format compact, l'assignation ne lit que clusters.parquet
+# (centroïdes indexés) et les membres des seuls clusters à portée du delta (une passe
+# sans tri sur labels.npy, puis leurs lignes seulement : accès direct si l'entrée est un
+# répertoire .npy, mais un CSV ou un parquet est relu en flux en entier, voir load_rows).
+# La sortie est par défaut un résultat complet (labels de la base puis du delta, résumé
+# mis à jour, points base + delta recopiés dans points/ en .npy), donc proportionnelle
+# au total. Avec --delta-seul, elle ne contient que le delta (labels des nouveaux sites,
+# résumé des clusters touchés, `base` dans meta.json) : le coût suit alors la taille du
+# delta pour des entrées .npy, et une chaîne de tels deltas peut servir de base.
+# Un res.csv, lui, est relu et résumé en entier, et réécrit complété des nouveaux sites.
+
+
+def add_points(summary, members_of, new_lats, new_lons, new_pirs, max_pir, radius_km):
+    # summary : résumé des clusters existants (cluster_id, points_count, pir_total, centroïde) ;
+    # members_of(ids) -> {cluster_id: (lats, lons)}, appelé une fois pour les seuls clusters
+    # à portée du delta. Renvoie (labels des nouveaux sites, résumé des clusters touchés :
+    # existants étendus puis ouverts par le delta, mêmes colonnes que cluster_summary).
+    cluster_ids = summary['cluster_id'].values
+    pir_total = summary['pir_total'].values.astype(np.float64)
+    centroid_lat = summary['centroid_lat'].values
+    centroid_lon = summary['centroid_lon'].values
+
+    new_lats = np.asarray(new_lats, dtype=np.float64)
+    new_lons = np.asarray(new_lons, dtype=np.float64)
+    new_pirs = np.asarray(new_pirs, dtype=np.float64)
+    candidates = np.empty(len(new_lats), dtype=object)
+    if len(cluster_ids):
+        tree = BallTree(np.radians(np.column_stack((centroid_lat, centroid_lon))), metric='haversine')
+        candidates[:] = list(tree.query_radius(np.radians(np.column_stack((new_lats, new_lons))),
+                                               r=3 * radius_km / EARTH_RADIUS_KM))
+    else:
+        candidates[:] = [np.empty(0, dtype=np.int64)] * len(new_lats)
+    # le PIR des clusters ne fait que croître : les candidats avec de la marge au départ suffisent
+    reachable = [ks[pir_total[ks] + pir <= max_pir] for ks, pir in zip(candidates, new_pirs)]
+    reachable = np.unique(np.concatenate(reachable)) if len(reachable) else np.empty(0, dtype=np.int64)
+    members = members_of(cluster_ids[reachable])
+
+    states = {}  # k -> ClusterState des clusters existants touchés par le delta
+    extended = set()
+    current_lat, current_lon = centroid_lat.astype(np.float64), centroid_lon.astype(np.float64)
+
+    def state_of(k):
+        if k not in states:
+            lats, lons = (np.asarray(v, dtype=np.float64) for v in members[int(cluster_ids[k])])
+            state = ClusterState(len(lats) + 16, radius_km)
+            for lat, lon, vec in zip(lats, lons, to_unit_vectors(lats, lons)):
+                state.add(lat, lon, vec)
+            states[k] = state
+            current_lat[k], current_lon[k] = state.centroid()
+        return states[k]
+
+    # clusters ouverts par le delta : états, PIR et centroïdes courants
+    new_states, new_pir, new_centroids = [], [], []
+    buckets = {}  # cellule de la graine -> clusters ouverts par le delta
+    offsets = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+    next_id = (cluster_ids.max() + 1) if len(cluster_ids) else 1
+
+    new_xyz = to_unit_vectors(new_lats, new_lons)
+    new_cells = [tuple(c) for c in np.floor(new_xyz / chord_from_km(3 * radius_km)).astype(np.int64).tolist()]
+    result = np.empty(len(new_lats), dtype=np.int64)
+    for i in range(len(new_lats)):
+        lat, lon, vec, pir = new_lats[i], new_lons[i], new_xyz[i], new_pirs[i]
+        # options : (distance au centroïde courant, 0 = cluster existant / 1 = nouveau, index)
+        ks = candidates[i][pir_total[candidates[i]] + pir <= max_pir]
+        options = list(zip(haversine_km(current_lat[ks], current_lon[ks], lat, lon), [0] * len(ks), ks))
+        cx, cy, cz = new_cells[i]
+        near = [j for dx, dy, dz in offsets for j in buckets.get((cx + dx, cy + dy, cz + dz), ())
+                if new_pir[j] + pir <= max_pir]
+        if near:
+            c = np.array([new_centroids[j] for j in near])
+            d = haversine_km(c[:, 0], c[:, 1], lat, lon)
+            options.extend((d[m], 1, near[m]) for m in np.flatnonzero(d <= 2 * radius_km))
+
+        for _, kind, k in sorted(options):
+            state = state_of(k) if kind == 0 else new_states[k]
+            if state.try_add(lat, lon, vec):
+                if kind == 0:
+                    pir_total[k] += pir
+                    current_lat[k], current_lon[k] = state.centroid()
+                    extended.add(k)
+                    result[i] = cluster_ids[k]
+                else:
+                    new_pir[k] += pir
+                    new_centroids[k] = state.centroid()
+                    result[i] = next_id + k
+                break
+        else:
+            # aucun cluster avec de la marge : nouveau cluster
+            state = ClusterState(16, radius_km)
+            state.add(lat, lon, vec)
+            new_states.append(state)
+            new_pir.append(pir)
+            new_centroids.append(state.centroid())
+            buckets.setdefault(new_cells[i], []).append(len(new_states) - 1)
+            result[i] = next_id + len(new_states) - 1
+
+    touched = sorted(extended)
+    all_states = [states[k] for k in touched] + new_states
+    centroids = np.array([state.centroid() for state in all_states]).reshape(-1, 2)
+    touched_summary = pd.DataFrame({
+        'cluster_id': np.concatenate((cluster_ids[touched], next_id + np.arange(len(new_states)))).astype(np.int64),
+        'points_count': np.array([state.size for state in all_states], dtype=np.int64),
+        'radius_km': np.array([_radius_km(state) for state in all_states]),
+        'pir_total': np.concatenate((pir_total[touched], new_pir)).astype(np.float64),
+        'centroid_lat': centroids[:, 0],
+        'centroid_lon': centroids[:, 1],
+    })
+    return result, touched_summary
+
+
+def _radius_km(state):
+    # Distance max des membres au centroïde (moyenne LAT/LON), comme cluster_summary
+    c_lat, c_lon = state.centroid()
+    center = to_unit_vectors(np.array([c_lat]), np.array([c_lon]))[0]
+    diff = state.members[:state.size] - center
+    return float(km_from_chord(np.sqrt(np.einsum('ij,ij->i', diff, diff).max())))
+
+
+def summary_members(labels, lats, lons, pirs):
+    # Résultat chargé en entier (CSV) : résumé par cluster et accès aux membres par tri
+    summary, order, starts = cluster_summary(labels, lats, lons, pirs)
+    bounds = np.append(starts, len(order))
+    cluster_ids = summary['cluster_id'].values
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    def members_of(ids):
+        positions = np.searchsorted(cluster_ids, ids)
+        return {int(cluster_ids[k]): (lats[order[bounds[k]:bounds[k + 1]]], lons[order[bounds[k]:bounds[k + 1]]])
+                for k in positions}
+    return summary, members_of
+
+
+def merge_summaries(summary, touched):
+    # Résumé mis à jour : lignes des clusters touchés remplacées, nouveaux clusters ajoutés
+    kept = summary[~summary['cluster_id'].isin(touched['cluster_id'])]
+    return pd.concat([kept, touched[summary.columns]], ignore_index=True).sort_values(
+        'cluster_id', kind='stable', ignore_index=True)
+
+
+if __name__ == "__main__":
+    print("\n\n\n###################################################################")
+    print("#                   Clustering incrémental                        #")
+    print("################################################################### \n\n\n")
+
+    parser = argparse.ArgumentParser(description="Ajout de nouveaux sites à un résultat existant")
+    parser.add_argument("resultat",
+                        help="résultat existant : CSV avec LAT, LON, PIR, cluster ou répertoire du format compact")
+    parser.add_argument("delta", help="nouveaux sites : CSV, .parquet ou répertoire .npy")
+    parser.add_argument("max_pir", type=float, help="PIR maximal par cluster")
+    parser.add_argument("--sortie",
+                        help="résultat complété : répertoire compact (par défaut res_incremental) pour un "
+                             "résultat compact, sinon CSV (par défaut res_incremental.csv)")
+    parser.add_argument("--delta-seul", action="store_true",
+                        help="format compact : n'écrire que le delta (nouveaux sites, clusters touchés), "
+                             "relié à sa base par meta.json")
+    parser.add_argument("--entree", help="format compact : données d'origine (par défaut celles de meta.json)")
+    args = parser.parse_args()
+
+    RADIUS_KM = 45
+
+    print("Lecture des données...")
+    compact = is_compact(args.resultat)
+    if args.delta_seul and not compact:
+        parser.error("--delta-seul demande un résultat compact (le lien vers la base est gardé dans meta.json)")
+    sortie = args.sortie or ("res_incremental" if compact else "res_incremental.csv")
+    if compact:
+        # résultat complet, éventuellement suivi de deltas (--delta-seul) : résumés fusionnés dans l'ordre
+        chaine = compact_chain(args.resultat)
+        if os.path.abspath(sortie) in {os.path.abspath(chemin) for chemin, *_ in chaine}:
+            parser.error(f"--sortie {sortie} écraserait le résultat de base")
+        entrees = [args.entree or chaine[0][3]['entree']] + [meta['entree'] for *_, meta in chaine[1:]]
+        resume = chaine[0][2]
+        for _, _, resume_delta, _ in chaine[1:]:
+            resume = merge_summaries(resume, resume_delta)
+        nb_existants = sum(len(labels) for _, labels, _, _ in chaine)
+
+        def membres(ids):
+            parts = {}
+            for (chemin, *_), entree in zip(chaine, entrees):
+                for c, (lats, lons) in load_cluster_members(chemin, ids, entree).items():
+                    parts.setdefault(c, []).append((lats, lons))
+            return {c: tuple(np.concatenate(v) for v in zip(*p)) for c, p in parts.items()}
+    else:
+        existant = load_labeled_points(args.resultat)
+        nb_existants = len(existant)
+        resume, membres = summary_members(existant['cluster'].values, existant['LAT'].values,
+                                          existant['LON'].values, existant['PIR'].values)
+    delta = load_points(args.delta)
+    print(f"Résultat existant: {nb_existants} lignes, {len(resume)} clusters - Nouveaux sites: {len(delta)}")
+
+    start_time = time.time()
+    delta['cluster'], touches = add_points(resume, membres, delta['LAT'].values, delta['LON'].values,
+                                           delta['PIR'].values, args.max_pir, RADIUS_KM)
+    # Résumé limité aux clusters du delta (les identifiants nouveaux suivent le plus grand existant)
+    labels_delta = delta['cluster'].values
+    ajoutes = labels_delta <= (resume['cluster_id'].max() if len(resume) else 0)
+    print(f"Assignation terminée en {time.time() - start_time:.2f}s - {ajoutes.sum()} sites ajoutés "
+          f"à {len(np.unique(labels_delta[ajoutes]))} clusters existants, "
+          f"{len(np.unique(labels_delta[~ajoutes]))} nouveaux clusters")
+
+    if compact and args.delta_seul:
+        write_compact(sortie, labels_delta, None, None, None, summary=touches,
+                      meta={'entree': os.path.abspath(args.delta), 'base': os.path.abspath(args.resultat),
+                            'max_pir': args.max_pir, 'rayon_km': RADIUS_KM})
+    elif compact:
+        # résultat complet : les points base + delta sont recopiés, le résultat se relit seul
+        points = os.path.join(sortie, "points")
+        concat_points(entrees + [args.delta], points)
+        labels = np.concatenate([np.asarray(labels) for _, labels, _, _ in chaine] + [labels_delta])
+        write_compact(sortie, labels, None, None, None, summary=merge_summaries(resume, touches),
+                      meta={'entree': os.path.abspath(points), 'resultat_initial': args.resultat, 'delta': args.delta,
+                            'max_pir': args.max_pir, 'rayon_km': RADIUS_KM})
+    else:
+        pd.concat([existant, delta], ignore_index=True).to_csv(sortie, index=False)
+    print(f"\nRésultats enregistrés dans '{sortie}'.")
+
+    print("\n\n\n###################################################################")
+    print("#                  fin du clustering incrémental                  #")
+    print("################################################################### \n\n\n")
@@ -0,0 +1,122 @@
+import contextlib
+import cProfile
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows : pas de getrusage, pics de RSS indisponibles (None)
+    resource = None
+
+# Instrumentation des exécutions : durée et mémoire (RSS début / fin / pic) de chaque
+# phase, compteurs (voisins parcourus, rejets rayon / PIR, clusters créés), rapport JSON
+# par exécution et profilage cProfile optionnel des phases choisies.
+# Pas de thread d'échantillonnage (les phases créent des pools par fork) : le pic
+# vient de getrusage aux bornes de la phase. Si le processus atteint un nouveau
+# maximum pendant la phase, c'est le pic exact ; sinon le pic de la phase reste
+# sous le maximum antérieur et on retient max(début, fin), un minorant signalé par
+# rss_pic_minorant dans le rapport. Le pic des processus fils terminés pendant la
+# phase (pools) est noté à part.
+
+
+def current_rss_mb():
+    # RSS courant (Linux : /proc/self/statm), sinon pic depuis le début du processus
+    # (None si aucun des deux n'est disponible)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb(children=False):
+    # children : plus gros processus fils terminé (et attendu) ; None sans getrusage
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024  # octets sous macOS, Ko sinon
+
+
+
+def _round(mb):
+    return None if mb is None else round(mb, 1)
+
+
+class Metrics:
+    def __init__(self, name, profile=(), profile_dir="profils"):
+        # profile : noms des phases à exécuter sous cProfile ('*' = toutes)
+        self.name = name
+        self.phases = {}
+        self.counters = {}
+        self.params = {}
+        self.profile = set(profile)
+        self.profile_dir = profile_dir
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        rss_start = current_rss_mb()
+        max_start = peak_rss_mb()
+        children_start = peak_rss_mb(children=True)
+        profiler = None
+        if name in self.profile or '*' in self.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._dump_profile(name, profiler)
+            rss_end = current_rss_mb()
+            record = self.phases.setdefault(name, {'secondes': 0.0, 'rss_debut_mo': _round(rss_start)})
+            record['secondes'] = round(record['secondes'] + seconds, 4)
+            record['rss_fin_mo'] = _round(rss_end)
+            max_end = peak_rss_mb()
+            if max_end is None or rss_start is None:
+                record['rss_pic_mo'] = None
+            else:
+                exact = max_end > max_start
+                peak = max_end if exact else max(rss_start, rss_end)
+                if peak > (record.get('rss_pic_mo') or 0):
+                    record['rss_pic_mo'] = round(peak, 1)
+                    record['rss_pic_minorant'] = not exact
+                children = peak_rss_mb(children=True)
+                if children > children_start:
+                    record['rss_pic_fils_mo'] = round(max(children, record.get('rss_pic_fils_mo', 0)), 1)
+
+    def _dump_profile(self, name, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{self.name}_{name}.prof")
+        profiler.dump_stats(path)
+        print(f"Profil de la phase '{name}' enregistré dans '{path}' (les 10 fonctions les plus coûteuses) :")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(10)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def set(self, **params):
+        self.params.update(params)
+
+    def report(self):
+        return {
+            'execution': self.name,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'parametres': self.params,
+            'duree_totale_s': round(time.perf_counter() - self.start, 4),
+            'rss_pic_mo': _round(peak_rss_mb()),
+            'phases': self.phases,
+            'compteurs': self.counters,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Rapport de mesures enregistré dans '{path}'.")
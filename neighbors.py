@@ -0,0 +1,302 @@
+import itertools
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+from sklearn.neighbors import BallTree
+
+from geo import EARTH_RADIUS_KM
+
+# Moteurs de recherche des voisins -> étiquette des graphes dans le cache disque
+# (mêmes voisins, mais dans un ordre différent pour chaque point)
+NEIGHBOR_BACKENDS = {"balltree": "haversine", "kdtree": "corde"}
+# Marge absolue sur le rayon de corde (~6 m sur la sphère terrestre) : couvre
+# l'arrondi des vecteurs unitaires float32, le filtre haversine fait le reste
+CHORD_MARGIN = 1e-6
+# Budget des lots de comptage exact (points incertains de ChordKDTree) : les listes
+# de voisins de query_ball_point coûtent ~UNSURE_BYTES_PER_NEIGHBOR octets par voisin
+UNSURE_BATCH_BYTES = 32 * 1024 * 1024
+UNSURE_BYTES_PER_NEIGHBOR = 96
+
+
+class RadiusGraph:
+    # Graphe de voisinage au format CSR : les voisins du point i sont
+    # indices[indptr[i]:indptr[i + 1]] (le point lui-même est exclu).
+    # `distances` (optionnel) : distances des arêtes, dans l'unité de l'arbre.
+
+    def __init__(self, indptr, indices, distances=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def degrees(self):
+        return np.diff(self.indptr).astype(np.int32)
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def to_sparse(self):
+        # Matrice scipy CSR des distances (les zéros explicites restent des voisins)
+        from scipy.sparse import csr_matrix
+        n = len(self)
+        return csr_matrix((self.distances, self.indices, self.indptr), shape=(n, n))
+
+
+class ChordKDTree:
+    # Alternative au BallTree haversine, même interface query_radius que sklearn.
+    # LAT/LON (radians) sont convertis une seule fois en vecteurs unitaires ECEF
+    # float32 ; la recherche est euclidienne (scipy cKDTree) au rayon de corde
+    # 2 sin(r / 2), sans trigonométrie par nœud. Seuls les candidats à moins de
+    # CHORD_MARGIN de la frontière sont départagés par la distance haversine
+    # réduite, calculée et comparée comme le BallTree (sin²(r / 2)) : les
+    # ensembles de voisins sont les mêmes. Voisins rendus par index croissant.
+    # cKDTree libère le GIL : build_radius_graph répartit les lots sur des threads.
+
+    # mémoire de travail par voisin d'un lot (paires, clés de tri, filtre) pour fill_batch_bounds
+    bytes_per_neighbor = 64
+
+    def __init__(self, coords, leaf_size=100):
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.tree = cKDTree(_unit_vectors(self.coords).astype(np.float32), leafsize=leaf_size)
+
+    def _search(self, X, r, exact_distance=False):
+        # Paires (requête, voisin) triées, filtrées au rayon r. Renvoie le nombre de
+        # voisins par requête, les voisins et, avec exact_distance, leur rdist haversine.
+        chord = 2.0 * np.sin(0.5 * min(r, np.pi))
+        query = cKDTree(_unit_vectors(X).astype(np.float32), leafsize=self.tree.leafsize)
+        pairs = query.sparse_distance_matrix(self.tree, chord + CHORD_MARGIN, output_type='ndarray')
+        key = pairs['i'].astype(np.int64)
+        key *= len(self.coords)
+        key += pairs['j']
+        pairs = pairs[np.argsort(key)]
+        del key
+        rows, cols = pairs['i'], pairs['j']
+        keep = pairs['v'] < chord - CHORD_MARGIN
+        check = np.arange(len(rows)) if exact_distance else np.flatnonzero(~keep)
+        lat1, lon1 = X[rows[check], 0], X[rows[check], 1]
+        lat2, lon2 = self.coords[cols[check], 0], self.coords[cols[check], 1]
+        a = np.sin(0.5 * (lat2 - lat1)) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(0.5 * (lon2 - lon1)) ** 2
+        keep[check] = a <= np.sin(0.5 * r) ** 2
+        return np.bincount(rows[keep], minlength=len(X)), cols[keep], a[keep] if exact_distance else None
+
+    def _count_exact(self, X, xyz, r):
+        # Nombre de voisins au rayon r : candidats de la boule de corde élargie
+        # (query_ball_point), tous départagés par la distance haversine réduite
+        neighs = self.tree.query_ball_point(xyz, 2.0 * np.sin(0.5 * min(r, np.pi)) + CHORD_MARGIN,
+                                            return_sorted=False)
+        lengths = np.fromiter(map(len, neighs), dtype=np.int64, count=len(neighs))
+        cols = np.fromiter(itertools.chain.from_iterable(neighs), dtype=np.int64, count=int(lengths.sum()))
+        del neighs
+        rows = np.repeat(np.arange(len(X)), lengths)
+        lat1, lon1 = X[rows, 0], X[rows, 1]
+        lat2, lon2 = self.coords[cols, 0], self.coords[cols, 1]
+        a = np.sin(0.5 * (lat2 - lat1)) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(0.5 * (lon2 - lon1)) ** 2
+        return np.bincount(rows[a <= np.sin(0.5 * r) ** 2], minlength=len(X))
+
+    def query_radius(self, X, r, count_only=False, return_distance=False):
+        X = np.asarray(X, dtype=np.float64)
+        if count_only:
+            # Comptes sans construire les paires : boules de corde réduite et élargie ;
+            # seuls les points dont les deux comptes diffèrent sont recomptés exactement,
+            # par lots bornés par UNSURE_BATCH_BYTES (d'après le compte élargi)
+            chord = 2.0 * np.sin(0.5 * min(r, np.pi))
+            xyz = _unit_vectors(X).astype(np.float32)
+            inner = self.tree.query_ball_point(xyz, chord - CHORD_MARGIN, return_length=True)
+            counts = self.tree.query_ball_point(xyz, chord + CHORD_MARGIN, return_length=True)
+            unsure = np.flatnonzero(inner != counts)
+            for start, end in fill_batch_bounds(counts[unsure], UNSURE_BATCH_BYTES, len(unsure),
+                                                UNSURE_BYTES_PER_NEIGHBOR):
+                rows = unsure[start:end]
+                counts[rows] = self._count_exact(X[rows], xyz[rows], r)
+            return counts
+        counts, cols, a = self._search(X, r, exact_distance=return_distance)
+        split = np.cumsum(counts)[:-1]
+        indices = np.empty(len(X), dtype=object)
+        indices[:] = np.split(cols, split)
+        if not return_distance:
+            return indices
+        distances = np.empty(len(X), dtype=object)
+        distances[:] = np.split(2.0 * np.arcsin(np.sqrt(a)), split)
+        return indices, distances
+
+
+def _unit_vectors(coords):
+    # LAT/LON (radians) -> vecteurs unitaires ECEF (x, y, z)
+    cos_lat = np.cos(coords[:, 0])
+    return np.column_stack((cos_lat * np.cos(coords[:, 1]), cos_lat * np.sin(coords[:, 1]), np.sin(coords[:, 0])))
+
+
+def neighbor_tree(coords, backend="balltree"):
+    # Arbre de recherche des voisins sur LAT/LON (radians), métrique haversine
+    if backend == "kdtree":
+        return ChordKDTree(coords)
+    return BallTree(coords, metric='haversine', leaf_size=100)
+
+
+def default_workers():
+    # Processus par défaut des scripts : tous les cœurs si fork est disponible ; sinon
+    # (spawn) 1, car les scripts sans garde __main__ seraient réexécutés par chaque processus
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return os.cpu_count() or 1
+    return 1
+
+
+def process_pool(workers, initializer, initargs):
+    # Pool de processus ; fork quand il est disponible pour que les gros tableaux
+    # passés à l'initialiseur soient partagés sans copie et que le script
+    # principal (sans garde __main__) ne soit pas réimporté par les processus
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                               initializer=initializer, initargs=initargs)
+
+
+# Arbre partagé (lecture seule) par les processus de calcul : hérité par fork
+# sous Linux, transmis une seule fois par processus sinon
+_tree = None
+_coords = None
+_radius = None
+
+
+def _init_worker(tree, coords, radius):
+    global _tree, _coords, _radius
+    _tree, _coords, _radius = tree, coords, radius
+
+
+def _count_batch(start, end):
+    return _tree.query_radius(_coords[start:end], r=_radius, count_only=True)
+
+
+def _fill_batch(start, end, return_distance=False):
+    # Voisins des points start..end-1 concaténés, le point lui-même exclu
+    if not return_distance:
+        batch_indices = _tree.query_radius(_coords[start:end], r=_radius)
+        parts = [neighs[neighs != start + j] for j, neighs in enumerate(batch_indices)]
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return np.concatenate(parts).astype(np.int32)
+    batch_indices, batch_dists = _tree.query_radius(_coords[start:end], r=_radius, return_distance=True)
+    keep = [neighs != start + j for j, neighs in enumerate(batch_indices)]
+    if not keep:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    return (np.concatenate([n[k] for n, k in zip(batch_indices, keep)]).astype(np.int32),
+            np.concatenate([d[k] for d, k in zip(batch_dists, keep)]))
+
+
+def _run_ordered(executor, func, bounds, max_in_flight, *args):
+    # Soumet les lots au pool et rend les résultats dans l'ordre des lots,
+    # avec un nombre borné de lots en vol pour garder la mémoire plate
+    pending = deque()
+    for start, end in bounds:
+        pending.append((start, end, executor.submit(func, start, end, *args)))
+        if len(pending) >= max_in_flight:
+            s, e, fut = pending.popleft()
+            yield s, e, fut.result()
+    while pending:
+        s, e, fut = pending.popleft()
+        yield s, e, fut.result()
+
+
+def fill_batch_bounds(counts, budget_bytes, max_points, bytes_per_neighbor=8):
+    # Découpe en lots selon la densité locale : un lot s'arrête dès que la
+    # sortie estimée de query_radius (indices int64 + surcoût par tableau)
+    # dépasse le budget, ou qu'il atteint max_points
+    cost = np.cumsum(counts * bytes_per_neighbor + 112)
+    bounds = []
+    start = 0
+    num_points = len(counts)
+    while start < num_points:
+        base = cost[start - 1] if start > 0 else 0
+        end = int(np.searchsorted(cost, base + budget_bytes, side='right'))
+        end = min(max(end, start + 1), start + max_points, num_points)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def build_radius_graph(tree, coords, radius, workers=1, memory_mb=256, progress=None,
+                       return_distance=False):
+    # Construction en deux passes pour que la mémoire reste préallouée :
+    # 1) query_radius(count_only=True) pour dimensionner indptr/indices
+    # 2) remplissage lot par lot directement dans le tableau final
+    # Les lots sont répartis sur `workers` processus partageant le même arbre ;
+    # les résultats sont assemblés dans l'ordre des points (sortie déterministe).
+    # Avec return_distance, les distances des arêtes (calculées par l'arbre) sont
+    # conservées dans graph.distances.
+    # ChordKDTree : les lots sont répartis sur `workers` threads (cKDTree libère le GIL).
+    num_points = len(coords)
+    workers = max(1, workers)
+    budget_bytes = memory_mb * 1024 * 1024 // (2 * workers)  # 2 lots en vol par processus
+
+    count_size = max(1, min(100_000, -(-num_points // (4 * workers))))
+    count_bounds = [(i, min(i + count_size, num_points)) for i in range(0, num_points, count_size)]
+
+    if workers == 1:
+        _init_worker(tree, coords, radius)
+        executor = None
+    elif isinstance(tree, ChordKDTree):
+        _init_worker(tree, coords, radius)
+        executor = ThreadPoolExecutor(max_workers=workers)
+    else:
+        executor = process_pool(workers, _init_worker, (tree, coords, radius))
+    try:
+        counts = np.empty(num_points, dtype=np.int64)
+        if executor is None:
+            results = ((s, e, _count_batch(s, e)) for s, e in count_bounds)
+        else:
+            results = _run_ordered(executor, _count_batch, count_bounds, 2 * workers)
+        for start, end, batch_counts in results:
+            counts[start:end] = batch_counts
+
+        indptr = np.zeros(num_points + 1, dtype=np.int64)
+        np.cumsum(counts - 1, out=indptr[1:])  # -1 pour exclure le point lui-même
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        distances = np.empty(indptr[-1], dtype=np.float64) if return_distance else None
+
+        fill_bounds = fill_batch_bounds(counts, budget_bytes // (2 if return_distance else 1),
+                                        max(count_size, 1000), getattr(tree, 'bytes_per_neighbor', 8))
+        if executor is None:
+            results = ((s, e, _fill_batch(s, e, return_distance)) for s, e in fill_bounds)
+        else:
+            results = _run_ordered(executor, _fill_batch, fill_bounds, 2 * workers, return_distance)
+        for start, end, batch in results:
+            if return_distance:
+                batch, batch_dists = batch
+                distances[indptr[start]:indptr[end]] = batch_dists
+            indices[indptr[start]:indptr[end]] = batch
+            if progress is not None:
+                progress(end, num_points)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        _init_worker(None, None, None)
+
+    return RadiusGraph(indptr, indices, distances)
+
+
+def graph_from_pairs(num_points, rows, cols):
+    # Graphe CSR à partir d'une liste de paires (i, j) non orientées
+    rows = np.asarray(rows, dtype=np.int32)
+    cols = np.asarray(cols, dtype=np.int32)
+    src = np.concatenate((rows, cols))
+    dst = np.concatenate((cols, rows))
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(num_points + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_points), out=indptr[1:])
+    return RadiusGraph(indptr, dst[order])
+
+
+def latlon_radius_graph(lats, lons, radius_km, workers=1, memory_mb=256, progress=None, backend="balltree"):
+    # Raccourci : arbre haversine sur LAT/LON (degrés) + graphe CSR au rayon donné
+    coords = np.radians(np.column_stack((lats, lons)).astype(np.float32))
+    tree = neighbor_tree(coords, backend)
+    return build_radius_graph(tree, coords, radius_km / EARTH_RADIUS_KM, workers=workers,
+                              memory_mb=memory_mb, progress=progress)
@@ -1,111 +1,175 @@
-import pandas as pd
 import numpy as np
-from sklearn.cluster import OPTICS
-from sklearn.metrics.pairwise import haversine_distances
 import time
-import sys
+import argparse
+
+from cache import CACHE_DIR, CACHE_MAX_MB, cached_radius_graph
+from checkpoint import CHECKPOINT_DIR, Checkpoint
+from dataset import load_points
+from density import build_haversine_graph, enforce_constraints, optics_labels
+from metrics import Metrics
+from neighbors import NEIGHBOR_BACKENDS, default_workers
+from refine import merge_clusters
+from tiling import cluster_tiles
 
 print("\n\n\n###################################################################")
 print("#                     Clustering avec OPTICS                      #")
 print("################################################################### \n\n\n")
 
-if len(sys.argv) != 2:
+parser = argparse.ArgumentParser(description="Clustering avec OPTICS")
+parser.add_argument("max_pir", nargs="?", type=float, help="PIR maximal par cluster (4000 par défaut)")
+parser.add_argument("--entree", default="generated.csv",
+                    help="données d'entrée : CSV, .parquet ou répertoire .npy (voir dataset.py)")
+parser.add_argument("--workers", type=int, default=default_workers(),
+                    help="nombre de processus de calcul (1 par défaut sans fork)")
+parser.add_argument("--tuiles", type=float, default=0, metavar="KM",
+                    help="mode partitionné : taille des tuiles en km (0 = désactivé)")
+parser.add_argument("--precalcule", action="store_true",
+                    help="graphe creux des distances haversine précalculé (metric='precomputed')")
+parser.add_argument("--recherche", choices=NEIGHBOR_BACKENDS, default="balltree",
+                    help="recherche des voisins : BallTree haversine ou KD-tree sur vecteurs unitaires 3D "
+                         "(mêmes voisins, voir neighbors.py ; kdtree implique --precalcule)")
+parser.add_argument("--fusion", action="store_true",
+                    help="fusionner ensuite les clusters voisins tant que diamètre et PIR tiennent (voir refine.py)")
+parser.add_argument("--cache", action="store_true",
+                    help="réutiliser le graphe stocké sur disque (implique --precalcule)")
+parser.add_argument("--cache-dir", default=CACHE_DIR, help="répertoire du cache des graphes")
+parser.add_argument("--cache-max-mo", type=int, default=CACHE_MAX_MB, help="taille maximale du cache (Mo)")
+parser.add_argument("--controle", action="store_true",
+                    help="points de contrôle : graphe (--precalcule) puis labels OPTICS bruts sauvegardés")
+parser.add_argument("--reprise", action="store_true",
+                    help="reprendre au dernier point de contrôle (mêmes données et paramètres, mêmes labels)")
+parser.add_argument("--controle-dir", default=CHECKPOINT_DIR, help="répertoire des points de contrôle")
+parser.add_argument("--rapport", default="rapport_optics.json",
+                    help="rapport JSON des mesures (durée et mémoire par phase, compteurs)")
+parser.add_argument("--profil", nargs="+", default=(), metavar="PHASE",
+                    help="phases à profiler avec cProfile (clustering, post_traitement... ou '*')")
+args = parser.parse_args()
+# graphe creux précalculé : demandé, relu du cache ou construit par le KD-tree
+precalcule = args.precalcule or args.cache or args.recherche == "kdtree"
+if (args.controle or args.reprise) and args.tuiles:
+    parser.error("--controle/--reprise ne sont pas disponibles avec --tuiles")
+mesures = Metrics("optics", profile=args.profil)
+
+if args.max_pir is None:
     print("Usage: python optics.py <max_pir_per_cluster>")
     print("Utilisation de la valeur 4000 par défaut\n\n")
     MAX_PIR_PER_CLUSTER = 4000.0
 else: 
-    MAX_PIR_PER_CLUSTER = float(sys.argv[1])
+    MAX_PIR_PER_CLUSTER = args.max_pir
 
 # Paramètres
 RADIUS_KM = 45
-EPS_RAD = RADIUS_KM / 6371.0  # pour post-traitement
+
+# Points de contrôle : graphe et labels bruts ne dépendent pas du PIR maximal
+# (le post-traitement est refait à chaque reprise)
+controle = None
+if args.controle or args.reprise:
+    try:
+        controle = Checkpoint(args.controle_dir, args.entree,
+                              dict(script="optics", rayon_km=RADIUS_KM, precalcule=precalcule,
+                                   recherche=args.recherche),
+                              resume=args.reprise)
+    except ValueError as e:
+        parser.error(str(e))
 
 # Lecture des données
-print("Lecture du fichier CSV...")
-dtype_dict = {
-    'LAT': np.float32,
-    'LON': np.float32,
-    'PIR': np.float32
-}
-df = pd.read_csv("generated.csv", dtype=dtype_dict)
+print(f"Lecture des données ({args.entree})...")
+with mesures.phase('chargement'):
+    df = load_points(args.entree)
 print(f"Chargement terminé: {len(df)} lignes")
+mesures.set(entree=args.entree, lignes=len(df), max_pir=MAX_PIR_PER_CLUSTER, rayon_km=RADIUS_KM,
+            workers=args.workers, tuiles_km=args.tuiles, precalcule=precalcule, recherche=args.recherche,
+            fusion=args.fusion, controle=controle is not None, reprise=args.reprise)
 
 coords = np.radians(df[['LAT', 'LON']].values)
 
-# Clustering OPTICS
-print("\nLancement du clustering OPTICS...")
-optics_model = OPTICS(metric='haversine', min_samples=2, cluster_method='xi', xi=0.05)
-optics_model.fit(coords)
-df['cluster'] = optics_model.labels_
-
-print("Clustering OPTICS terminé.")
-
-# --- Post-traitement : respect des contraintes de rayon et PIR ---
-def cluster_diameter_km(cluster_coords):
-    if len(cluster_coords) < 2:
-        return 0
-    dists = haversine_distances(cluster_coords)
-    return np.max(dists) * 6371
-
-def split_cluster(indices, coords, pirs):
-    clusters = []
-    current = []
-    current_pir = 0
-    for idx in indices:
-        if current:
-            temp_coords = coords[current + [idx]]
-            temp_pir = current_pir + pirs[idx]
-            if (cluster_diameter_km(temp_coords) > RADIUS_KM) or (temp_pir > MAX_PIR_PER_CLUSTER):
-                clusters.append(current)
-                current = [idx]
-                current_pir = pirs[idx]
-            else:
-                current.append(idx)
-                current_pir = temp_pir
-        else:
-            current = [idx]
-            current_pir = pirs[idx]
-    if current:
-        clusters.append(current)
-    return clusters
-
-print("\nDébut du post-traitement pour contraintes de PIR et rayon...")
-new_labels = np.full(len(df), -1, dtype=int)
-next_label = 1
-start_time = time.time()
-
-unique_clusters = sorted(df['cluster'].unique())
-for i, label in enumerate(unique_clusters):
-    if label == -1:
-        continue  # bruit
-    indices = df.index[df['cluster'] == label].tolist()
-    cluster_coords = coords[indices]
-    cluster_pirs = df['PIR'].values[indices]
-    if (cluster_diameter_km(cluster_coords) <= RADIUS_KM) and (cluster_pirs.sum() <= MAX_PIR_PER_CLUSTER):
-        new_labels[indices] = next_label
-        next_label += 1
-    else:
-        # split en sous-clusters respectant les contraintes
-        splits = split_cluster(indices, coords, df['PIR'].values)
-        for split in splits:
-            new_labels[split] = next_label
-            next_label += 1
-    if (i + 1) % 100 == 0 or (i + 1) == len(unique_clusters):
+if args.tuiles:
+    # Mode partitionné : tuiles + halo clusterisées en parallèle
+    print(f"\nClustering OPTICS par tuiles de {args.tuiles:.0f} km ({args.workers} processus)...")
+    start_time = time.time()
+
+    def afficher_tuiles(done, total):
+        elapsed = time.time() - start_time
+        print(f"Tuiles traitées: {done}/{total} - Temps écoulé: {elapsed:.1f}s")
+
+    with mesures.phase('tuiles'):
+        new_labels = cluster_tiles(df['LAT'].values, df['LON'].values, df['PIR'].values, 'optics',
+                                   MAX_PIR_PER_CLUSTER, RADIUS_KM, args.tuiles, workers=args.workers,
+                                   first_label=1, progress=afficher_tuiles,
+                                   precomputed=args.precalcule, backend=args.recherche)
+else:
+    # Clustering OPTICS
+    print("\nLancement du clustering OPTICS...")
+    # Graphe creux au rayon RADIUS_KM, relu depuis le cache disque si possible
+    labels = controle.load_array("labels_optics") if controle is not None else None
+    graph = controle.load_graph() if controle is not None and labels is None else None
+    graphe_repris = graph is not None
+    if labels is not None:
+        print("Labels OPTICS repris du point de contrôle")
+    elif graphe_repris:
+        print("Graphe de voisinage repris du point de contrôle")
+    elif args.cache:
+        def construire_graphe():
+            with mesures.phase('voisins'):
+                return build_haversine_graph(coords, RADIUS_KM / 6371.0, workers=args.workers,
+                                             backend=args.recherche)
+
+        graph, trouve = cached_radius_graph(args.entree, RADIUS_KM, NEIGHBOR_BACKENDS[args.recherche],
+                                            construire_graphe,
+                                            with_distances=True, cache_dir=args.cache_dir,
+                                            max_mb=args.cache_max_mo, metrics=mesures)
+        mesures.set(cache_trouve=trouve)
+        if trouve:
+            print("Graphe de voisinage chargé depuis le cache")
+    elif controle is not None and precalcule:
+        with mesures.phase('voisins'):
+            graph = build_haversine_graph(coords, RADIUS_KM / 6371.0, workers=args.workers,
+                                          backend=args.recherche)
+    if controle is not None and graph is not None and not graphe_repris:
+        controle.save_graph(graph)  # sortie de la phase de voisinage
+
+    # Avec --precalcule, le voisinage est plafonné à RADIUS_KM (max_eps)
+    if labels is None:
+        with mesures.phase('clustering'):
+            labels = optics_labels(coords, min_samples=2, xi=0.05, precomputed=precalcule,
+                                   radius_km=RADIUS_KM, workers=args.workers, graph=graph,
+                                   backend=args.recherche)
+        if controle is not None:
+            controle.save_array("labels_optics", labels)
+
+    print("Clustering OPTICS terminé.")
+
+    # --- Post-traitement : respect des contraintes de rayon et PIR ---
+    print("\nDébut du post-traitement pour contraintes de PIR et rayon...")
+    start_time = time.time()
+
+    def afficher_progression(done, total):
         elapsed = time.time() - start_time
-        percent_done = (i + 1) / len(unique_clusters)
+        percent_done = done / total
         remaining = (elapsed / percent_done) - elapsed
         print(f"Progression: {percent_done*100:.1f}% - Temps restant estimé: {remaining:.1f}s")
 
-# Points bruit → cluster individuel
-noise_indices = df.index[df['cluster'] == -1].tolist()
-for idx in noise_indices:
-    new_labels[idx] = next_label
-    next_label += 1
+    # Points bruit → cluster individuel
+    with mesures.phase('post_traitement'):
+        new_labels = enforce_constraints(labels, coords, df['PIR'].values, MAX_PIR_PER_CLUSTER, RADIUS_KM,
+                                         first_label=1, progress=afficher_progression, progress_every=100,
+                                         metrics=mesures, workers=args.workers)
+
+if args.fusion:
+    # Fusion des clusters voisins (en premier lieu les singletons du bruit) sur les résumés par cluster
+    with mesures.phase('fusion'):
+        new_labels = merge_clusters(new_labels, df['LAT'].values, df['LON'].values, df['PIR'].values,
+                                    MAX_PIR_PER_CLUSTER, RADIUS_KM, constraint='diametre', first_label=1,
+                                    metrics=mesures)
 
 df['cluster'] = new_labels
-df.to_csv("res_optics.csv", index=False)
+with mesures.phase('ecriture'):
+    df.to_csv("res_optics.csv", index=False)
 
 print(f"\nNombre final de clusters: {len(set(new_labels))}")
+mesures.set(nb_clusters=len(set(new_labels)))
+if args.rapport:
+    mesures.write(args.rapport)
 print("\n\n\n###################################################################")
 print("#                     Fin du clustering OPTICS                   #")
 print("################################################################### \n\n\n")
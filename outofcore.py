@@ -0,0 +1,363 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from dataset import CHUNK_ROWS, iter_points
+from metrics import Metrics, current_rss_mb
+from neighbors import latlon_radius_graph
+from tiling import ALGORITHMS, KM_PER_DEG, TileGrid, cluster_points
+
+# Mode hors mémoire (données plus grandes que la RAM) :
+# 1) comptage : lecture en flux, histogramme des points sur une grille fine ;
+#    la taille des tuiles est choisie pour que le clustering de la tuile la plus
+#    chargée (cœur + halo de 2 x RADIUS_KM) tienne dans le budget mémoire. À la
+#    plus petite taille, les tuiles trop chargées sont découpées en sous-tuiles ;
+#    si elles dépassent encore, l'exécution s'arrête avant la répartition
+# 2) répartition : deuxième lecture en flux, chaque point est ajouté au fichier
+#    binaire de sa tuile (index global, LAT, LON, PIR)
+# 3) clustering tuile par tuile (ordre des identifiants) : cœur + halo relus depuis
+#    les fichiers des tuiles voisines, sans les points déjà assignés ; on garde les
+#    clusters dont le centroïde est dans le cœur (et dans la sous-tuile pour une
+#    tuile découpée). Les clusters sont gardés entiers, un point n'est jamais
+#    revendiqué deux fois et les contraintes restent vérifiées.
+# 4) passe finale : les points restés libres sont clusterisés tuile par tuile (cœur seul)
+# 5) écriture : les labels (memmap sur disque) sont réécrits en flux avec les données
+# Seuls un morceau d'entrée et une tuile (+ halo) sont en mémoire à la fois.
+# Le budget (--memoire-mo) porte sur tout le processus : les tuiles disposent de
+# ce qui reste au-dessus du RSS au démarrage (interpréteur, numpy, sklearn...).
+
+RECORD = np.dtype([('index', '<i8'), ('lat', '<f4'), ('lon', '<f4'), ('pir', '<f4')])
+FINE_KM = 25  # grille de comptage
+TILE_CANDIDATES_KM = (1600, 800, 400, 200, 100)
+SUBTILE_CANDIDATES_KM = (50, 25)
+MIN_AVAILABLE_MB = 32
+# Coût du clustering d'une tuile, calibré sur le pic de RSS mesuré (1e4 à 4e4 points
+# de degré 500 à 4300) : par point, par arête du graphe au rayon RADIUS_KM selon
+# l'algorithme (graphe CSR int32 pour balltree, voisinages sklearn pour DBSCAN,
+# matrice creuse float64 + copies pour precalcule), plus une part fixe et les lots
+# de construction du graphe (1/8 du budget des tuiles)
+BYTES_PER_POINT = 1024
+BYTES_PER_EDGE = {('balltree', False): 5, ('dbscan', False): 3, ('optics', False): 1,
+                  ('dbscan', True): 22, ('optics', True): 56}
+FIXED_MB = 32
+
+
+def chunk_rows_for(memory_mb):
+    # Morceaux de lecture : au plus 1/8 du budget (la lecture CSV coûte plusieurs fois la ligne)
+    return int(max(10_000, min(CHUNK_ROWS, memory_mb * 1024 * 1024 // (8 * 64))))
+
+
+def graph_batch_mb(available_mb):
+    return max(8, int(available_mb) // 8)
+
+
+def count_cells(path, chunk_rows):
+    grid = TileGrid(FINE_KM)
+    totals = {}
+    num_points = 0
+    for chunk in iter_points(path, chunk_rows=chunk_rows):
+        cells, counts = np.unique(grid.tile_of(chunk['LAT'].values, chunk['LON'].values), return_counts=True)
+        for cell, count in zip(cells.tolist(), counts.tolist()):
+            totals[cell] = totals.get(cell, 0) + count
+        num_points += len(chunk)
+    cells = np.array(sorted(totals), dtype=np.int64)
+    return grid, cells, np.array([totals[c] for c in cells], dtype=np.int64), num_points
+
+
+def cell_degrees(c_lat, c_lon, counts, radius_km):
+    # Voisins estimés d'un point de chaque cellule de comptage : points des cellules
+    # dont le centre est à moins de radius_km + FINE_KM / 2 (cellule comprise)
+    graph = latlon_radius_graph(c_lat, c_lon, radius_km + FINE_KM / 2)
+    rows = np.repeat(np.arange(len(counts)), graph.degrees())
+    return counts + np.bincount(rows, weights=counts[graph.indices], minlength=len(counts))
+
+
+def tile_loads(tile_km, c_lat, c_lon, lat_order, counts, degrees, radius_km, tiles=None):
+    # Points et arêtes estimés du cœur + halo de chaque tuile (par défaut : toutes les tuiles occupées)
+    grid = TileGrid(tile_km)
+    if tiles is None:
+        tiles = np.unique(grid.tile_of(c_lat, c_lon))
+    halo_km = 2 * radius_km + 1.5 * FINE_KM  # marge : taille d'une cellule de comptage
+    points = np.empty(len(tiles))
+    edges = np.empty(len(tiles))
+    for k, tile in enumerate(tiles):
+        members = grid.halo_members(tile, c_lat, c_lon, halo_km, lat_order)
+        points[k] = counts[members].sum()
+        edges[k] = counts[members] @ degrees[members]
+    return tiles, points, edges
+
+
+def estimate_tile_mb(points, edges, algorithm, precomputed, graph_mb):
+    per_edge = BYTES_PER_EDGE[(algorithm, precomputed and algorithm != 'balltree')]
+    return FIXED_MB + graph_mb + (points * BYTES_PER_POINT + edges * per_edge) / (1024 * 1024)
+
+
+def plan_tiles(fine_grid, cells, counts, radius_km, algorithm, precomputed, budget_mb, graph_mb, tile_km=0):
+    # Plus grandes tuiles qui tiennent dans le budget (moins de halo recalculé) ; à la
+    # plus petite taille, les tuiles trop chargées sont découpées en sous-tuiles.
+    # Renvoie (taille des tuiles, {tuile découpée: taille des sous-tuiles}, estimation
+    # maximale en Mo) ; ValueError si même les plus petites sous-tuiles dépassent le budget.
+    centers = np.array([fine_grid.bounds(c) for c in cells])
+    c_lat = (centers[:, 0] + centers[:, 1]) / 2
+    c_lon = centers[:, 2] + centers[:, 3] / 2
+    lat_order = np.argsort(c_lat, kind='stable')
+    degrees = cell_degrees(c_lat, c_lon, counts, radius_km)
+
+    def loads(size, tiles=None):
+        tiles, points, edges = tile_loads(size, c_lat, c_lon, lat_order, counts, degrees, radius_km, tiles)
+        return tiles, estimate_tile_mb(points, edges, algorithm, precomputed, graph_mb)
+
+    for size in (tile_km,) if tile_km else TILE_CANDIDATES_KM:
+        tiles, estimates = loads(size)
+        if estimates.max() <= budget_mb:
+            return size, {}, float(estimates.max())
+    over = estimates > budget_mb
+    dense = np.isin(TileGrid(size).tile_of(c_lat, c_lon), tiles[over])  # cellules des tuiles trop chargées
+    smallest, estimate = size, estimates.max()
+    for sub_km in SUBTILE_CANDIDATES_KM:
+        if sub_km >= size:
+            continue
+        _, sub_estimates = loads(sub_km, np.unique(TileGrid(sub_km).tile_of(c_lat[dense], c_lon[dense])))
+        smallest, estimate = sub_km, sub_estimates.max()
+        if estimate <= budget_mb:
+            return size, dict.fromkeys(tiles[over].tolist(), sub_km), float(max(estimate, estimates[~over].max(initial=0)))
+    raise ValueError(f"Budget mémoire insuffisant : la tuile la plus chargée est estimée à {estimate:.0f} Mo "
+                     f"en tuiles de {smallest:g} km pour {budget_mb:.0f} Mo disponibles (augmenter --memoire-mo "
+                     f"d'au moins {estimate - budget_mb:.0f} Mo)")
+
+
+def spill(path, grid, bucket_dir, chunk_rows):
+    # Répartition des points dans un fichier binaire par tuile ; renvoie le nombre de points
+    os.makedirs(bucket_dir, exist_ok=True)
+    start = 0
+    for chunk in iter_points(path, chunk_rows=chunk_rows):
+        records = np.empty(len(chunk), dtype=RECORD)
+        records['index'] = np.arange(start, start + len(chunk))
+        records['lat'] = chunk['LAT'].values
+        records['lon'] = chunk['LON'].values
+        records['pir'] = chunk['PIR'].values
+        tiles = grid.tile_of(records['lat'], records['lon'])
+        order = np.argsort(tiles, kind='stable')
+        tile_ids, first = np.unique(tiles[order], return_index=True)
+        for tile, group in zip(tile_ids, np.split(order, first[1:])):
+            with open(os.path.join(bucket_dir, f"{tile}.bin"), 'ab') as f:
+                records[group].tofile(f)
+        start += len(chunk)
+    return start
+
+
+def _bucket(bucket_dir, tile):
+    return np.memmap(os.path.join(bucket_dir, f"{tile}.bin"), dtype=RECORD, mode='r')
+
+
+def neighbor_tiles(grid, tile, tiles, tile_bounds, halo_km):
+    # Tuiles non vides dont l'emprise touche le cœur + halo de `tile`
+    lat_lo, lat_hi, lon_lo, lon_step = grid.bounds(tile)
+    halo_deg = halo_km / KM_PER_DEG
+    lo, hi = lat_lo - halo_deg, lat_hi + halo_deg
+    ok = (tile_bounds[:, 1] >= lo) & (tile_bounds[:, 0] <= hi)
+    max_abs = max(abs(lo), abs(hi))
+    if max_abs < 90.0:
+        lon_halo = halo_deg / np.cos(np.radians(max_abs))
+        width = lon_step + 2 * lon_halo
+        if width < 360.0:
+            start = lon_lo - lon_halo
+            overlap = (((tile_bounds[:, 2] - start) % 360.0 <= width)
+                       | ((start - tile_bounds[:, 2]) % 360.0 <= tile_bounds[:, 3]))
+            ok &= overlap
+    return tiles[ok]
+
+
+def _cluster_owned(records, labels, next_label, owned, algorithm, max_pir, radius_km, precomputed, graph_mb):
+    # Clusterise les points encore libres de `records` et garde les clusters dont le
+    # centroïde (moyenne LAT/LON) vérifie owned(lat, lon) ; renvoie le prochain label
+    records = records[labels[records['index']] == -1]
+    if len(records) == 0:
+        return next_label
+    sub = cluster_points(algorithm, records['lat'], records['lon'], records['pir'], max_pir, radius_km,
+                         precomputed, memory_mb=graph_mb)
+    order = np.argsort(sub, kind='stable')
+    ids, first = np.unique(sub[order], return_index=True)
+    sizes = np.diff(np.append(first, len(order)))
+    c_lat = np.add.reduceat(records['lat'][order].astype(np.float64), first) / sizes
+    c_lon = np.add.reduceat(records['lon'][order].astype(np.float64), first) / sizes
+    kept = owned(c_lat, c_lon)
+    new_ids = np.full(len(ids), -1, dtype=np.int64)
+    new_ids[kept] = next_label + np.arange(kept.sum())
+    point_ids = np.repeat(new_ids, sizes)
+    taken = point_ids >= 0
+    labels[records['index'][order][taken]] = point_ids[taken]
+    return next_label + int(kept.sum())
+
+
+def cluster_out_of_core(path, algorithm, max_pir, radius_km, work_dir, memory_mb=1024, tile_km=0,
+                        first_label=1, precomputed=False, metrics=None, progress=None):
+    # Renvoie (labels en memmap sur disque : work_dir/labels.npy, taille des tuiles utilisée).
+    # Les fichiers des tuiles sont écrits dans un sous-répertoire créé pour l'occasion.
+    # ValueError (avant toute écriture) si le budget ne peut pas être tenu.
+    metrics = metrics or Metrics("hors_memoire")
+    base_mb = current_rss_mb() or 0.0  # RSS indisponible (Windows) : budget entier pour les tuiles
+    available_mb = memory_mb - base_mb
+    if available_mb < MIN_AVAILABLE_MB:
+        raise ValueError(f"Budget mémoire insuffisant : {memory_mb} Mo pour un processus qui en occupe déjà "
+                         f"{base_mb:.0f} (augmenter --memoire-mo)")
+    chunk_rows = chunk_rows_for(available_mb)
+    graph_mb = graph_batch_mb(available_mb)
+
+    with metrics.phase('comptage'):
+        fine_grid, cells, counts, num_points = count_cells(path, chunk_rows)
+        tile_km, subtiles, estimate = plan_tiles(fine_grid, cells, counts, radius_km, algorithm, precomputed,
+                                                 available_mb, graph_mb, tile_km)
+    metrics.set(tuiles_km=tile_km, tuiles_decoupees=len(subtiles),
+                sous_tuiles_km=next(iter(subtiles.values()), 0), estimation_tuile_mo=round(estimate, 1),
+                budget_mo=memory_mb, budget_tuiles_mo=round(available_mb, 1), lignes=num_points,
+                morceaux_lignes=chunk_rows)
+
+    os.makedirs(work_dir, exist_ok=True)
+    bucket_dir = tempfile.mkdtemp(prefix="tuiles-", dir=work_dir)
+    grid = TileGrid(tile_km)
+    with metrics.phase('repartition'):
+        spill(path, grid, bucket_dir, chunk_rows)
+    tiles = np.array(sorted(int(name[:-4]) for name in os.listdir(bucket_dir)), dtype=np.int64)
+    tile_bounds = np.array([grid.bounds(t) for t in tiles])
+    metrics.count('tuiles', len(tiles))
+
+    labels = np.lib.format.open_memmap(os.path.join(work_dir, "labels.npy"), mode='w+', dtype=np.int64,
+                                       shape=(num_points,))
+    labels[:] = -1  # point libre
+    next_label = first_label
+    halo_km = 2 * radius_km
+
+    with metrics.phase('clustering'):
+        for done, tile in enumerate(tiles, start=1):
+            parts = []
+            for other in neighbor_tiles(grid, tile, tiles, tile_bounds, halo_km):
+                bucket = _bucket(bucket_dir, other)
+                lat_order = np.argsort(bucket['lat'], kind='stable')
+                parts.append(np.array(bucket[grid.halo_members(tile, bucket['lat'], bucket['lon'], halo_km,
+                                                               lat_order)]))
+            records = np.concatenate(parts)
+            records = records[np.argsort(records['index'], kind='stable')]
+            params = (algorithm, max_pir, radius_km, precomputed, graph_mb)
+            if tile not in subtiles:
+                next_label = _cluster_owned(records, labels, next_label,
+                                            lambda lat, lon: grid.tile_of(lat, lon) == tile, *params)
+            else:
+                # tuile trop chargée : sous-tuiles (+ halo) prises dans le cœur + halo de la tuile
+                sub_grid = TileGrid(subtiles[tile])
+                core = grid.tile_of(records['lat'], records['lon']) == tile
+                lat_order = np.argsort(records['lat'], kind='stable')
+                for sub in np.unique(sub_grid.tile_of(records['lat'][core], records['lon'][core])):
+                    members = sub_grid.halo_members(sub, records['lat'], records['lon'], halo_km, lat_order)
+                    next_label = _cluster_owned(records[members], labels, next_label,
+                                                lambda lat, lon: (grid.tile_of(lat, lon) == tile)
+                                                & (sub_grid.tile_of(lat, lon) == sub), *params)
+                    metrics.count('sous_tuiles')
+            if progress is not None:
+                progress(done, len(tiles))
+
+    with metrics.phase('passe_finale'):
+        orphans = 0
+        for tile in tiles:
+            records = np.array(_bucket(bucket_dir, tile))
+            records = records[labels[records['index']] == -1]
+            if len(records) == 0:
+                continue
+            sub = cluster_points(algorithm, records['lat'], records['lon'], records['pir'], max_pir, radius_km,
+                                 precomputed, memory_mb=graph_mb)
+            _, sub = np.unique(sub, return_inverse=True)
+            labels[records['index']] = next_label + sub
+            next_label += int(sub.max()) + 1
+            orphans += len(records)
+    metrics.count('points_orphelins', orphans)
+    metrics.count('clusters_crees', next_label - first_label)
+    labels.flush()
+    shutil.rmtree(bucket_dir, ignore_errors=True)
+    return labels, tile_km
+
+
+def write_labeled_csv(path, labels, out_path, chunk_rows):
+    # Écriture en flux : données d'entrée + colonne cluster, morceau par morceau
+    start = 0
+    for chunk in iter_points(path, chunk_rows=chunk_rows):
+        chunk['cluster'] = labels[start:start + len(chunk)]
+        chunk.to_csv(out_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+        start += len(chunk)
+
+
+if __name__ == "__main__":
+    print("\n\n\n###################################################################")
+    print("#                Clustering hors mémoire (par tuiles)             #")
+    print("################################################################### \n\n\n")
+
+    parser = argparse.ArgumentParser(description="Clustering de données plus grandes que la mémoire")
+    parser.add_argument("max_pir", nargs="?", type=float, help="PIR maximal par cluster (4000 par défaut)")
+    parser.add_argument("--entree", default="generated.csv",
+                        help="données d'entrée : CSV, .parquet ou répertoire .npy (voir dataset.py)")
+    parser.add_argument("--algo", choices=ALGORITHMS, default="balltree")
+    parser.add_argument("--memoire-mo", type=int, default=1024, help="budget mémoire (Mo)")
+    parser.add_argument("--tuiles", type=float, default=0, metavar="KM",
+                        help="taille des tuiles en km (0 = choisie selon le budget mémoire)")
+    parser.add_argument("--precalcule", action="store_true",
+                        help="DBSCAN/OPTICS sur graphe creux précalculé (metric='precomputed')")
+    parser.add_argument("--travail", default="hors_memoire",
+                        help="répertoire de travail : tuiles et labels dans un sous-répertoire execution-*")
+    parser.add_argument("--garder", action="store_true",
+                        help="conserver le sous-répertoire de l'exécution (labels.npy)")
+    parser.add_argument("--sortie", default="res.csv", help="fichier de résultats")
+    parser.add_argument("--rapport", default="rapport_hors_memoire.json",
+                        help="rapport JSON des mesures (durée et mémoire par phase, compteurs)")
+    args = parser.parse_args()
+
+    if args.max_pir is None:
+        print("Usage: python outofcore.py <max_pir_per_cluster>")
+        print("Utilisation de la valeur 4000 par défaut\n\n")
+        MAX_PIR = 4000.0
+    else:
+        MAX_PIR = args.max_pir
+
+    RADIUS_KM = 45
+    mesures = Metrics("hors_memoire")
+    mesures.set(entree=args.entree, algorithme=args.algo, max_pir=MAX_PIR, rayon_km=RADIUS_KM)
+    start_time = time.time()
+
+    def afficher_tuiles(done, total):
+        if done % 10 == 0 or done == total:
+            print(f"Tuiles traitées: {done}/{total} - Temps écoulé: {time.time() - start_time:.1f}s")
+
+    # Sous-répertoire propre à l'exécution : seul lui est supprimé à la fin
+    os.makedirs(args.travail, exist_ok=True)
+    execution_dir = tempfile.mkdtemp(prefix="execution-", dir=args.travail)
+    try:
+        labels, tile_km = cluster_out_of_core(args.entree, args.algo, MAX_PIR, RADIUS_KM, execution_dir,
+                                              memory_mb=args.memoire_mo, tile_km=args.tuiles,
+                                              first_label=0 if args.algo == 'dbscan' else 1,
+                                              precomputed=args.precalcule, metrics=mesures,
+                                              progress=afficher_tuiles)
+    except ValueError as e:
+        shutil.rmtree(execution_dir, ignore_errors=True)
+        parser.error(str(e))
+    decoupe = ""
+    if mesures.params['tuiles_decoupees']:
+        decoupe = (f" ({mesures.params['tuiles_decoupees']} découpées en sous-tuiles de "
+                   f"{mesures.params['sous_tuiles_km']:g} km)")
+    print(f"Tuiles de {tile_km:g} km{decoupe} - {mesures.counters['clusters_crees']} clusters")
+
+    with mesures.phase('ecriture'):
+        write_labeled_csv(args.entree, labels, args.sortie, mesures.params['morceaux_lignes'])
+    print(f"\nRésultats enregistrés dans '{args.sortie}'.")
+    del labels
+    if args.garder:
+        print(f"Labels conservés dans '{os.path.join(execution_dir, 'labels.npy')}'.")
+    else:
+        shutil.rmtree(execution_dir, ignore_errors=True)
+    if args.rapport:
+        mesures.write(args.rapport)
+
+    print("\n\n\n###################################################################")
+    print("#                  Fin du clustering hors mémoire                 #")
+    print("################################################################### \n\n\n")
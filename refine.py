@@ -0,0 +1,214 @@
+import argparse
+import heapq
+import time
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from export import load_labeled_points
+from geo import EARTH_RADIUS_KM, diameter_within, haversine_km
+from metrics import Metrics
+from validation import cluster_summary
+
+# Passe de raffinement : fusion des clusters voisins sous-remplis.
+# Travaille sur le résumé par cluster (effectif, sommes LAT/LON, PIR total, rayon
+# au centroïde) : un BallTree sur les centroïdes donne les candidats (les
+# NUM_NEIGHBORS centroïdes les plus proches, à moins de 2 x RADIUS_KM pour la
+# contrainte de rayon, RADIUS_KM pour le diamètre ; un cluster fusionné hérite des
+# candidats de ses parties), le coût reste donc linéaire en nombre de clusters ;
+# un tas (une entrée par cluster : son candidat le plus proche) classe les paires
+# par distance entre centroïdes et les fusions sont faites dans cet ordre tant que
+# le PIR total et la contrainte géométrique tiennent :
+# - rayon (BallTree) : distance max au nouveau centroïde (moyenne LAT/LON, comme test.py)
+# - diamètre (DBSCAN/OPTICS) : plus grande distance entre deux membres
+# Une borne par l'inégalité triangulaire (rayons des deux clusters + distances des
+# centroïdes) accepte la plupart des fusions sans relire les points ; sinon le
+# contrôle exact ne porte que sur les membres des deux clusters.
+# Chaque fusion crée un nouvel identifiant ; une entrée dont le candidat a disparu
+# (ou a été refusé) est recalculée quand elle arrive en tête, comme dans
+# clutering_hierarchique.py.
+
+CONSTRAINTS = ('rayon', 'diametre')
+NUM_NEIGHBORS = 16  # candidats par cluster d'origine : ses plus proches centroïdes
+
+
+def merge_clusters(labels, lats, lons, pirs, max_pir, radius_km, constraint='rayon', first_label=1,
+                   num_neighbors=NUM_NEIGHBORS, metrics=None, progress=None):
+    # Renvoie les nouveaux labels (numérotés à partir de first_label, dans l'ordre
+    # des anciens identifiants)
+    labels = np.asarray(labels)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    summary, order, starts = cluster_summary(labels, lats, lons, pirs)
+    num_clusters = len(summary)
+    bounds = np.append(starts, len(order))
+
+    capacity = 2 * num_clusters
+    count = np.zeros(capacity, dtype=np.int64)
+    count[:num_clusters] = summary['points_count'].values
+    lat_sum = np.zeros(capacity)
+    lat_sum[:num_clusters] = summary['centroid_lat'].values * count[:num_clusters]
+    lon_sum = np.zeros(capacity)
+    lon_sum[:num_clusters] = summary['centroid_lon'].values * count[:num_clusters]
+    pir_total = np.zeros(capacity)
+    pir_total[:num_clusters] = summary['pir_total'].values
+    radius = np.zeros(capacity)  # majorant de la distance max au centroïde
+    radius[:num_clusters] = summary['radius_km'].values
+    alive = np.zeros(capacity, dtype=bool)
+    alive[:num_clusters] = True
+    root = np.arange(num_clusters)  # cluster courant de chaque cluster d'origine
+    parts = {}  # identifiant fusionné -> clusters d'origine
+
+    search_km = 2 * radius_km if constraint == 'rayon' else radius_km
+    centroids = np.radians(summary[['centroid_lat', 'centroid_lon']].values)
+    tree = BallTree(centroids, metric='haversine')
+    dists, nearest = tree.query(centroids, k=min(num_neighbors + 1, num_clusters))
+    candidates = {c: nearest[c][dists[c] <= search_km / EARTH_RADIUS_KM] for c in range(num_clusters)}
+
+    def parts_of(c):
+        return parts[c] if c in parts else np.array([c])
+
+    def members_of(c):
+        return np.concatenate([order[bounds[p]:bounds[p + 1]] for p in parts_of(c)])
+
+    def centroid(c):
+        return lat_sum[c] / count[c], lon_sum[c] / count[c]
+
+    forbidden = {}  # identifiant -> clusters avec lesquels la fusion a été refusée
+
+    def best_candidate(c):
+        # Cluster compatible en PIR le plus proche (centroïdes), hors fusions refusées
+        others = root[candidates[c]]  # doublons possibles, sans effet sur le minimum
+        others = others[(others != c) & (pir_total[others] + pir_total[c] <= max_pir)]
+        refused = forbidden.get(c)
+        if refused:
+            others = others[~np.isin(others, list(refused))]
+        if len(others) == 0:
+            return None
+        c_lat, c_lon = centroid(c)
+        dists = haversine_km(c_lat, c_lon, lat_sum[others] / count[others], lon_sum[others] / count[others])
+        best = np.lexsort((others, dists))[0]  # égalité : plus petit identifiant
+        if dists[best] > search_km:
+            return None
+        return float(dists[best]), int(others[best])
+
+    heap = []
+
+    def push_best(c):
+        best = best_candidate(c)
+        if best is not None:
+            heapq.heappush(heap, (best[0], c, best[1]))
+
+    def try_merge(a, b):
+        # Rayon (majorant) du cluster fusionné si la fusion est possible, None sinon
+        n = count[a] + count[b]
+        m_lat, m_lon = (lat_sum[a] + lat_sum[b]) / n, (lon_sum[a] + lon_sum[b]) / n
+        a_lat, a_lon = centroid(a)
+        b_lat, b_lon = centroid(b)
+        bound = max(haversine_km(m_lat, m_lon, a_lat, a_lon) + radius[a],
+                    haversine_km(m_lat, m_lon, b_lat, b_lon) + radius[b])
+        if constraint == 'rayon':
+            if bound <= radius_km:
+                return bound
+        elif haversine_km(a_lat, a_lon, b_lat, b_lon) + radius[a] + radius[b] <= radius_km:
+            return bound
+        union = np.concatenate((members_of(a), members_of(b)))
+        exact = float(haversine_km(m_lat, m_lon, lats[union], lons[union]).max())
+        if constraint == 'rayon':
+            return exact if exact <= radius_km else None
+        within = diameter_within(np.radians(lats[union]), np.radians(lons[union]), radius_km)
+        return exact if within else None
+
+    for c in range(num_clusters):
+        push_best(c)
+
+    next_id = num_clusters
+    merges = rejected = 0
+    while heap:
+        _, a, b = heapq.heappop(heap)
+        if not alive[a]:
+            continue
+        if not alive[b] or b in forbidden.get(a, ()):
+            push_best(a)  # candidat disparu (fusionné) ou refusé entre-temps
+            continue
+        new_radius = try_merge(a, b)
+        if new_radius is None:
+            rejected += 1
+            forbidden.setdefault(a, set()).add(b)
+            forbidden.setdefault(b, set()).add(a)
+            push_best(a)
+            continue
+
+        c = next_id
+        next_id += 1
+        alive[a] = alive[b] = False
+        alive[c] = True
+        count[c] = count[a] + count[b]
+        lat_sum[c] = lat_sum[a] + lat_sum[b]
+        lon_sum[c] = lon_sum[a] + lon_sum[b]
+        pir_total[c] = pir_total[a] + pir_total[b]
+        radius[c] = new_radius
+        parts[c] = np.concatenate((parts_of(a), parts_of(b)))
+        root[parts[c]] = c
+        candidates[c] = np.unique(np.concatenate((candidates.pop(a), candidates.pop(b))))
+        for old in (a, b):
+            parts.pop(old, None)
+            forbidden.pop(old, None)
+        merges += 1
+        if progress is not None and merges % 10000 == 0:
+            progress(merges, num_clusters - merges)
+        push_best(c)
+
+    if metrics is not None:
+        metrics.count('clusters_avant_fusion', num_clusters)
+        metrics.count('fusions', merges)
+        metrics.count('fusions_refusees', rejected)
+
+    # Numérotation : ordre du plus petit ancien identifiant de chaque cluster
+    _, first, inverse = np.unique(root, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first, kind='stable')] = np.arange(len(first))
+    new_labels = np.empty(len(labels), dtype=np.int64)
+    new_labels[order] = np.repeat(first_label + rank[inverse], np.diff(bounds))
+    return new_labels
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fusion des clusters voisins d'un résultat existant")
+    parser.add_argument("fichier", nargs="?", default="res.csv",
+                        help="résultats : res.csv ou répertoire du format compact")
+    parser.add_argument("max_pir", nargs="?", type=float, default=4000.0, help="PIR maximal par cluster")
+    parser.add_argument("--contrainte", choices=CONSTRAINTS, default="rayon",
+                        help="rayon au centroïde (BallTree) ou diamètre (DBSCAN/OPTICS)")
+    parser.add_argument("--sortie", default="res_fusion.csv", help="fichier de résultats")
+    parser.add_argument("--rapport", default="rapport_fusion.json",
+                        help="rapport JSON des mesures (durée et mémoire par phase, compteurs)")
+    args = parser.parse_args()
+
+    RADIUS_KM = 45
+    mesures = Metrics("fusion")
+    with mesures.phase('chargement'):
+        donnees = load_labeled_points(args.fichier)
+    avant = donnees['cluster'].nunique()
+    mesures.set(fichier=args.fichier, max_pir=args.max_pir, rayon_km=RADIUS_KM, contrainte=args.contrainte)
+
+    start_time = time.time()
+
+    def afficher_fusions(merges, clusters):
+        print(f"Fusions: {merges} - Clusters restants: {clusters} - Temps écoulé: {time.time() - start_time:.1f}s")
+
+    with mesures.phase('fusion'):
+        donnees['cluster'] = merge_clusters(donnees['cluster'].values, donnees['LAT'].values, donnees['LON'].values,
+                                            donnees['PIR'].values, args.max_pir, RADIUS_KM, args.contrainte,
+                                            first_label=int(donnees['cluster'].min()), metrics=mesures,
+                                            progress=afficher_fusions)
+    duree = time.time() - start_time
+    with mesures.phase('ecriture'):
+        donnees.to_csv(args.sortie, index=False)
+
+    apres = donnees['cluster'].nunique()
+    print(f"Clusters: {avant} -> {apres} en {duree:.1f}s")
+    print(f"Résultats enregistrés dans '{args.sortie}'.")
+    mesures.set(nb_clusters=int(apres))
+    if args.rapport:
+        mesures.write(args.rapport)
@@ -0,0 +1,124 @@
+import argparse
+import io
+import json
+import math
+import os
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+from api import ALGORITHMS, RADIUS_KM, WarmDataset
+from dataset import load_points
+from neighbors import NEIGHBOR_BACKENDS
+
+# Service local persistant : les données, le graphe de voisinage et les labels
+# DBSCAN/OPTICS bruts restent en mémoire, chaque requête ne refait que l'étape
+# qui dépend du PIR. Écoute uniquement sur 127.0.0.1.
+#
+#   python service.py --entree generated.csv --precharger balltree
+#   curl 'http://127.0.0.1:8765/clusters?algorithme=balltree&max_pir=4000'
+#   GET /etat                                    -> état du service (JSON)
+#   GET /clusters?algorithme=..&max_pir=..       -> labels en JSON
+#   GET /clusters?algorithme=..&max_pir=..&format=npy -> labels en tableau .npy
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+
+class ClusteringHandler(BaseHTTPRequestHandler):
+    dataset = None  # WarmDataset partagé, requêtes traitées une par une (HTTPServer)
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/etat":
+            self._send(200, {'lignes': len(self.dataset), 'rayon_km': self.dataset.radius_km,
+                             'prets': self.dataset.ready(), 'resultats_memorises': len(self.dataset.results)})
+        elif url.path == "/clusters":
+            self._clusters(query)
+        else:
+            self._send(404, {'erreur': f"chemin inconnu: {url.path}"})
+
+    def _clusters(self, query):
+        algorithm = query.get('algorithme', 'balltree')
+        if algorithm not in ALGORITHMS:
+            self._send(400, {'erreur': f"algorithme inconnu: {algorithm}"})
+            return
+        try:
+            max_pir = float(query['max_pir'])
+        except (KeyError, ValueError):
+            max_pir = math.nan
+        if not math.isfinite(max_pir):  # nan / inf : réponse JSON invalide (NaN, Infinity)
+            self._send(400, {'erreur': "paramètre max_pir manquant ou invalide"})
+            return
+
+        start = time.perf_counter()
+        try:
+            labels = self.dataset.labels(algorithm, max_pir)
+        except Exception as e:
+            self._send(500, {'erreur': f"{type(e).__name__}: {e}"})
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if query.get('format') == 'npy':
+            buffer = io.BytesIO()
+            np.save(buffer, labels)
+            self._send(200, buffer.getvalue(), "application/octet-stream")
+        else:
+            self._send(200, {'algorithme': algorithm, 'max_pir': max_pir, 'duree_ms': round(elapsed_ms, 2),
+                             'nb_clusters': int(len(np.unique(labels))), 'labels': labels.tolist()})
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+def fetch_labels(algorithm, max_pir, host=HOST, port=PORT, timeout=None):
+    # Client : labels d'un service déjà lancé, en tableau numpy
+    query = urllib.parse.urlencode({'algorithme': algorithm, 'max_pir': max_pir, 'format': 'npy'})
+    with urllib.request.urlopen(f"http://{host}:{port}/clusters?{query}", timeout=timeout) as response:
+        return np.load(io.BytesIO(response.read()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service local de clustering (données gardées en mémoire)")
+    parser.add_argument("--entree", default="generated.csv",
+                        help="données d'entrée : CSV, .parquet ou répertoire .npy (voir dataset.py)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="nombre de processus de calcul")
+    parser.add_argument("--precalcule", action="store_true",
+                        help="DBSCAN/OPTICS sur graphe creux précalculé (metric='precomputed')")
+    parser.add_argument("--recherche", choices=NEIGHBOR_BACKENDS, default="balltree",
+                        help="recherche des voisins : BallTree haversine ou KD-tree sur vecteurs unitaires 3D")
+    parser.add_argument("--precharger", nargs="+", choices=ALGORITHMS, default=(),
+                        help="algorithmes préparés au démarrage plutôt qu'à la première requête")
+    args = parser.parse_args()
+
+    print(f"Lecture des données ({args.entree})...")
+    donnees = load_points(args.entree)
+    ClusteringHandler.dataset = WarmDataset(donnees['LAT'].values, donnees['LON'].values, donnees['PIR'].values,
+                                            RADIUS_KM, workers=args.workers, precomputed=args.precalcule,
+                                            backend=args.recherche)
+    for algorithme in args.precharger:
+        debut = time.time()
+        ClusteringHandler.dataset.prepare(algorithme)
+        print(f"{algorithme} prêt en {time.time() - debut:.1f}s")
+
+    server = HTTPServer((HOST, args.port), ClusteringHandler)
+    print(f"Service à l'écoute sur http://{HOST}:{args.port} ({len(donnees)} lignes) - Ctrl+C pour arrêter")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,46 +1,43 @@
 import pandas as pd
 import sys
 import numpy as np
-import math
+import argparse
+
+from export import is_compact, load_labeled_points
+from validation import cluster_summary, min_enclosing_radius_km
 
 print("\n\n\n###################################################################")
 print("#               Test sur le fichier de résultats                  #")
 print("################################################################### \n\n\n")
 
-# Load data
-donnees = pd.read_csv("res.csv", delimiter=",")
-donnees = donnees.sort_values(by='cluster', ascending=True)
+parser = argparse.ArgumentParser(description="Vérification des contraintes sur un fichier de résultats")
+parser.add_argument("max_pir", nargs="?", type=float, help="PIR maximal par cluster")
+parser.add_argument("--fichier", default="res.csv",
+                    help="fichier de résultats à vérifier (res.csv ou répertoire du format compact)")
+parser.add_argument("--entree", help="format compact : données d'entrée (par défaut celles de meta.json)")
+parser.add_argument("--colonne", default="cluster",
+                    help="colonne des labels (par ex. cluster_4000 pour un balayage --sweep en CSV)")
+parser.add_argument("--cercle-min", action="store_true",
+                    help="vérification exacte par plus petit cercle englobant (plus lent)")
+args = parser.parse_args()
 
 # Define constants
 MAX_RADIUS_KM = 45.0  # maximum radius in kilometers
 
-if len(sys.argv) != 2:
-    print("Usage: python balltree.py <max_pir_per_cluster>")
+if args.max_pir is None:
+    print("Usage: python test.py <max_pir_per_cluster>")
     sys.exit(1)
 else : 
-    MAX_PIR_TOTAL = float(sys.argv[1])
-
-# Function to calculate distance between two points using Haversine formula
-def haversine_distance(lat1, lon1, lat2, lon2):
-    # Convert latitude and longitude from degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371  # Radius of Earth in kilometers
-    return c * r
-
-# Process clusters
-cluster_info = {}
-current_cluster = None
-cluster_points = []
-cluster_pir_total = 0
-
-# Print column names to debug
-print("Available columns in the CSV file:", donnees.columns.tolist())
+    MAX_PIR_TOTAL = args.max_pir
+
+if is_compact(args.fichier):
+    # Compact output: labels.npy + coordinates read back from the input data
+    compact = load_labeled_points(args.fichier, args.entree)
+    columns = compact.columns.tolist()
+else:
+    compact = None
+    columns = pd.read_csv(args.fichier, nrows=0).columns.tolist()
+print("Available columns in the CSV file:", columns)
 
 # Determine coordinate column names
 # Common variations of latitude/longitude column names
@@ -48,79 +45,48 @@ lat_options = ['LAT', 'latitude', 'lat', 'y', 'LATITUDE', 'Latitude']  # Priorit
 long_options = ['LON', 'longitude', 'long', 'lng', 'x', 'LONGITUDE', 'Longitude']  # Prioritize LON
 
 # Find the first matching column name
-lat_col = next((col for col in lat_options if col in donnees.columns), None)
-long_col = next((col for col in long_options if col in donnees.columns), None)
+lat_col = next((col for col in lat_options if col in columns), None)
+long_col = next((col for col in long_options if col in columns), None)
 
 # Check if PIR column exists or find alternative
-pir_col = 'pir' if 'pir' in donnees.columns else 'PIR' if 'PIR' in donnees.columns else None
+pir_col = 'pir' if 'pir' in columns else 'PIR' if 'PIR' in columns else None
 
 if not lat_col or not long_col:
     print("Error: Could not find latitude/longitude columns in the CSV file.")
     print("Please rename your coordinate columns to 'latitude' and 'longitude'.")
-    print("Available columns:", donnees.columns.tolist())
+    print("Available columns:", columns)
+    sys.exit(1)
+
+if args.colonne not in columns:
+    print(f"Error: Could not find the label column '{args.colonne}' in the results file.")
+    print("Available columns:", columns)
     sys.exit(1)
 
 if not pir_col:
     print("Warning: Could not find PIR column in the CSV file.")
     print("Using a default value of 1.0 for all PIR values.")
-    print("Available columns:", donnees.columns.tolist())
+    print("Available columns:", columns)
 
 print(f"Using columns: Latitude = '{lat_col}', Longitude = '{long_col}', PIR = '{pir_col}'")
 
-# Process each point
-for i, row in donnees.iterrows():
-    cluster_id = row['cluster']
-    
-    # If we've moved to a new cluster
-    if current_cluster is not None and current_cluster != cluster_id:
-        # Calculate centroid (center of mass)
-        cluster_points_array = np.array(cluster_points)
-        centroid_lat = np.mean(cluster_points_array[:, 0])
-        centroid_lon = np.mean(cluster_points_array[:, 1])
-        
-        # Calculate maximum distance from centroid to any point (radius)
-        max_distance = 0
-        for point in cluster_points:
-            distance = haversine_distance(centroid_lat, centroid_lon, point[0], point[1])
-            max_distance = max(max_distance, distance)
-        
-        # Store cluster info
-        cluster_info[current_cluster] = {
-            'radius': max_distance,
-            'pir_total': cluster_pir_total,
-            'centroid': (centroid_lat, centroid_lon),
-            'points_count': len(cluster_points)
-        }
-        
-        # Reset for next cluster
-        cluster_points = []
-        cluster_pir_total = 0
-    
-    # Add point to current cluster
-    current_cluster = cluster_id
-    cluster_points.append((row[lat_col], row[long_col]))
-    # Add PIR if column exists, otherwise use default value of 1.0
-    pir_value = row[pir_col] if pir_col else 1.0
-    cluster_pir_total += pir_value
-
-# Process the last cluster
-if cluster_points:
-    cluster_points_array = np.array(cluster_points)
-    centroid_lat = np.mean(cluster_points_array[:, 0])
-    centroid_lon = np.mean(cluster_points_array[:, 1])
-    
-    max_distance = 0
-    for point in cluster_points:
-        distance = haversine_distance(centroid_lat, centroid_lon, point[0], point[1])
-        max_distance = max(max_distance, distance)
-    
-    cluster_info[current_cluster] = {
-        'radius': max_distance,
-        'pir_total': cluster_pir_total,
-        'centroid': (centroid_lat, centroid_lon),
-        'points_count': len(cluster_points)
-    }
-
+# Load only the needed columns
+usecols = [c for c in (lat_col, long_col, pir_col, args.colonne) if c]
+if compact is not None:
+    donnees = compact[usecols]
+else:
+    donnees = pd.read_csv(args.fichier, delimiter=",", usecols=usecols)
+donnees = donnees.rename(columns={args.colonne: 'cluster'})
+donnees = donnees.sort_values(by='cluster', ascending=True, kind='stable')
+
+# Process clusters: counts, PIR totals, centroids and radii in vectorized passes
+pirs = donnees[pir_col].values if pir_col else np.ones(len(donnees))
+summary, order, starts = cluster_summary(donnees['cluster'].values, donnees[lat_col].values,
+                                         donnees[long_col].values, pirs)
+# cluster ids are floats, as with the former row-by-row (iterrows) processing
+summary['cluster_id'] = summary['cluster_id'].astype(float)
+if args.cercle_min:
+    summary['mec_radius_km'] = min_enclosing_radius_km(donnees[lat_col].values, donnees[long_col].values,
+                                                       order, starts)
 # Check constraints and print results
 print("Cluster Analysis Results:")
 print("-" * 80)
@@ -133,26 +99,15 @@ print(donnees.head(5).to_string(index=False))
 print("\n")
 
 # Add summary statistics
-num_clusters = len(cluster_info)
+num_clusters = len(summary)
 print(f"Found {num_clusters} clusters in the data.")
 print("-" * 80)
 
-all_constraints_met = True
-for cluster_id, info in cluster_info.items():
-    # For single-point clusters, only radius constraint matters (PIR is exempted)
-    is_single_point = info['points_count'] == 1
-    radius_ok = info['radius'] < MAX_RADIUS_KM
-    
-    # PIR constraint is exempted for single-point clusters
-    pir_ok = info['pir_total'] < MAX_PIR_TOTAL if not is_single_point else True
-    pir_status = '✓' if pir_ok else '✗'
-    
-    # For single-point clusters with high PIR, mark with a special symbol
-    if is_single_point and info['pir_total'] >= MAX_PIR_TOTAL:
-        pir_status = '⚠'  # Warning symbol for exempted cases
-    
-    if not radius_ok or not pir_ok:
-        all_constraints_met = False
+# For single-point clusters, only radius constraint matters (PIR is exempted)
+is_single_point = summary['points_count'].values == 1
+radius_ok = summary['radius_km'].values < MAX_RADIUS_KM
+pir_ok = (summary['pir_total'].values < MAX_PIR_TOTAL) | is_single_point
+all_constraints_met = bool(np.all(radius_ok & pir_ok))
 
 # Summary of constraints
 print("\nSummary:")
@@ -168,15 +123,16 @@ print("✗: Constraint violated")
 print("⚠: Single-point cluster exceeding PIR limit (exempted from PIR constraint)")
 
 # Add more detailed statistics
+cluster_ids = summary['cluster_id'].values
 violations = {
-    "radius": [cid for cid, info in cluster_info.items() if info['radius'] >= MAX_RADIUS_KM],
+    "radius": cluster_ids[~radius_ok].tolist(),
     # Only clusters with more than one point are considered PIR violations
-    "pir": [cid for cid, info in cluster_info.items() if info['pir_total'] >= MAX_PIR_TOTAL and info['points_count'] > 1]
+    "pir": cluster_ids[~pir_ok].tolist()
 }
 
 # Calculate and print average radius of clusters
 if num_clusters > 0:
-    avg_radius = np.mean([info['radius'] for info in cluster_info.values()])
+    avg_radius = summary['radius_km'].mean()
     print(f"- Average cluster radius: {avg_radius:.2f} km")
 else:
     print("- Average cluster radius: N/A (no clusters found)")
@@ -195,25 +151,38 @@ if violations["pir"]:
 else:
     print(f"  ✓ All clusters within PIR total limit")
 
+# Exact check: can each cluster fit in a circle of MAX_RADIUS_KM at all?
+if args.cercle_min:
+    mec_ok = summary['mec_radius_km'].values < MAX_RADIUS_KM
+    print("- Minimum enclosing circle (exact):")
+    if mec_ok.all():
+        print(f"  ✓ All clusters fit in a {MAX_RADIUS_KM} km circle")
+    else:
+        print(f"  ❌ {int((~mec_ok).sum())} clusters do not fit in any {MAX_RADIUS_KM} km circle")
+        print(f"  Violating clusters: {', '.join(map(str, cluster_ids[~mec_ok].tolist()))}")
+
 
 
 # Warn if there are single-point clusters with PIR exceeding the limit
-single_point_high_pir = [cid for cid, info in cluster_info.items() if info['points_count'] == 1 and info['pir_total'] >= MAX_PIR_TOTAL]
-if single_point_high_pir:
+single_point_high_pir = cluster_ids[is_single_point & (summary['pir_total'].values >= MAX_PIR_TOTAL)]
+if len(single_point_high_pir):
     print(f"\nWarning: {len(single_point_high_pir)} single-point clusters have PIR exceeding the limit (these are exempted from the PIR constraint)")
 
 # Write results to output file for further analysis
 output_file = "cluster_analysis_results.csv"
-results_df = pd.DataFrame([{
-    'cluster_id': cid,
-    'points_count': info['points_count'],
-    'radius_km': info['radius'],
-    'pir_total': info['pir_total'],
-    'radius_ok': info['radius'] < MAX_RADIUS_KM,
-    'pir_ok': info['pir_total'] < MAX_PIR_TOTAL,
-    'centroid_lat': info['centroid'][0],
-    'centroid_lon': info['centroid'][1]
-} for cid, info in cluster_info.items()])
+results_df = pd.DataFrame({
+    'cluster_id': cluster_ids,
+    'points_count': summary['points_count'],
+    'radius_km': summary['radius_km'],
+    'pir_total': summary['pir_total'],
+    'radius_ok': radius_ok,
+    'pir_ok': summary['pir_total'].values < MAX_PIR_TOTAL,
+    'centroid_lat': summary['centroid_lat'],
+    'centroid_lon': summary['centroid_lon']
+})
+if args.cercle_min:
+    results_df['mec_radius_km'] = summary['mec_radius_km']
+    results_df['mec_ok'] = mec_ok
 
 results_df.to_csv(output_file, index=False)
 print(f"\nDetailed results saved to {output_file}")
@@ -0,0 +1,194 @@
+import numpy as np
+
+from density import dbscan_labels, enforce_constraints, optics_labels
+from geo import EARTH_RADIUS_KM, centroid_radius_km, diameter_within
+from greedy import assign_clusters
+from neighbors import latlon_radius_graph, process_pool
+
+# Mode partitionné : le globe est découpé en tuiles (bandes de latitude, puis
+# colonnes de longitude de largeur ~constante en km). Chaque tuile est
+# clusterisée avec un halo de 2 x RADIUS_KM sur un processus séparé ; seuls les
+# clusters dont le centroïde tombe dans le cœur de la tuile sont conservés.
+# Un point revendiqué par plusieurs tuiles revient à la tuile qui le contient,
+# sinon à la plus petite tuile ; les clusters amputés sont revalidés, et les
+# points restés orphelins sont reclusterisés dans une dernière passe globale.
+
+KM_PER_DEG = np.pi * EARTH_RADIUS_KM / 180.0
+ALGORITHMS = ('balltree', 'dbscan', 'optics')
+
+
+class TileGrid:
+
+    def __init__(self, tile_km):
+        self.lat_step = tile_km / KM_PER_DEG
+        self.num_bands = int(np.ceil(180.0 / self.lat_step))
+        lat_lo = -90.0 + np.arange(self.num_bands) * self.lat_step
+        lat_hi = np.minimum(lat_lo + self.lat_step, 90.0)
+        # largeur en longitude calculée sur le bord de la bande le plus proche du pôle
+        max_abs = np.maximum(np.abs(lat_lo), np.abs(lat_hi))
+        cos_edge = np.maximum(np.cos(np.radians(max_abs)), 1e-6)
+        self.num_cols = np.maximum(1, np.floor(360.0 * cos_edge / self.lat_step)).astype(np.int64)
+        self.band_offset = np.concatenate(([0], np.cumsum(self.num_cols)[:-1]))
+
+    def band_of(self, lats):
+        band = np.floor((np.asarray(lats, dtype=np.float64) + 90.0) / self.lat_step).astype(np.int64)
+        return np.clip(band, 0, self.num_bands - 1)
+
+    def tile_of(self, lats, lons):
+        band = self.band_of(lats)
+        cols = self.num_cols[band]
+        col = np.floor((np.asarray(lons, dtype=np.float64) + 180.0) % 360.0 / (360.0 / cols)).astype(np.int64)
+        return self.band_offset[band] + np.minimum(col, cols - 1)
+
+    def bounds(self, tile):
+        band = int(np.searchsorted(self.band_offset, tile, side='right') - 1)
+        col = tile - self.band_offset[band]
+        lon_step = 360.0 / self.num_cols[band]
+        lat_lo = -90.0 + band * self.lat_step
+        lon_lo = -180.0 + col * lon_step
+        return lat_lo, min(lat_lo + self.lat_step, 90.0), lon_lo, lon_step
+
+    def halo_members(self, tile, lats, lons, halo_km, lat_order):
+        # Points du cœur + halo (sur-ensemble conservateur des points à moins de
+        # halo_km de la tuile), triés par indice global
+        lat_lo, lat_hi, lon_lo, lon_step = self.bounds(tile)
+        halo_deg = halo_km / KM_PER_DEG
+        lo, hi = lat_lo - halo_deg, lat_hi + halo_deg
+        start = np.searchsorted(lats[lat_order], lo, side='left')
+        end = np.searchsorted(lats[lat_order], hi, side='right')
+        candidates = lat_order[start:end]
+        max_abs = max(abs(lo), abs(hi))
+        if max_abs < 90.0:
+            lon_halo = halo_deg / np.cos(np.radians(max_abs))
+            if lon_step + 2 * lon_halo < 360.0:
+                dlon = (lons[candidates] - (lon_lo - lon_halo)) % 360.0
+                candidates = candidates[dlon <= lon_step + 2 * lon_halo]
+        return np.sort(candidates)
+
+
+def cluster_points(algorithm, lats, lons, pirs, max_pir, radius_km, precomputed=False, backend="balltree",
+                   memory_mb=256):
+    # Clustering d'un sous-ensemble de points avec l'algorithme demandé.
+    # backend : recherche des voisins (neighbors.NEIGHBOR_BACKENDS) ; le KD-tree ne
+    # sert qu'au graphe creux, il implique precomputed pour DBSCAN/OPTICS.
+    # memory_mb : budget des lots de construction du graphe de voisinage.
+    if len(pirs) < 2:
+        return np.zeros(len(pirs), dtype=np.int64)
+    if algorithm == 'balltree':
+        graph = latlon_radius_graph(lats, lons, radius_km, memory_mb=memory_mb, backend=backend)
+        return assign_clusters(lats, lons, pirs, graph, max_pir, radius_km)
+    coords = np.radians(np.column_stack((lats, lons)))
+    precomputed = precomputed or backend == "kdtree"
+    if algorithm == 'dbscan':
+        labels = dbscan_labels(coords, radius_km, precomputed=precomputed, backend=backend, memory_mb=memory_mb)
+    elif algorithm == 'optics':
+        labels = optics_labels(coords, precomputed=precomputed, radius_km=radius_km, backend=backend,
+                               memory_mb=memory_mb)
+    else:
+        raise ValueError(f"Algorithme inconnu: {algorithm}")
+    return enforce_constraints(labels, coords, pirs, max_pir, radius_km)
+
+
+def cluster_ok(algorithm, lats, lons, pirs, max_pir, radius_km):
+    # BallTree : rayon autour du centroïde ; DBSCAN/OPTICS : diamètre.
+    # Un cluster d'un seul point est toujours valide (exempté du PIR).
+    if len(pirs) <= 1:
+        return True
+    if pirs.sum() > max_pir:
+        return False
+    if algorithm == 'balltree':
+        return centroid_radius_km(lats, lons) <= radius_km
+    return diameter_within(np.radians(lats), np.radians(lons), radius_km)
+
+
+_state = {}
+
+
+def _init_worker(grid, lats, lons, pirs, lat_order, algorithm, max_pir, radius_km, precomputed, backend):
+    _state.update(grid=grid, lats=lats, lons=lons, pirs=pirs, lat_order=lat_order, algorithm=algorithm,
+                  max_pir=max_pir, radius_km=radius_km, precomputed=precomputed, backend=backend)
+
+
+def _cluster_tile(tile):
+    s = _state
+    members = s['grid'].halo_members(tile, s['lats'], s['lons'], 2 * s['radius_km'], s['lat_order'])
+    lats, lons = s['lats'][members], s['lons'][members]
+    labels = cluster_points(s['algorithm'], lats, lons, s['pirs'][members], s['max_pir'], s['radius_km'],
+                            s['precomputed'], s['backend'])
+
+    # Propriété : on garde les clusters dont le centroïde est dans le cœur de la tuile
+    order = np.argsort(labels, kind='stable')
+    cuts = np.flatnonzero(np.diff(labels[order])) + 1
+    kept = []
+    for group in np.split(order, cuts):
+        c_lat = lats[group].astype(np.float64).mean()
+        c_lon = lons[group].astype(np.float64).mean()
+        if s['grid'].tile_of(c_lat, c_lon) == tile:
+            kept.append(members[group])
+    return kept
+
+
+def cluster_tiles(lats, lons, pirs, algorithm, max_pir, radius_km, tile_km,
+                  workers=1, first_label=0, progress=None, precomputed=False, backend="balltree"):
+    lats = np.asarray(lats)
+    lons = np.asarray(lons)
+    pirs = np.asarray(pirs)
+    num_points = len(pirs)
+    grid = TileGrid(tile_km)
+    point_tile = grid.tile_of(lats, lons)
+    tiles = np.unique(point_tile)
+    lat_order = np.argsort(lats, kind='stable')
+
+    initargs = (grid, lats, lons, pirs, lat_order, algorithm, max_pir, radius_km, precomputed, backend)
+    clusters = []
+    cluster_tile = []
+    if workers <= 1:
+        _init_worker(*initargs)
+        results = map(_cluster_tile, tiles)
+    else:
+        executor = process_pool(workers, _init_worker, initargs)
+        results = executor.map(_cluster_tile, tiles)
+    try:
+        for done, (tile, kept) in enumerate(zip(tiles, results), start=1):
+            clusters.extend(kept)
+            cluster_tile.extend([tile] * len(kept))
+            if progress is not None:
+                progress(done, len(tiles))
+    finally:
+        if workers > 1:
+            executor.shutdown()
+        _state.clear()
+
+    # Résolution des points revendiqués plusieurs fois : priorité à la tuile
+    # qui contient le point, puis à l'ordre (tuile, cluster)
+    winner = np.full(num_points, -1, dtype=np.int64)
+    if clusters:
+        sizes = np.array([len(c) for c in clusters])
+        claim_points = np.concatenate(clusters)
+        claim_cluster = np.repeat(np.arange(len(clusters)), sizes)
+        foreign = point_tile[claim_points] != np.repeat(np.array(cluster_tile), sizes)
+        order = np.lexsort((claim_cluster, foreign, claim_points))
+        claim_points, claim_cluster = claim_points[order], claim_cluster[order]
+        first = np.concatenate(([True], claim_points[1:] != claim_points[:-1]))
+        winner[claim_points[first]] = claim_cluster[first]
+
+    labels = np.full(num_points, -1, dtype=np.int64)
+    next_label = first_label
+    for k, cluster in enumerate(clusters):
+        members = cluster[winner[cluster] == k]
+        if len(members) == 0:
+            continue
+        if len(members) < len(cluster) and not cluster_ok(algorithm, lats[members], lons[members],
+                                                          pirs[members], max_pir, radius_km):
+            continue  # cluster amputé devenu invalide : ses points repartent en passe finale
+        labels[members] = next_label
+        next_label += 1
+
+    # Passe finale (globale, séquentielle) sur les points orphelins
+    orphans = np.flatnonzero(labels == -1)
+    if len(orphans):
+        sub = cluster_points(algorithm, lats[orphans], lons[orphans], pirs[orphans], max_pir, radius_km,
+                             precomputed, backend=backend)
+        _, sub = np.unique(sub, return_inverse=True)
+        labels[orphans] = next_label + sub
+    return labels
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from geo import EARTH_RADIUS_KM, haversine_km, min_enclosing_cap, to_unit_vectors
+
+
+def cluster_summary(labels, lats, lons, pirs):
+    # Statistiques par cluster en passes vectorisées (tri + opérations par segment) :
+    # nombre de points, PIR total, centroïde (moyenne LAT/LON) et rayon max au centroïde
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    cluster_ids, starts = np.unique(sorted_labels, return_index=True)
+    counts = np.diff(np.append(starts, len(labels)))
+
+    lats = np.asarray(lats, dtype=np.float64)[order]
+    lons = np.asarray(lons, dtype=np.float64)[order]
+    pirs = np.asarray(pirs, dtype=np.float64)[order]
+    centroid_lat = np.add.reduceat(lats, starts) / counts
+    centroid_lon = np.add.reduceat(lons, starts) / counts
+    dists = haversine_km(np.repeat(centroid_lat, counts), np.repeat(centroid_lon, counts), lats, lons)
+
+    summary = pd.DataFrame({
+        'cluster_id': cluster_ids,
+        'points_count': counts,
+        'radius_km': np.maximum.reduceat(dists, starts),
+        'pir_total': np.add.reduceat(pirs, starts),
+        'centroid_lat': centroid_lat,
+        'centroid_lon': centroid_lon,
+    })
+    return summary, order, starts
+
+
+def min_enclosing_radius_km(lats, lons, order, starts):
+    # Rayon exact de la plus petite calotte englobante de chaque cluster
+    xyz = to_unit_vectors(np.asarray(lats)[order], np.asarray(lons)[order])
+    bounds = np.append(starts, len(order))
+    radii = np.empty(len(starts))
+    for k in range(len(starts)):
+        radii[k] = min_enclosing_cap(xyz[bounds[k]:bounds[k + 1]])[1] * EARTH_RADIUS_KM
+    return radii